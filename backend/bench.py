@@ -0,0 +1,526 @@
+"""бенчмарки бекенда на живой бд
+
+запуск из папки backend:
+    python bench.py upsert --tables 20 200 2000 --repeat 50
+    python bench.py broadcast --clients 1000 5000 --slow-ratio 0.01
+    python bench.py history --rows 10000000
+    python bench.py ingest --tables 20 500
+
+для upsert и history таблицы создаются во временной схеме и удаляются после прогона
+broadcast и ingest работают без бд
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+# отдельная схема чтобы не трогать рабочие таблицы
+BENCH_SCHEMA = os.getenv("BENCH_SCHEMA", "dining_bench")
+os.environ["PGOPTIONS"] = f"-c search_path={BENCH_SCHEMA}"
+
+import psycopg2  # noqa: E402
+import psycopg2.extensions  # noqa: E402
+
+import db  # noqa: E402
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        self.connection.round_trips += 1
+        return super().execute(query, vars)
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    # считаем запросы и коммиты как обмены с сервером
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.round_trips = 0
+
+    def cursor(self, *args, **kwargs):
+        kwargs.setdefault("cursor_factory", CountingCursor)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        self.round_trips += 1
+        return super().commit()
+
+
+def _open_counting_connection():
+    return psycopg2.connect(
+        dbname=db.DB_NAME,
+        user=db.DB_USER,
+        password=db.DB_PASSWORD,
+        host=db.DB_HOST,
+        port=db.DB_PORT,
+        connection_factory=CountingConnection,
+    )
+
+
+def legacy_update_detailed_tables_status(occupancy_list, table_capacity):
+    """старый вариант по строке на стол"""
+    conn = db.connect_db()
+    cursor = conn.cursor()
+    try:
+        adjusted = db.redistribute_overflow_in_columns(occupancy_list, table_capacity)
+        total_occupied = sum(adjusted)
+        free_seats = max(0, len(adjusted) * table_capacity - total_occupied)
+        for idx, occupied in enumerate(adjusted):
+            cursor.execute("""
+                INSERT INTO table_status (id, occupied_seats)
+                VALUES (%s, %s)
+                ON CONFLICT (id) DO UPDATE
+                SET occupied_seats = EXCLUDED.occupied_seats
+            """, (idx + 1, occupied))
+        cursor.execute("""
+            UPDATE current_status SET people_inside = %s, free_tables = %s, last_update = NOW()
+            WHERE id = 1
+        """, (total_occupied, free_seats))
+        cursor.execute("""
+            INSERT INTO visit_history(
+                timestamp, entered, exited, people_inside, occupied_tables, free_tables
+            )
+            VALUES (NOW(), %s, %s, %s, %s, %s)
+        """, (0, 0, total_occupied, sum(1 for v in adjusted if v > 0), free_seats))
+        conn.commit()
+        return True
+    finally:
+        cursor.close()
+        db.release_db(conn)
+
+
+def _setup_schema():
+    conn = _open_counting_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {BENCH_SCHEMA}")
+        conn.commit()
+    finally:
+        conn.close()
+    db.init_db()
+
+
+def _drop_schema():
+    conn = _open_counting_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _occupancy(n_tables, step, changed_ratio):
+    # меняется только часть столов
+    n_changed = max(1, int(n_tables * changed_ratio))
+    values = [0] * n_tables
+    for i in range(n_changed):
+        values[(step * n_changed + i) % n_tables] = 1 + (step % 3)
+    return values
+
+
+def _measure(update_fn, n_tables, repeat, changed_ratio):
+    latencies = []
+    trips = []
+    for step in range(repeat):
+        occupancy = _occupancy(n_tables, step, changed_ratio)
+        conn = db.connect_db()
+        before = conn.round_trips
+        db.release_db(conn)
+
+        started = time.perf_counter()
+        ok = update_fn(occupancy, db.DEFAULT_TABLE_CAPACITY)
+        latencies.append((time.perf_counter() - started) * 1000.0)
+        if not ok:
+            raise RuntimeError("update failed")
+
+        conn = db.connect_db()
+        trips.append(conn.round_trips - before)
+        db.release_db(conn)
+    return trips, latencies
+
+
+def bench_upsert(tables, repeat, changed_ratio):
+    # один коннект чтобы считать обмены
+    db.DB_POOL_MIN = 1
+    db.DB_POOL_MAX = 1
+    db._open_connection = _open_counting_connection
+    _setup_schema()
+    try:
+        print(f"{'tables':>7} | {'impl':<8} | {'round trips':>11} | {'p50 ms':>8} | {'p99 ms':>8}")
+        print("-" * 56)
+        for n_tables in tables:
+            for name, fn in (
+                ("legacy", legacy_update_detailed_tables_status),
+                ("batched", db.update_detailed_tables_status),
+            ):
+                # прогрев и заполнение строк столов
+                fn([0] * n_tables, db.DEFAULT_TABLE_CAPACITY)
+                trips, latencies = _measure(fn, n_tables, repeat, changed_ratio)
+                latencies.sort()
+                p99 = latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))]
+                print(
+                    f"{n_tables:>7} | {name:<8} | {statistics.mean(trips):>11.1f} | "
+                    f"{statistics.median(latencies):>8.2f} | {p99:>8.2f}"
+                )
+    finally:
+        db.close_pool()
+        _drop_schema()
+
+
+def _fill_history(rows, days):
+    # равномерная синтетическая история за days дней
+    conn = db.connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("TRUNCATE visit_history, visit_history_hourly")
+        cursor.execute(
+            """
+            INSERT INTO visit_history(
+                timestamp, entered, exited, people_inside, occupied_tables, free_tables
+            )
+            SELECT
+                NOW() - (%s || ' days')::interval * (g::float8 / %s),
+                0, 0, (g %% 55), (g %% 19), 60 - (g %% 55)
+            FROM generate_series(1, %s) AS g
+            """,
+            (days, rows, rows),
+        )
+        cursor.execute(db.ROLLUP_BACKFILL_SQL)
+        cursor.execute("ANALYZE visit_history")
+        cursor.execute("ANALYZE visit_history_hourly")
+        conn.commit()
+        cursor.close()
+    finally:
+        db.release_db(conn)
+
+
+def _timed_query(sql, params, repeat):
+    conn = db.connect_db()
+    try:
+        cursor = conn.cursor()
+        latencies = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            cursor.execute(sql, params)
+            cursor.fetchall()
+            latencies.append((time.perf_counter() - started) * 1000.0)
+        cursor.close()
+        conn.rollback()
+        return statistics.median(latencies)
+    finally:
+        db.release_db(conn)
+
+
+def _timed_call(fn, repeat):
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - started) * 1000.0)
+    return statistics.median(latencies)
+
+
+def _legacy_weekly_python(days_back):
+    """старый вариант сырые строки в питон"""
+    conn = db.connect_db()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT timestamp, people_inside
+            FROM visit_history
+            WHERE timestamp >= NOW() - (%s || ' days')::interval
+            """,
+            (days_back,),
+        )
+        buckets = {}
+        for ts, people_inside in cursor.fetchall():
+            if ts.weekday() > 5 or ts.hour < 9 or ts.hour > 16:
+                continue
+            buckets.setdefault((ts.weekday(), ts.hour), []).append(int(people_inside))
+        cursor.close()
+        return buckets
+    finally:
+        db.release_db(conn)
+
+
+RAW_WEEKLY_GROUP_BY_SQL = """
+    SELECT EXTRACT(ISODOW FROM timestamp)::int - 1, EXTRACT(HOUR FROM timestamp)::int,
+           SUM(people_inside), COUNT(*)
+    FROM visit_history
+    WHERE timestamp >= NOW() - (%s || ' days')::interval
+    AND EXTRACT(ISODOW FROM timestamp) <= 6
+    AND EXTRACT(HOUR FROM timestamp) BETWEEN 9 AND 16
+    GROUP BY 1, 2
+"""
+
+LEGACY_DAILY_SQL = """
+    SELECT SUM(entered), SUM(exited), MAX(people_inside), MIN(people_inside), AVG(people_inside)
+    FROM visit_history
+    WHERE DATE(timestamp) = %s
+"""
+
+
+def bench_history(rows, days, days_back, repeat, skip_legacy):
+    db._open_connection = _open_counting_connection
+    _setup_schema()
+    try:
+        print(f"filling {rows} rows over {days} days...")
+        started = time.perf_counter()
+        _fill_history(rows, days)
+        print(f"filled in {time.perf_counter() - started:.1f}s")
+
+        day = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+        results = []
+        if not skip_legacy:
+            results.append(("weekly: raw rows + python", _timed_call(lambda: _legacy_weekly_python(days_back), 1)))
+        results.append(("weekly: raw GROUP BY", _timed_query(RAW_WEEKLY_GROUP_BY_SQL, (days_back,), repeat)))
+        results.append((
+            "weekly: rollup GROUP BY",
+            _timed_call(lambda: db.get_weekday_hourly_occupancy(days_back, 9, 16), repeat),
+        ))
+        results.append(("daily: DATE(timestamp) = day", _timed_query(LEGACY_DAILY_SQL, (day,), repeat)))
+        results.append(("daily: timestamp range + index", _timed_call(lambda: db.get_daily_stats(day), repeat)))
+
+        print(f"{'query':<34} | {'p50 ms':>10}")
+        print("-" * 48)
+        for name, ms in results:
+            print(f"{name:<34} | {ms:>10.1f}")
+    finally:
+        db.close_pool()
+        _drop_schema()
+
+
+class SimulatedWebSocket:
+    # клиент с сетевой задержкой отправки
+    def __init__(self, delay_seconds):
+        self.delay_seconds = delay_seconds
+        self.received = 0
+        self.last_received_at = 0.0
+
+    async def send_text(self, data):
+        await asyncio.sleep(self.delay_seconds)
+        self.received += 1
+        self.last_received_at = time.perf_counter()
+
+    async def close(self, code=1000):
+        pass
+
+
+def _simulated_clients(n_clients, slow_ratio, rng):
+    clients = []
+    for _ in range(n_clients):
+        if rng.random() < slow_ratio:
+            # клиент на плохом wifi
+            clients.append(SimulatedWebSocket(rng.uniform(3.0, 10.0)))
+        else:
+            clients.append(SimulatedWebSocket(rng.uniform(0.0005, 0.005)))
+    return clients
+
+
+async def _legacy_broadcast(connections, data):
+    """старая последовательная рассылка"""
+    for connection in connections:
+        await connection.send_text(data)
+
+
+def _status_payload(n_tables, step):
+    tables = [
+        db.table_status_entry(i + 1, (i + step) % 4, db.DEFAULT_TABLE_CAPACITY)
+        for i in range(n_tables)
+    ]
+    return {
+        "overall_inside": sum(t["occupied"] for t in tables),
+        "total_capacity": n_tables * db.DEFAULT_TABLE_CAPACITY,
+        "tables": tables,
+        "last_update": "2025-12-16 12:34:56",
+    }
+
+
+async def _wait_delivered(clients, expected, deadline_seconds):
+    # ждем пока быстрые клиенты получат кадр
+    deadline = time.perf_counter() + deadline_seconds
+    while time.perf_counter() < deadline:
+        if all(c.received >= expected for c in clients):
+            return
+        await asyncio.sleep(0.001)
+
+
+async def _bench_broadcast_once(n_clients, slow_ratio, duration, interval, legacy):
+    import main
+
+    rng = random.Random(42)
+    manager = main.ConnectionManager()
+    clients = _simulated_clients(n_clients, slow_ratio, rng)
+    fast_clients = [c for c in clients if c.delay_seconds < 1.0]
+    if legacy:
+        connections = list(clients)
+    else:
+        for client in clients:
+            manager.register(client)
+
+    latencies = []
+    # задержка быстрых клиентов пока медленные отваливаются по таймауту
+    evicting_latencies = []
+    encode_ms = []
+    evictions_seen = 0
+    run_started = time.perf_counter()
+    step = 0
+    # дольше таймаута отправки, иначе медленных никто не отключит
+    while step == 0 or time.perf_counter() - run_started < duration:
+        payload = _status_payload(db.TOTAL_TABLES, step)
+        started = time.perf_counter()
+        data = main.encode_status(payload)
+        encoded_at = time.perf_counter()
+        if legacy:
+            await _legacy_broadcast(connections, data)
+        else:
+            await manager.broadcast(data)
+            await _wait_delivered(fast_clients, step + 1, deadline_seconds=30.0)
+        # время до последнего быстрого клиента
+        finished = max(c.last_received_at for c in fast_clients)
+        encode_ms.append((encoded_at - started) * 1000.0)
+        latencies.append((finished - started) * 1000.0)
+        if manager.evictions > evictions_seen:
+            evictions_seen = manager.evictions
+            evicting_latencies.append(latencies[-1])
+        step += 1
+        await asyncio.sleep(max(0.0, interval - (time.perf_counter() - started)))
+
+    # дожидаемся закрытия отключенных
+    await asyncio.sleep(0)
+    alive = n_clients if legacy else len(manager.active_connections)
+    for client in list(manager.active_connections):
+        manager.disconnect(client)
+    return {
+        "latencies": latencies,
+        "evicting_latencies": evicting_latencies,
+        "encode_ms": encode_ms,
+        "slow": n_clients - len(fast_clients),
+        "alive": alive,
+        "stats": manager.stats(),
+    }
+
+
+def bench_broadcast(clients, slow_ratio, duration, interval, legacy_max_clients):
+    import main
+
+    if duration is None:
+        duration = main.WS_SEND_TIMEOUT_SECONDS + 3.0
+    encoder = "orjson" if main.orjson is not None else "json"
+    print(
+        f"encoder: {encoder}, send timeout: {main.WS_SEND_TIMEOUT_SECONDS}s, slow ratio: {slow_ratio}, "
+        f"duration: {duration}s, interval: {interval}s"
+    )
+    print(
+        f"{'clients':>7} | {'impl':<10} | {'frames':>6} | {'encode ms':>9} | {'p50 ms':>9} | {'max ms':>9} | "
+        f"{'evict max':>9} | {'slow':>5} | {'evicted':>7} | {'alive':>6} | {'dropped':>7}"
+    )
+    print("-" * 110)
+    for n_clients in clients:
+        impls = [("queued", False)]
+        if n_clients <= legacy_max_clients:
+            impls.insert(0, ("sequential", True))
+        for name, legacy in impls:
+            run = asyncio.run(_bench_broadcast_once(n_clients, slow_ratio, duration, interval, legacy))
+            latencies, stats = run["latencies"], run["stats"]
+            # быстрые клиенты в шагах, где шли отключения
+            evicting = f"{max(run['evicting_latencies']):>9.1f}" if run["evicting_latencies"] else f"{'-':>9}"
+            print(
+                f"{n_clients:>7} | {name:<10} | {len(latencies):>6} | {statistics.mean(run['encode_ms']):>9.3f} | "
+                f"{statistics.median(latencies):>9.1f} | {max(latencies):>9.1f} | {evicting} | "
+                f"{run['slow']:>5} | {stats['evictions']:>7} | {run['alive']:>6} | {stats['frames_dropped']:>7}"
+            )
+
+
+def bench_ingest(tables, repeat):
+    # разбор тела обновления мл и весь маршрут с заглушкой бд
+    from fastapi.testclient import TestClient
+
+    import main
+    from models import OccupancyUpdate, decode_occupancy_frame, encode_occupancy_frame
+
+    main.update_detailed_tables_status = lambda occupancy_list, table_capacity, captured_ts=None: True
+    main.get_detailed_status = lambda table_capacity: None
+    client = TestClient(main.app)
+    rng = random.Random(0)
+
+    print(f"{'tables':>6} | {'format':<6} | {'body bytes':>10} | {'parse us':>9} | {'request us':>10}")
+    print("-" * 55)
+    for n_tables in tables:
+        occupancy = [rng.randint(0, 3) for _ in range(n_tables)]
+        # так же как requests.post(json=...)
+        json_body = json.dumps({"table_occupancy": occupancy, "camera_id": "hall1", "first_table_id": 1}).encode()
+        bin_body = encode_occupancy_frame(occupancy, seq=1, captured_ts=time.time(), camera_id="hall1")
+        assert decode_occupancy_frame(bin_body).table_occupancy == occupancy
+
+        rows = [
+            (
+                "json",
+                json_body,
+                # fastapi сначала json.loads потом модель
+                lambda: OccupancyUpdate.model_validate(json.loads(json_body)),
+                lambda: client.post("/api/tables/update", content=json_body, headers={"Content-Type": "application/json"}),
+            ),
+            (
+                "binary",
+                bin_body,
+                lambda: decode_occupancy_frame(bin_body),
+                lambda: client.post(
+                    "/api/tables/update/bin", content=bin_body, headers={"Content-Type": "application/x-occupancy"}
+                ),
+            ),
+        ]
+        for name, body, parse, route in rows:
+            parse_us = _timed_call(parse, repeat) * 1000.0
+            route_us = _timed_call(route, max(1, repeat // 10)) * 1000.0
+            print(f"{n_tables:>6} | {name:<6} | {len(body):>10} | {parse_us:>9.1f} | {route_us:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="backend benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_upsert = sub.add_parser("upsert", help="ml update write path")
+    p_upsert.add_argument("--tables", type=int, nargs="+", default=[20, 200, 2000])
+    p_upsert.add_argument("--repeat", type=int, default=50)
+    p_upsert.add_argument("--changed-ratio", type=float, default=0.1)
+
+    p_broadcast = sub.add_parser("broadcast", help="websocket fan-out")
+    p_broadcast.add_argument("--clients", type=int, nargs="+", default=[1000, 5000])
+    p_broadcast.add_argument("--slow-ratio", type=float, default=0.01)
+    # по умолчанию таймаут отправки плюс 3 сек
+    p_broadcast.add_argument("--duration", type=float, default=None)
+    p_broadcast.add_argument("--interval", type=float, default=0.5)
+    # старая рассылка слишком долгая на многих клиентах
+    p_broadcast.add_argument("--legacy-max-clients", type=int, default=1000)
+
+    p_history = sub.add_parser("history", help="stats queries over synthetic history")
+    p_history.add_argument("--rows", type=int, default=10_000_000)
+    p_history.add_argument("--days", type=int, default=90)
+    p_history.add_argument("--days-back", type=int, default=30)
+    p_history.add_argument("--repeat", type=int, default=5)
+    p_history.add_argument("--skip-legacy", action="store_true")
+
+    p_ingest = sub.add_parser("ingest", help="ml update json vs binary frame")
+    p_ingest.add_argument("--tables", type=int, nargs="+", default=[20, 500])
+    p_ingest.add_argument("--repeat", type=int, default=2000)
+
+    args = parser.parse_args()
+    if args.command == "upsert":
+        bench_upsert(args.tables, args.repeat, args.changed_ratio)
+    elif args.command == "broadcast":
+        bench_broadcast(args.clients, args.slow_ratio, args.duration, args.interval, args.legacy_max_clients)
+    elif args.command == "history":
+        bench_history(args.rows, args.days, args.days_back, args.repeat, args.skip_legacy)
+    elif args.command == "ingest":
+        bench_ingest(args.tables, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,18 @@
+-- разделы по месяцам создает backend (init_db и ночная задача)
 CREATE TABLE IF NOT EXISTS visit_history (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     timestamp TIMESTAMP NOT NULL DEFAULT NOW(),
     entered INT NOT NULL,
     exited INT NOT NULL,
     people_inside INT NOT NULL,
     occupied_tables INT NOT NULL,
-    free_tables INT NOT NULL
-);
+    free_tables INT NOT NULL,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+CREATE TABLE IF NOT EXISTS visit_history_default PARTITION OF visit_history DEFAULT;
+
+CREATE INDEX IF NOT EXISTS idx_visit_history_timestamp ON visit_history (timestamp);
 
 CREATE TABLE IF NOT EXISTS daily_reports (
     date DATE PRIMARY KEY,
@@ -14,4 +20,12 @@ CREATE TABLE IF NOT EXISTS daily_reports (
     exited_total INT NOT NULL,
     max_inside INT NOT NULL,
     min_inside INT NOT NULL
-);
\ No newline at end of file
+);
+
+CREATE TABLE IF NOT EXISTS visit_history_hourly (
+    bucket TIMESTAMP PRIMARY KEY,
+    samples INT NOT NULL,
+    people_sum BIGINT NOT NULL,
+    people_min INT NOT NULL,
+    people_max INT NOT NULL
+);
@@ -1,7 +1,12 @@
 import psycopg2
-from datetime import datetime
-from typing import List, Dict, Any
+from datetime import date, datetime
+from typing import List, Dict, Any, Optional, Tuple
+import io
+import json
 import os
+import re
+import threading
+import time
 
 # конфигурация подключения постгрес тут
 DB_NAME = os.getenv("POSTGRES_DB", "stolovka_db")
@@ -10,6 +15,26 @@ DB_PASSWORD = os.getenv("POSTGRES_PASSWORD", "password")
 DB_HOST = os.getenv("POSTGRES_HOST", "localhost")
 DB_PORT = os.getenv("POSTGRES_PORT", "5432")
 
+# настройки пула соединений тут
+DB_POOL_MIN = max(0, int(os.getenv("DB_POOL_MIN", "1")))
+DB_POOL_MAX = max(1, int(os.getenv("DB_POOL_MAX", "10")))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "2.0"))
+# проверка соединения после простоя
+DB_POOL_HEALTHCHECK_IDLE_SECONDS = float(os.getenv("DB_POOL_HEALTHCHECK_IDLE_SECONDS", "30"))
+
+# хранение истории по месяцам
+HISTORY_RETENTION_MONTHS = max(1, int(os.getenv("HISTORY_RETENTION_MONTHS", "12")))
+HISTORY_PARTITIONS_AHEAD = max(1, int(os.getenv("HISTORY_PARTITIONS_AHEAD", "2")))
+# старые разделы отсоединяем а не удаляем
+HISTORY_ARCHIVE_OLD = os.getenv("HISTORY_ARCHIVE_OLD", "0") in ("1", "true", "True", "yes", "YES")
+
+# буфер отложенной записи истории
+HISTORY_FLUSH_SECONDS = float(os.getenv("HISTORY_FLUSH_SECONDS", "5"))
+HISTORY_FLUSH_ROWS = max(1, int(os.getenv("HISTORY_FLUSH_ROWS", "500")))
+HISTORY_BUFFER_MAX_ROWS = max(1, int(os.getenv("HISTORY_BUFFER_MAX_ROWS", "50000")))
+# файл для замеров не записанных в бд
+HISTORY_SPILL_PATH = os.getenv("HISTORY_SPILL_PATH", "history_spill.jsonl")
+
 # константы проекта для расчетов
 DEFAULT_TABLE_CAPACITY = 3
 TOTAL_TABLES = 20  # общее число столов в базе
@@ -77,17 +102,236 @@ def redistribute_overflow_in_columns(occupancy_list: List[int], table_capacity:
 
 # утилиты работы с бд тут
 
+class PoolTimeout(Exception):
+    """нет свободного соединения за таймаут"""
+
+
+class ConnectionPool:
+    """ограниченный пул соединений с проверкой здоровья"""
+
+    def __init__(
+        self,
+        connect_fn,
+        minconn: int,
+        maxconn: int,
+        timeout_seconds: float,
+        healthcheck_idle_seconds: float,
+    ):
+        self._connect_fn = connect_fn
+        self.maxconn = max(1, int(maxconn))
+        self.timeout_seconds = float(timeout_seconds)
+        self.healthcheck_idle_seconds = float(healthcheck_idle_seconds)
+
+        self._slots = threading.BoundedSemaphore(self.maxconn)
+        self._lock = threading.Lock()
+        # простаивающие соединения и время возврата
+        self._idle: List[tuple] = []
+        self._closed = False
+
+        # счетчики для метрик пула
+        self.in_use = 0
+        self.created = 0
+        self.discarded = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+        for _ in range(min(max(0, int(minconn)), self.maxconn)):
+            conn = self._connect_fn()
+            self.created += 1
+            self._idle.append((conn, time.monotonic()))
+
+    def _is_healthy(self, conn, released_at: float) -> bool:
+        if conn.closed:
+            return False
+        if (time.monotonic() - released_at) < self.healthcheck_idle_seconds:
+            return True
+        # долго простаивало проверяем запросом
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+            finally:
+                cursor.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn) -> None:
+        with self._lock:
+            self.discarded += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                item = self._idle.pop() if self._idle else None
+            if item is None:
+                conn = self._connect_fn()
+                with self._lock:
+                    self.created += 1
+                return conn
+            conn, released_at = item
+            if self._is_healthy(conn, released_at):
+                return conn
+            self._discard(conn)
+
+    def acquire(self):
+        """берем соединение или ждем до таймаута"""
+        if self._closed:
+            raise PoolTimeout("pool is closed")
+
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout_seconds):
+            with self._lock:
+                self.timeouts += 1
+            raise PoolTimeout(
+                f"no free connection in {self.timeout_seconds:.1f}s (max {self.maxconn})"
+            )
+        waited = time.monotonic() - started
+
+        try:
+            conn = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self.in_use += 1
+            self.acquired += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        return conn
+
+    def release(self, conn) -> None:
+        """возвращаем соединение в пул"""
+        keep = not self._closed and not conn.closed
+        if keep:
+            # сбрасываем незавершенную транзакцию
+            try:
+                conn.rollback()
+            except Exception:
+                keep = False
+
+        if keep:
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        else:
+            self._discard(conn)
+
+        with self._lock:
+            self.in_use = max(0, self.in_use - 1)
+        self._slots.release()
+
+    def close(self) -> None:
+        """закрываем простаивающие соединения"""
+        with self._lock:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle = []
+        for conn in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_size": self.maxconn,
+                "in_use": self.in_use,
+                "idle": len(self._idle),
+                "created": self.created,
+                "discarded": self.discarded,
+                "acquired": self.acquired,
+                "timeouts": self.timeouts,
+                "wait_ms_avg": round(1000.0 * self.wait_seconds_total / self.acquired, 3)
+                if self.acquired
+                else 0.0,
+                "wait_ms_max": round(1000.0 * self.wait_seconds_max, 3),
+            }
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+# после close_pool запросы не поднимают пул заново
+_pool_closed = False
+
+
+def _open_connection():
+    return psycopg2.connect(
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        host=DB_HOST,
+        port=DB_PORT
+    )
+
+
+def init_pool(lazy: bool = False) -> bool:
+    """создаем общий пул соединений, lazy из connect_db до явного init"""
+    global _pool, _pool_closed
+    with _pool_lock:
+        if _pool is not None:
+            return True
+        if lazy and _pool_closed:
+            return False
+        _pool_closed = False
+        try:
+            _pool = ConnectionPool(
+                _open_connection,
+                minconn=DB_POOL_MIN,
+                maxconn=DB_POOL_MAX,
+                timeout_seconds=DB_POOL_TIMEOUT_SECONDS,
+                healthcheck_idle_seconds=DB_POOL_HEALTHCHECK_IDLE_SECONDS,
+            )
+        except psycopg2.OperationalError as e:
+            print(
+                f"ERROR: Failed to create PostgreSQL pool at {DB_HOST}:{DB_PORT}. "
+                f"Check server status and credentials. DETAILS: {e}"
+            )
+            return False
+        print(f"INFO: PostgreSQL pool ready (min={DB_POOL_MIN}, max={DB_POOL_MAX}).")
+        return True
+
+
+def close_pool() -> None:
+    """закрываем пул при остановке"""
+    global _pool, _pool_closed
+    with _pool_lock:
+        pool, _pool = _pool, None
+        _pool_closed = True
+    if pool is not None:
+        pool.close()
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """метрики занятости пула"""
+    pool = _pool
+    if pool is None:
+        return {"enabled": False}
+    return {"enabled": True, **pool.stats()}
+
+
 def connect_db():
-    """подключаемся к постгрес базе"""
+    """берем соединение из пула постгрес"""
+    # при остановке пул уже закрыт, новый бы утек
+    if _pool is None and not init_pool(lazy=True):
+        return None
+    pool = _pool
+    if pool is None:
+        return None
     try:
-        conn = psycopg2.connect(
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            host=DB_HOST,
-            port=DB_PORT
-        )
-        return conn
+        return pool.acquire()
+    except PoolTimeout as e:
+        print(f"ERROR: PostgreSQL pool exhausted: {e}")
+        return None
     except psycopg2.OperationalError as e:
         # логируем ошибку без выхода
         print(
@@ -99,8 +343,217 @@ def connect_db():
         print(f"Error connecting to DB: {e}")
         return None
 
+
+def release_db(conn) -> None:
+    """возвращаем соединение в пул"""
+    pool = _pool
+    if pool is not None:
+        pool.release(conn)
+    else:
+        conn.close()
+
 # инициализация таблиц базы данных
 
+# история разбита на разделы по месяцам
+VISIT_HISTORY_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS visit_history (
+        id SERIAL,
+        timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        entered INTEGER NOT NULL,
+        exited INTEGER NOT NULL,
+        people_inside INTEGER NOT NULL,
+        occupied_tables INTEGER NOT NULL,
+        free_tables INTEGER NOT NULL,
+        PRIMARY KEY (id, timestamp)
+    ) PARTITION BY RANGE (timestamp)
+"""
+
+_PARTITION_NAME_RE = re.compile(r"^visit_history_p(\d{4})_(\d{2})$")
+
+
+def _add_months(month: date, n: int) -> date:
+    idx = month.year * 12 + (month.month - 1) + n
+    return date(idx // 12, idx % 12 + 1, 1)
+
+
+def _partition_name(month: date) -> str:
+    return f"visit_history_p{month.year:04d}_{month.month:02d}"
+
+
+def _partition_month(name: str) -> Optional[date]:
+    match = _PARTITION_NAME_RE.match(name)
+    if not match:
+        return None
+    return date(int(match.group(1)), int(match.group(2)), 1)
+
+
+def plan_history_partitions(
+    existing: List[str],
+    today: date,
+    ahead: int,
+    retention_months: int,
+) -> Tuple[List[date], List[str]]:
+    """какие разделы создать и какие убрать"""
+    current = date(today.year, today.month, 1)
+    existing_months = {_partition_month(name) for name in existing}
+
+    to_create = [
+        _add_months(current, n)
+        for n in range(0, ahead + 1)
+        if _add_months(current, n) not in existing_months
+    ]
+
+    # раздел уходит когда весь месяц старше срока
+    cutoff = _add_months(current, -retention_months)
+    to_drop = sorted(
+        name
+        for name in existing
+        if _partition_month(name) is not None and _add_months(_partition_month(name), 1) <= cutoff
+    )
+    return to_create, to_drop
+
+
+def _create_history_partition(cursor, month: date) -> None:
+    name = _partition_name(month)
+    cursor.execute("SELECT to_regclass(%s)", (name,))
+    if cursor.fetchone()[0] is not None:
+        return
+    # границы из дат без пользовательского ввода
+    start = month.strftime("%Y-%m-%d")
+    end = _add_months(month, 1).strftime("%Y-%m-%d")
+    # строки месяца в запасном разделе не дают создать раздел, выносим на время
+    cursor.execute("CREATE TEMP TABLE visit_history_move (LIKE visit_history)")
+    cursor.execute(
+        "WITH moved AS ("
+        f"DELETE FROM visit_history_default WHERE timestamp >= '{start}' AND timestamp < '{end}' RETURNING *"
+        ") INSERT INTO visit_history_move SELECT * FROM moved"
+    )
+    cursor.execute(
+        f"CREATE TABLE {name} "
+        f"PARTITION OF visit_history FOR VALUES FROM ('{start}') TO ('{end}')"
+    )
+    cursor.execute("INSERT INTO visit_history SELECT * FROM visit_history_move")
+    cursor.execute("DROP TABLE visit_history_move")
+
+
+def _default_history_months(cursor) -> List[date]:
+    """месяцы строк, попавших в запасной раздел"""
+    cursor.execute("SELECT DISTINCT date_trunc('month', timestamp)::date FROM visit_history_default")
+    return sorted(row[0] for row in cursor.fetchall())
+
+
+def _list_history_partitions(cursor) -> List[str]:
+    cursor.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'visit_history'::regclass
+    """)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _init_partitioned_history(cursor) -> None:
+    """создаем историю с разделами и переносим старую"""
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('visit_history')")
+    row = cursor.fetchone()
+    migrate = row is not None and row[0] == "r"
+    if migrate:
+        # старая таблица без разделов переносим данные
+        print("INFO: Migrating visit_history to monthly partitions.")
+        cursor.execute("ALTER TABLE visit_history RENAME TO visit_history_unpartitioned")
+
+    cursor.execute(VISIT_HISTORY_TABLE_SQL)
+    # запасной раздел если плановый не создан
+    cursor.execute("CREATE TABLE IF NOT EXISTS visit_history_default PARTITION OF visit_history DEFAULT")
+
+    today = date.today()
+    first_month = date(today.year, today.month, 1)
+    if migrate:
+        cursor.execute("SELECT MIN(timestamp) FROM visit_history_unpartitioned")
+        oldest = cursor.fetchone()[0]
+        if oldest is not None:
+            first_month = min(first_month, date(oldest.year, oldest.month, 1))
+
+    month = first_month
+    last_month = _add_months(date(today.year, today.month, 1), HISTORY_PARTITIONS_AHEAD)
+    while month <= last_month:
+        _create_history_partition(cursor, month)
+        month = _add_months(month, 1)
+
+    if migrate:
+        cursor.execute("""
+            INSERT INTO visit_history (
+                id, timestamp, entered, exited, people_inside, occupied_tables, free_tables
+            )
+            SELECT id, timestamp, entered, exited, people_inside, occupied_tables, free_tables
+            FROM visit_history_unpartitioned
+        """)
+        cursor.execute("""
+            SELECT setval(
+                pg_get_serial_sequence('visit_history', 'id'),
+                COALESCE((SELECT MAX(id) FROM visit_history), 0) + 1,
+                false
+            )
+        """)
+        cursor.execute("DROP TABLE visit_history_unpartitioned")
+
+
+def maintain_history_partitions() -> bool:
+    """создаем будущие разделы и убираем старые"""
+    conn = connect_db()
+    if conn is None:
+        return False
+
+    cursor = conn.cursor()
+    try:
+        existing = _list_history_partitions(cursor)
+        # запасной раздел не чистится по сроку, его месяцы получают свои разделы
+        stray = [m for m in _default_history_months(cursor) if _partition_name(m) not in existing]
+        for month in stray:
+            _create_history_partition(cursor, month)
+        existing += [_partition_name(m) for m in stray]
+        to_create, to_drop = plan_history_partitions(
+            existing, date.today(), HISTORY_PARTITIONS_AHEAD, HISTORY_RETENTION_MONTHS
+        )
+        for month in to_create:
+            _create_history_partition(cursor, month)
+        for name in to_drop:
+            if HISTORY_ARCHIVE_OLD:
+                # раздел остается отдельной таблицей
+                cursor.execute(f"ALTER TABLE visit_history DETACH PARTITION {name}")
+            else:
+                cursor.execute(f"DROP TABLE {name}")
+        conn.commit()
+        if stray or to_create or to_drop:
+            print(
+                f"INFO: History partitions created: {[_partition_name(m) for m in stray + to_create]}, "
+                f"{'detached' if HISTORY_ARCHIVE_OLD else 'dropped'}: {to_drop}"
+            )
+        return True
+    except Exception as e:
+        print(f"DB Error in maintain_history_partitions: {e}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        release_db(conn)
+
+
+# индекс по времени для выборок истории по дням
+VISIT_HISTORY_INDEX_SQL = """
+    CREATE INDEX IF NOT EXISTS idx_visit_history_timestamp
+    ON visit_history (timestamp)
+"""
+
+ROLLUP_BACKFILL_SQL = """
+    INSERT INTO visit_history_hourly (bucket, samples, people_sum, people_min, people_max)
+    SELECT date_trunc('hour', timestamp), COUNT(*), SUM(people_inside), MIN(people_inside), MAX(people_inside)
+    FROM visit_history
+    GROUP BY 1
+    ON CONFLICT (bucket) DO NOTHING
+"""
+
+
 def init_db():
     """инициализация таблиц в базе"""
     conn = connect_db()
@@ -130,18 +583,11 @@ def init_db():
             )
         ''')
 
-        # создаем таблицу истории визитов
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS visit_history (
-                id SERIAL PRIMARY KEY,
-                timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
-                entered INTEGER NOT NULL,
-                exited INTEGER NOT NULL,
-                people_inside INTEGER NOT NULL,
-                occupied_tables INTEGER NOT NULL,
-                free_tables INTEGER NOT NULL
-            )
-        ''')
+        # создаем таблицу истории по месяцам
+        _init_partitioned_history(cursor)
+        
+        # индекс по времени для выборок истории
+        cursor.execute(VISIT_HISTORY_INDEX_SQL)
         
         # создаем таблицу дневных отчетов
         cursor.execute('''
@@ -154,6 +600,22 @@ def init_db():
             )
         ''')
 
+        # создаем почасовые агрегаты истории
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS visit_history_hourly (
+                bucket TIMESTAMP WITHOUT TIME ZONE PRIMARY KEY,
+                samples INTEGER NOT NULL,
+                people_sum BIGINT NOT NULL,
+                people_min INTEGER NOT NULL,
+                people_max INTEGER NOT NULL
+            )
+        ''')
+
+        # заполняем агрегаты по старой истории один раз
+        cursor.execute("SELECT 1 FROM visit_history_hourly LIMIT 1")
+        if not cursor.fetchone():
+            cursor.execute(ROLLUP_BACKFILL_SQL)
+
         # инициализируем строку общей статистики
         cursor.execute("SELECT id FROM current_status WHERE id=1")
         if not cursor.fetchone():
@@ -180,12 +642,272 @@ def init_db():
         
     finally:
         cursor.close()
-        conn.close()
+        release_db(conn)
 
 # обновление статуса столов из мл
 
-def update_detailed_tables_status(occupancy_list: List[int], table_capacity: int) -> bool:
-    """обновляем статус столов из мл"""
+# почасовой агрегат для одного замера
+HOURLY_ROLLUP_UPSERT_SQL = """
+    INSERT INTO visit_history_hourly (bucket, samples, people_sum, people_min, people_max)
+    VALUES (date_trunc('hour', NOW()), 1, %(people_inside)s, %(people_inside)s, %(people_inside)s)
+    ON CONFLICT (bucket) DO UPDATE SET
+    samples = visit_history_hourly.samples + 1,
+    people_sum = visit_history_hourly.people_sum + EXCLUDED.people_sum,
+    people_min = LEAST(visit_history_hourly.people_min, EXCLUDED.people_min),
+    people_max = GREATEST(visit_history_hourly.people_max, EXCLUDED.people_max)
+"""
+
+# столы и общая строка одним запросом
+# неизмененные столы не переписываем
+BATCH_UPDATE_SQL = """
+    WITH changed AS (
+        INSERT INTO table_status (id, occupied_seats)
+        SELECT * FROM unnest(%(table_ids)s::int[], %(occupied)s::int[])
+        ON CONFLICT (id) DO UPDATE
+        SET occupied_seats = EXCLUDED.occupied_seats
+        WHERE table_status.occupied_seats IS DISTINCT FROM EXCLUDED.occupied_seats
+        RETURNING id
+    )
+    UPDATE current_status SET
+    people_inside = %(people_inside)s,
+    free_tables = %(free_tables)s,
+    last_update = COALESCE(to_timestamp(%(captured_ts)s::double precision), NOW())
+    WHERE id = 1
+"""
+
+# агрегаты пачки замеров по часам
+HOURLY_ROLLUP_MERGE_SQL = """
+    INSERT INTO visit_history_hourly (bucket, samples, people_sum, people_min, people_max)
+    SELECT * FROM unnest(
+        %s::timestamp[], %s::int[], %s::bigint[], %s::int[], %s::int[]
+    )
+    ON CONFLICT (bucket) DO UPDATE SET
+    samples = visit_history_hourly.samples + EXCLUDED.samples,
+    people_sum = visit_history_hourly.people_sum + EXCLUDED.people_sum,
+    people_min = LEAST(visit_history_hourly.people_min, EXCLUDED.people_min),
+    people_max = GREATEST(visit_history_hourly.people_max, EXCLUDED.people_max)
+"""
+
+HISTORY_COLUMNS = (
+    "timestamp", "entered", "exited", "people_inside", "occupied_tables", "free_tables"
+)
+
+
+def write_history_batch(samples: List[tuple]) -> bool:
+    """пачка замеров в историю и агрегаты"""
+    if not samples:
+        return True
+    conn = connect_db()
+    if conn is None:
+        return False
+
+    cursor = conn.cursor()
+    try:
+        # copy быстрее построчных insert
+        buf = io.StringIO()
+        for sample in samples:
+            buf.write("\t".join(str(v) for v in sample))
+            buf.write("\n")
+        buf.seek(0)
+        cursor.copy_from(buf, "visit_history", columns=HISTORY_COLUMNS)
+
+        # агрегаты считаем тут по часам
+        hourly: Dict[datetime, List[int]] = {}
+        for sample in samples:
+            bucket = sample[0].replace(minute=0, second=0, microsecond=0)
+            people = int(sample[3])
+            acc = hourly.get(bucket)
+            if acc is None:
+                hourly[bucket] = [1, people, people, people]
+            else:
+                acc[0] += 1
+                acc[1] += people
+                acc[2] = min(acc[2], people)
+                acc[3] = max(acc[3], people)
+        buckets = sorted(hourly)
+        cursor.execute(
+            HOURLY_ROLLUP_MERGE_SQL,
+            (
+                buckets,
+                [hourly[b][0] for b in buckets],
+                [hourly[b][1] for b in buckets],
+                [hourly[b][2] for b in buckets],
+                [hourly[b][3] for b in buckets],
+            ),
+        )
+        conn.commit()
+        return True
+    except Exception as e:
+        print(f"DB Error in write_history_batch: {e}")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+        release_db(conn)
+
+
+class HistoryBuffer:
+    """отложенная запись истории пачками"""
+
+    def __init__(
+        self,
+        write_fn,
+        flush_seconds: float,
+        flush_rows: int,
+        max_rows: int,
+        spill_path: Optional[str],
+    ):
+        self._write_fn = write_fn
+        self.flush_seconds = float(flush_seconds)
+        self.flush_rows = max(1, int(flush_rows))
+        self.max_rows = max(self.flush_rows, int(max_rows))
+        self.spill_path = spill_path
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pending: List[tuple] = []
+
+        # счетчики для метрик буфера
+        self.flushed = 0
+        self.dropped = 0
+        self.flush_failures = 0
+        self.last_flush_ms = 0.0
+
+    def add(self, sample: tuple) -> None:
+        """кладем замер без обращения к бд"""
+        with self._lock:
+            self._pending.append(sample)
+            if len(self._pending) > self.max_rows:
+                # при переполнении теряем самые старые
+                overflow = len(self._pending) - self.max_rows
+                del self._pending[:overflow]
+                self.dropped += overflow
+            full = len(self._pending) >= self.flush_rows
+        if full:
+            self._wake.set()
+
+    def flush(self) -> bool:
+        """пишем накопленное одной пачкой"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return True
+
+            started = time.monotonic()
+            ok = False
+            try:
+                ok = bool(self._write_fn(batch))
+            except Exception as e:
+                print(f"ERROR: History flush failed: {e}")
+
+            with self._lock:
+                if ok:
+                    self.flushed += len(batch)
+                    self.last_flush_ms = round((time.monotonic() - started) * 1000.0, 3)
+                else:
+                    # возвращаем пачку в начало очереди
+                    self.flush_failures += 1
+                    self._pending = batch + self._pending
+                    if len(self._pending) > self.max_rows:
+                        overflow = len(self._pending) - self.max_rows
+                        del self._pending[:overflow]
+                        self.dropped += overflow
+            self._save_spill()
+            return ok
+
+    def _save_spill(self) -> None:
+        # на диске только то что не дошло до бд
+        if not self.spill_path:
+            return
+        with self._lock:
+            pending = list(self._pending)
+        try:
+            if not pending:
+                if os.path.exists(self.spill_path):
+                    os.remove(self.spill_path)
+                return
+            tmp_path = f"{self.spill_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for sample in pending:
+                    f.write(json.dumps([sample[0].isoformat(), *sample[1:]]))
+                    f.write("\n")
+            os.replace(tmp_path, self.spill_path)
+        except OSError as e:
+            print(f"ERROR: History spill write failed: {e}")
+
+    def load_spill(self) -> int:
+        """поднимаем замеры оставшиеся после сбоя"""
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return 0
+        restored: List[tuple] = []
+        try:
+            with open(self.spill_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    values = json.loads(line)
+                    restored.append((datetime.fromisoformat(values[0]), *values[1:]))
+        except (OSError, ValueError) as e:
+            print(f"ERROR: History spill read failed: {e}")
+            return 0
+        with self._lock:
+            self._pending = restored + self._pending
+        return len(restored)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        restored = self.load_spill()
+        if restored:
+            print(f"INFO: Restored {restored} history samples from {self.spill_path}.")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """останавливаем и дописываем остаток"""
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            self._wake.set()
+            thread.join(timeout=self.flush_seconds + 5.0)
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "flushed": self.flushed,
+                "dropped": self.dropped,
+                "flush_failures": self.flush_failures,
+                "last_flush_ms": self.last_flush_ms,
+            }
+
+
+history_buffer = HistoryBuffer(
+    write_history_batch,
+    flush_seconds=HISTORY_FLUSH_SECONDS,
+    flush_rows=HISTORY_FLUSH_ROWS,
+    max_rows=HISTORY_BUFFER_MAX_ROWS,
+    spill_path=HISTORY_SPILL_PATH or None,
+)
+
+
+def update_detailed_tables_status(
+    occupancy_list: List[int], table_capacity: int, captured_ts: Optional[float] = None
+) -> bool:
+    """обновляем статус столов из мл, время по захвату кадра unix сек если есть"""
     conn = connect_db()
     if conn is None: 
         return False
@@ -204,38 +926,33 @@ def update_detailed_tables_status(occupancy_list: List[int], table_capacity: int
         
         print("DEBUG DB: Stage 2 - Calculated stats.")
 
-        # обновляем таблицу статуса столов
-        for idx, occupied in enumerate(adjusted_occupancy_list):
-            table_id = idx + 1 
-            cursor.execute("""
-                INSERT INTO table_status (id, occupied_seats) 
-                VALUES (%s, %s)
-                ON CONFLICT (id) DO UPDATE 
-                SET occupied_seats = EXCLUDED.occupied_seats
-            """, (table_id, occupied))
-        
-        print("DEBUG DB: Stage 3 - Table statuses updated.")
-        
-        # обновляем общую строку статуса
-        cursor.execute("""
-            UPDATE current_status SET 
-            people_inside = %s, 
-            free_tables = %s, 
-            last_update = NOW() 
-            WHERE id = 1
-        """, (total_occupied_seats, free_tables_count))
-        
-        # пишем запись в историю
         occupied_tables_count = sum(1 for occupied in adjusted_occupancy_list if occupied > 0) 
+        table_ids = list(range(1, total_tables + 1))
+        # до записи: неверное время не должно оставить закоммиченную строку
+        # буфер истории в локальном времени бекенда как datetime.now()
+        sampled_at = datetime.now() if captured_ts is None else datetime.fromtimestamp(captured_ts)
+
+        # одна запись на все обновление
+        cursor.execute(
+            BATCH_UPDATE_SQL,
+            {
+                "table_ids": table_ids,
+                "occupied": [int(v) for v in adjusted_occupancy_list],
+                "people_inside": total_occupied_seats,
+                "free_tables": free_tables_count,
+                # бд переводит в свою зону так же как NOW()
+                "captured_ts": captured_ts,
+            },
+        )
         
-        cursor.execute("""
-            INSERT INTO visit_history(
-                timestamp, entered, exited, people_inside, occupied_tables, free_tables
-            )
-            VALUES (NOW(), %s, %s, %s, %s, %s)
-        """, (0, 0, total_occupied_seats, occupied_tables_count, free_tables_count)) 
+        print("DEBUG DB: Stage 3 - Table statuses updated.")
         
         conn.commit()
+
+        # история пишется пачкой вне запроса
+        history_buffer.add((
+            sampled_at, 0, 0, total_occupied_seats, occupied_tables_count, free_tables_count
+        ))
         
         print("DEBUG DB: Stage 4 - Commit successful. Returning True.")
         return True
@@ -246,10 +963,28 @@ def update_detailed_tables_status(occupancy_list: List[int], table_capacity: int
         return False
     finally:
         cursor.close()
-        conn.close()
+        release_db(conn)
 
 # чтение статуса для фронта
 
+def table_status_entry(table_id: int, occupied: int, table_capacity: int) -> Dict[str, Any]:
+    """запись стола с цветом статуса"""
+    # вычисляем цвет статуса стола
+    if occupied == 0:
+        color = "green"
+    elif occupied < table_capacity:
+        color = "yellow"
+    else:
+        color = "red"
+
+    return {
+        "table_id": table_id,
+        "occupied": occupied,
+        "capacity": table_capacity,
+        "status_color": color
+    }
+
+
 def get_detailed_status(table_capacity: int) -> Dict[str, Any]:
     """читаем статус столов для интерфейса"""
     conn = connect_db()
@@ -273,20 +1008,7 @@ def get_detailed_status(table_capacity: int) -> Dict[str, Any]:
                 table_id = row[0]
                 occupied = row[1]
                 
-                # вычисляем цвет статуса стола
-                if occupied == 0:
-                    color = "green"
-                elif occupied < table_capacity:
-                    color = "yellow"
-                else:
-                    color = "red"
-                
-                tables_list.append({
-                    "table_id": table_id,
-                    "occupied": occupied,
-                    "capacity": table_capacity,
-                    "status_color": color
-                })
+                tables_list.append(table_status_entry(table_id, occupied, table_capacity))
         
         last_update_value = overall_data[2] if overall_data else None
         if last_update_value is None:
@@ -308,7 +1030,7 @@ def get_detailed_status(table_capacity: int) -> Dict[str, Any]:
         return None
     finally:
         cursor.close()
-        conn.close()
+        release_db(conn)
 
 
 # старые функции для совместимости
@@ -354,6 +1076,9 @@ def update_status(entered: int, exited: int, occupied_tables: int):
             VALUES (NOW(), %s, %s, %s, %s, %s)
         """, (entered, exited, new_people, occupied_tables, free_tables))
 
+        # агрегаты обновляем вместе с историей
+        cursor.execute(HOURLY_ROLLUP_UPSERT_SQL, {"people_inside": new_people})
+
         conn.commit()
         return True
     except Exception as e:
@@ -362,7 +1087,7 @@ def update_status(entered: int, exited: int, occupied_tables: int):
         return False
     finally:
         cursor.close()
-        conn.close()
+        release_db(conn)
 
 
 def get_current_status():
@@ -382,7 +1107,7 @@ def get_current_status():
         return None
     finally:
         cursor.close()
-        conn.close()
+        release_db(conn)
 
 
 def get_history(limit: int = 100):
@@ -392,15 +1117,20 @@ def get_history(limit: int = 100):
 
     cursor = conn.cursor()
 
-    cursor.execute("""
-        SELECT timestamp, entered, exited, people_inside, occupied_tables, free_tables
-        FROM visit_history
-        ORDER BY timestamp DESC
-        LIMIT %s
-    """, (limit,))
+    try:
+        cursor.execute("""
+            SELECT timestamp, entered, exited, people_inside, occupied_tables, free_tables
+            FROM visit_history
+            ORDER BY timestamp DESC
+            LIMIT %s
+        """, (limit,))
+
+        rows = cursor.fetchall()
+    finally:
+        # соединение возвращаем даже при ошибке
+        cursor.close()
+        release_db(conn)
 
-    rows = cursor.fetchall()
-    
     # форматируем время для ответа
     results = [
         {
@@ -414,9 +1144,6 @@ def get_history(limit: int = 100):
         for r in rows
     ]
 
-    cursor.close()
-    conn.close()
-
     return results
 
 def get_daily_stats(date: str):
@@ -426,21 +1153,24 @@ def get_daily_stats(date: str):
     
     cursor = conn.cursor()
 
-    cursor.execute("""
-        SELECT 
-            SUM(entered),
-            SUM(exited),
-            MAX(people_inside),
-            MIN(people_inside),
-            AVG(people_inside)
-        FROM visit_history
-        WHERE DATE(timestamp) = %s
-    """, (date,))
-
-    row = cursor.fetchone()
+    try:
+        # диапазон по времени вместо DATE() для индекса
+        cursor.execute("""
+            SELECT 
+                SUM(entered),
+                SUM(exited),
+                MAX(people_inside),
+                MIN(people_inside),
+                AVG(people_inside)
+            FROM visit_history
+            WHERE timestamp >= %s::date
+            AND timestamp < %s::date + 1
+        """, (date, date))
 
-    cursor.close()
-    conn.close()
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+        release_db(conn)
 
     return {
         "date": date,
@@ -461,50 +1191,47 @@ def get_weekday_hourly_occupancy(days_back: int = 30, start_hour: int = 9, end_h
     hours = list(range(start_hour, end_hour + 1))
     weekday_labels = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб"]
 
-    # буферы значений по часам
+    # суммы и число замеров по часам
     buckets: Dict[tuple[int, int], List[int]] = {}
     for w in range(6):
         for h in hours:
-            buckets[(w, h)] = []
+            buckets[(w, h)] = [0, 0]
 
     cursor = conn.cursor()
     try:
+        # группировка по дню недели и часу в бд
+        # isodow понедельник 1 воскресенье 7
         cursor.execute(
             """
-            SELECT timestamp, people_inside
-            FROM visit_history
-            WHERE timestamp >= NOW() - (%s || ' days')::interval
+            SELECT
+                EXTRACT(ISODOW FROM bucket)::int - 1 AS weekday_idx,
+                EXTRACT(HOUR FROM bucket)::int AS hour,
+                SUM(people_sum),
+                SUM(samples)
+            FROM visit_history_hourly
+            WHERE bucket >= date_trunc('hour', NOW() - (%s || ' days')::interval)
+            AND EXTRACT(ISODOW FROM bucket) <= 6
+            AND EXTRACT(HOUR FROM bucket) BETWEEN %s AND %s
+            GROUP BY 1, 2
             """,
-            (days_back,),
+            (days_back, start_hour, end_hour),
         )
         rows = cursor.fetchall()
 
-        for ts, people_inside in rows:
-            if ts is None:
-                continue
-
-            weekday_idx = ts.weekday()  # понедельник это нулевой индекс
-            if weekday_idx < 0 or weekday_idx > 5:
-                continue
-
-            hour = ts.hour
-            if hour < start_hour or hour > end_hour:
-                continue
-
-            try:
-                buckets[(weekday_idx, hour)].append(int(people_inside))
-            except Exception:
-                continue
+        for weekday_idx, hour, people_sum, samples in rows:
+            key = (int(weekday_idx), int(hour))
+            if key in buckets:
+                buckets[key] = [int(people_sum), int(samples)]
 
         occupancy_by_day: Dict[str, List[int]] = {}
         for w_idx, label in enumerate(weekday_labels):
             values: List[int] = []
             for h in hours:
-                vals = buckets[(w_idx, h)]
-                if not vals:
+                people_sum, samples = buckets[(w_idx, h)]
+                if not samples:
                     values.append(0)
                 else:
-                    values.append(int(round(sum(vals) / len(vals))))
+                    values.append(int(round(people_sum / samples)))
             occupancy_by_day[label] = values
 
         # для ui показываем только столы 1..18 по 3 места
@@ -518,17 +1245,18 @@ def get_weekday_hourly_occupancy(days_back: int = 30, start_hour: int = 9, end_h
         }
     finally:
         cursor.close()
-        conn.close()
+        release_db(conn)
 
 def generate_daily_report(date: str):
-    conn = connect_db()
-    if not conn:
-        return False
-    
+    # статистику читаем до захвата соединения
     stats = get_daily_stats(date)
     if not stats:
         return False
 
+    conn = connect_db()
+    if not conn:
+        return False
+
     cursor = conn.cursor()
 
     try:
@@ -555,4 +1283,4 @@ def generate_daily_report(date: str):
         return False
     finally:
         cursor.close()
-        conn.close()
\ No newline at end of file
+        release_db(conn)
\ No newline at end of file
@@ -1,15 +1,31 @@
-from fastapi import FastAPI, HTTPException, WebSocket
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List
+from fastapi.responses import JSONResponse, Response
+from typing import Any, Dict, List, Optional
+import asyncio
+import bisect
 import json 
+import os
+import time
 from datetime import datetime
 from apscheduler.schedulers.background import BackgroundScheduler
 import sys 
 from starlette.concurrency import run_in_threadpool  # асинхронный вызов синхронного кода
 
+try:
+    import orjson  # быстрый джсон если установлен
+except ImportError:
+    orjson = None
+
 # импорт функций базы данных
 from db import (
+    history_buffer,
     init_db,
+    init_pool,
+    close_pool,
+    get_pool_stats,
     update_status, 
     get_current_status,
     get_history,
@@ -18,12 +34,17 @@ from db import (
     update_detailed_tables_status, 
     get_detailed_status,
     get_weekday_hourly_occupancy,
+    maintain_history_partitions,
+    redistribute_overflow_in_columns,
+    table_status_entry,
 )
 from models import (
     UpdateData, 
     StatusResponse, 
     OccupancyUpdate, 
-    DetailedStatusResponse
+    Heartbeat,
+    DetailedStatusResponse,
+    decode_occupancy_frame,
 )
 
 # конфигурация параметров приложения тут
@@ -33,6 +54,22 @@ scheduler = BackgroundScheduler()
 # емкость мест на стол
 TABLE_CAPACITY = 3 
 
+# таймаут отправки одному клиенту
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "2.0"))
+# повтор рассылки без изменений для времени
+BROADCAST_REFRESH_SECONDS = float(os.getenv("BROADCAST_REFRESH_SECONDS", "30"))
+# мл без обновлений и heartbeat дольше считаем пропавшим
+ML_STALE_SECONDS = float(os.getenv("ML_STALE_SECONDS", "45"))
+# время захвата дальше от часов бекенда не верим, пишем NOW()
+CAPTURE_MAX_SKEW_SECONDS = float(os.getenv("CAPTURE_MAX_SKEW_SECONDS", "300"))
+# канал приема от мл: подтверждение после стольких кадров или паузы
+WS_INGEST_ACK_EVERY = max(1, int(os.getenv("WS_INGEST_ACK_EVERY", "16")))
+WS_INGEST_ACK_DELAY_SECONDS = float(os.getenv("WS_INGEST_ACK_DELAY_SECONDS", "0.05"))
+# очередь клиента старые кадры вытесняются
+WS_QUEUE_SIZE = max(1, int(os.getenv("WS_QUEUE_SIZE", "1")))
+# сколько кадров подряд можно потерять
+WS_MAX_LAGGED_FRAMES = max(1, int(os.getenv("WS_MAX_LAGGED_FRAMES", "5")))
+
 # настройка корс для запросов
 app.add_middleware(
     CORSMiddleware,
@@ -43,40 +80,504 @@ app.add_middleware(
 )
 
 
+@app.exception_handler(RequestValidationError)
+async def validation_exception_handler(request: Request, exc: RequestValidationError):
+    """422 без входных значений: inf и nan не пишутся в json"""
+    errors = [{k: v for k, v in error.items() if k != "input"} for error in exc.errors()]
+    return JSONResponse(status_code=422, content={"detail": jsonable_encoder(errors)})
+
+
+def encode_status(data: Any) -> str:
+    """сериализация статуса в джсон"""
+    if orjson is not None:
+        return orjson.dumps(data, default=str).decode("utf-8")
+    return json.dumps(data, default=str)
+
+
+# снимок статуса столов в памяти
+class StatusSnapshot:
+    """актуальный статус столов для чтения без бд"""
+    def __init__(self):
+        self.data: Optional[Dict[str, Any]] = None
+        # версия растет только при изменении столов
+        # она же номер кадра в режиме дельт
+        self.version = 0
+        # изменения столов для текущей версии
+        self.changes: Optional[List[List[int]]] = None
+        self._encoded: Optional[str] = None
+        self._snapshot_frame: Optional[str] = None
+        self._delta_frame: Optional[str] = None
+
+    def _reset_cache(self):
+        self._encoded = None
+        self._snapshot_frame = None
+        self._delta_frame = None
+
+    def load(self, data: Dict[str, Any]):
+        """заменяем снимок данными из бд"""
+        self.data = data
+        self.changes = None
+        self._reset_cache()
+        self.version += 1
+
+    def encoded(self) -> str:
+        """джсон снимка кодируем один раз"""
+        if self._encoded is None:
+            self._encoded = encode_status(self.data)
+        return self._encoded
+
+    def snapshot_frame(self) -> str:
+        """полный кадр с номером для дельт"""
+        if self._snapshot_frame is None:
+            self._snapshot_frame = encode_status(
+                {"type": "snapshot", "seq": self.version, **self.data}
+            )
+        return self._snapshot_frame
+
+    def delta_frame(self) -> Optional[str]:
+        """кадр только с изменениями столов"""
+        if self.changes is None:
+            return None
+        if self._delta_frame is None:
+            self._delta_frame = encode_status({
+                "type": "delta",
+                "seq": self.version,
+                "changes": self.changes,
+                "overall_inside": self.data["overall_inside"],
+                "last_update": self.data["last_update"],
+                "captured_at": self.data.get("captured_at"),
+                "source_seq": self.data.get("source_seq"),
+            })
+        return self._delta_frame
+
+    def apply_update(
+        self,
+        occupancy_list: List[int],
+        table_capacity: int,
+        captured_ts: Optional[float] = None,
+        source_seq: Optional[int] = None,
+    ) -> bool:
+        """применяем принятое обновление мл, время по захвату кадра если есть"""
+        if self.data is None:
+            return False
+
+        # те же правила что при записи в бд
+        adjusted = redistribute_overflow_in_columns(occupancy_list, table_capacity)
+
+        prev_tables = self.data.get("tables", [])
+        prev_occupied = {t["table_id"]: t["occupied"] for t in prev_tables}
+        tables = {t["table_id"]: t for t in prev_tables}
+        changes: List[List[int]] = []
+        for idx, occupied in enumerate(adjusted):
+            table_id = idx + 1
+            tables[table_id] = table_status_entry(table_id, int(occupied), table_capacity)
+            if prev_occupied.get(table_id) != int(occupied):
+                changes.append([table_id, int(occupied)])
+        ordered = [tables[table_id] for table_id in sorted(tables)]
+        overall_inside = int(sum(adjusted))
+        changed = (
+            ordered != prev_tables
+            or overall_inside != self.data.get("overall_inside")
+        )
+
+        # снимок не мутируем а заменяем
+        self.data = {
+            "overall_inside": overall_inside,
+            "total_capacity": len(ordered) * table_capacity,
+            "tables": ordered,
+            "last_update": (
+                datetime.fromtimestamp(captured_ts) if captured_ts is not None else datetime.now()
+            ).strftime('%Y-%m-%d %H:%M:%S'),
+            # насколько свежие цифры видно на клиенте
+            "captured_at": captured_ts,
+            "source_seq": source_seq,
+        }
+        self._reset_cache()
+        if changed:
+            self.version += 1
+            self.changes = changes
+        return True
+
+
+snapshot = StatusSnapshot()
+
+
+async def get_status_snapshot() -> Optional[Dict[str, Any]]:
+    """статус из памяти или один раз из бд"""
+    if snapshot.data is None:
+        # загрузка из бд без блокировки
+        data = await run_in_threadpool(get_detailed_status, TABLE_CAPACITY)
+        if data:
+            snapshot.load(data)
+    return snapshot.data
+
+
+class CameraOccupancy:
+    """последние списки камер в один общий список"""
+
+    def __init__(self):
+        # камера -> (первый стол, занятость, время)
+        self.cameras: Dict[str, Any] = {}
+        # камера -> (номер, время захвата) последнего принятого обновления
+        self.last_seq: Dict[str, Any] = {}
+        self.late_dropped: Dict[str, int] = {}
+
+    def is_late(self, camera_id: str, seq: Optional[int], captured_ts: Optional[float]) -> bool:
+        """повтор мл пришел после более нового обновления камеры"""
+        last = self.last_seq.get(camera_id)
+        if seq is None or last is None or last[0] is None or seq > last[0]:
+            return False
+        # номер меньше, но кадр новее: мл перезапустился и считает заново
+        return captured_ts is None or last[1] is None or captured_ts <= last[1]
+
+    def merge(
+        self,
+        camera_id: str,
+        first_table_id: int,
+        occupancy_list: List[int],
+        seq: Optional[int] = None,
+        captured_ts: Optional[float] = None,
+    ) -> Optional[List[int]]:
+        """None если обновление опоздало"""
+        if self.is_late(camera_id, seq, captured_ts):
+            self.late_dropped[camera_id] = self.late_dropped.get(camera_id, 0) + 1
+            return None
+        now = time.monotonic()
+        self.cameras[camera_id] = (int(first_table_id), [int(v) for v in occupancy_list], now)
+        for other, (first, occ, ts) in list(self.cameras.items()):
+            if now - ts > ML_STALE_SECONDS and any(occ):
+                # камера пропала: ее столы считаем свободными, а не застывшими
+                self.cameras[other] = (first, [0] * len(occ), ts)
+        n_tables = max(first + len(occ) - 1 for first, occ, _ in self.cameras.values())
+        merged = [0] * max(0, n_tables)
+        for first, occ, _ in self.cameras.values():
+            for idx, occupied in enumerate(occ):
+                # стол видят две камеры берем максимум
+                merged[first - 1 + idx] = max(merged[first - 1 + idx], occupied)
+        return merged
+
+    def committed(self, camera_id: str, seq: Optional[int], captured_ts: Optional[float]) -> None:
+        """номер запоминаем после записи, повтор после ошибки бд не опоздавший"""
+        self.last_seq[camera_id] = (seq, captured_ts)
+
+    def touch(self, camera_id: Optional[str]) -> None:
+        """heartbeat: статус камеры не менялся, но она жива"""
+        entry = self.cameras.get(camera_id)
+        if entry is not None:
+            self.cameras[camera_id] = (entry[0], entry[1], time.monotonic())
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            camera_id: {
+                "first_table_id": first,
+                "tables": len(occ),
+                "age_seconds": round(now - ts, 1),
+                "stale": now - ts > ML_STALE_SECONDS,
+                "late_dropped": self.late_dropped.get(camera_id, 0),
+            }
+            for camera_id, (first, occ, ts) in self.cameras.items()
+        }
+
+
+cameras = CameraOccupancy()
+# слияние камер, запись в бд и снимок по одному: иначе старый список
+# из тредпула может закоммититься последним
+ingest_lock = asyncio.Lock()
+
+
+class MlLiveness:
+    """когда источник мл последний раз выходил на связь, только в памяти"""
+
+    def __init__(self):
+        # источник -> счетчики и время последнего контакта
+        self.sources: Dict[str, Dict[str, Any]] = {}
+
+    def _touch(self, camera_id: Optional[str], kind: str) -> None:
+        source = self.sources.setdefault(
+            camera_id or "default",
+            {"updates": 0, "heartbeats": 0, "last_update": None, "last_seen": None, "last_seq": None},
+        )
+        now = time.monotonic()
+        source[kind + "s"] += 1
+        source["last_seen"] = now
+        if kind == "update":
+            source["last_update"] = now
+
+    def update(self, camera_id: Optional[str], seq: Optional[int] = None) -> None:
+        self._touch(camera_id, "update")
+        if seq is not None:
+            # номер кадра мл для поиска пропусков
+            self.sources[camera_id or "default"]["last_seq"] = int(seq)
+
+    def heartbeat(self, camera_id: Optional[str]) -> None:
+        self._touch(camera_id, "heartbeat")
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            name: {
+                "updates": source["updates"],
+                "heartbeats": source["heartbeats"],
+                "last_seq": source["last_seq"],
+                "seen_age_seconds": round(now - source["last_seen"], 1),
+                "update_age_seconds": None if source["last_update"] is None else round(now - source["last_update"], 1),
+                "stale": now - source["last_seen"] > ML_STALE_SECONDS,
+            }
+            for name, source in self.sources.items()
+        }
+
+
+liveness = MlLiveness()
+
+
+# границы корзин задержки в мс
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class LatencyHistogram:
+    """гистограмма задержки одного участка пути"""
+
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = tuple(bounds)
+        # последняя корзина все что больше верхней границы
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        # отрицательная задержка значит часы мл и бекенда разошлись
+        self.clock_skew = 0
+
+    def record(self, ms: float) -> None:
+        if ms < 0:
+            self.clock_skew += 1
+            ms = 0.0
+        self.counts[bisect.bisect_left(self.bounds, ms)] += 1
+        self.count += 1
+        self.sum_ms += ms
+
+    def quantile(self, q: float) -> Optional[float]:
+        """верхняя граница корзины с квантилем, none если за пределами"""
+        if self.count == 0:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen >= target:
+                return float(bound)
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        cumulative = 0
+        buckets = {}
+        for bound, n in zip(self.bounds + ("+Inf",), self.counts):
+            cumulative += n
+            buckets[str(bound)] = cumulative
+        return {
+            "count": self.count,
+            "mean_ms": round(self.sum_ms / self.count, 1) if self.count else None,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "clock_skew": self.clock_skew,
+            # накопительно как le в prometheus
+            "buckets_ms": buckets,
+        }
+
+
+class IngestLatency:
+    """задержки по участкам: захват, инференс, отправка, запись, рассылка"""
+
+    HOPS = (
+        ("capture_to_inference", "captured", "inferred"),
+        ("inference_to_post", "inferred", "posted"),
+        ("post_to_commit", "posted", "committed"),
+        ("commit_to_broadcast", "committed", "broadcast"),
+        ("capture_to_broadcast", "captured", "broadcast"),
+    )
+
+    def __init__(self):
+        self.hops = {name: LatencyHistogram() for name, _, _ in self.HOPS}
+        # время захвата отброшено как неправдоподобное
+        self.capture_ts_ignored = 0
+
+    def record(self, **timestamps: Optional[float]) -> None:
+        """времена unix сек, участок без любого из концов пропускаем"""
+        for name, start, end in self.HOPS:
+            if timestamps.get(start) is not None and timestamps.get(end) is not None:
+                self.hops[name].record(1000.0 * (timestamps[end] - timestamps[start]))
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {name: hist.stats() for name, hist in self.hops.items()}
+        out["capture_ts_ignored"] = self.capture_ts_ignored
+        return out
+
+
+ingest_latency = IngestLatency()
+
+
+class IngestChannels:
+    """счетчики постоянных каналов приема от мл"""
+
+    def __init__(self):
+        self.open = 0
+        self.connections = 0
+        self.frames = 0
+        self.acks = 0
+        self.nacks = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "open": self.open,
+            "connections": self.connections,
+            "frames": self.frames,
+            "acks": self.acks,
+            "nacks": self.nacks,
+        }
+
+
+ingest_channels = IngestChannels()
+
+
+# клиент вебсокет со своей очередью
+class ClientConnection:
+    """очередь и писатель одного клиента"""
+    def __init__(self, websocket: WebSocket, manager: "ConnectionManager", mode: str = "full"):
+        self.websocket = websocket
+        self.manager = manager
+        # full полные снимки delta только изменения
+        self.mode = mode
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WS_QUEUE_SIZE)
+        self.task: Optional[asyncio.Task] = None
+        # кадры потерянные подряд
+        self.lagged = 0
+        self.evicted = False
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
+
+    def offer(self, data: str, resync_frame=None):
+        """кладем кадр новый важнее старого"""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.lagged += 1
+            self.manager.frames_dropped += 1
+            if self.lagged >= WS_MAX_LAGGED_FRAMES:
+                self.manager.evict(self)
+                return
+            # потерянную дельту заменяем полным кадром
+            if resync_frame is not None:
+                data = resync_frame()
+        self.queue.put_nowait(data)
+
+    async def _close(self):
+        try:
+            # 1013 просим клиента переподключиться позже
+            await asyncio.wait_for(self.websocket.close(code=1013), WS_SEND_TIMEOUT_SECONDS)
+        except Exception:
+            pass
+
+    async def _run(self):
+        try:
+            while True:
+                data = await self.queue.get()
+                await asyncio.wait_for(self.websocket.send_text(data), WS_SEND_TIMEOUT_SECONDS)
+                self.lagged = 0
+                self.manager.frames_sent += 1
+        except asyncio.CancelledError:
+            if self.evicted:
+                await self._close()
+            raise
+        except Exception:
+            # таймаут или обрыв соединения
+            self.manager.evict(self)
+            await self._close()
+
+
 # менеджер подключений вебсокет клиентов
 class ConnectionManager:
     """управляет подключениями вебсокет клиентов"""
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        # словарь дает удаление за о от 1
+        self.active_connections: Dict[WebSocket, ClientConnection] = {}
+        self.last_payload: Optional[str] = None
+        self.last_broadcast_ts = 0.0
+
+        # счетчики для метрик сокетов
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.evictions = 0
 
-    async def connect(self, websocket: WebSocket):
+    def register(self, websocket: WebSocket, mode: str = "full") -> ClientConnection:
+        """заводим очередь и писатель клиента"""
+        client = ClientConnection(websocket, self, mode)
+        self.active_connections[websocket] = client
+        client.start()
+        return client
+
+    async def connect(self, websocket: WebSocket, mode: str = "full") -> ClientConnection:
         """добавляем клиента и шлем статус"""
         await websocket.accept()
-        self.active_connections.append(websocket)
+        client = self.register(websocket, mode)
         
-        # загрузка из бд без блокировки
-        initial_data = await run_in_threadpool(get_detailed_status, TABLE_CAPACITY)
+        # начальный статус из снимка
+        initial_data = await get_status_snapshot()
         
         if initial_data:
-            initial_json = json.dumps(initial_data, default=str)
-            await websocket.send_text(initial_json)
+            if mode == "delta":
+                client.offer(snapshot.snapshot_frame())
+            else:
+                client.offer(snapshot.encoded())
+        return client
 
     def disconnect(self, websocket: WebSocket):
         """удаляем клиента из списка"""
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+        client = self.active_connections.pop(websocket, None)
+        if client is not None:
+            client.stop()
+
+    def evict(self, client: ClientConnection):
+        """отключаем отстающего клиента"""
+        if client.evicted:
+            return
+        client.evicted = True
+        self.evictions += 1
+        self.active_connections.pop(client.websocket, None)
+        client.stop()
+
+    def payload_age(self) -> float:
+        """секунды с последней рассылки"""
+        return time.monotonic() - self.last_broadcast_ts
 
     async def broadcast(self, data: str):
         """рассылаем статус всем клиентам"""
-        disconnected_connections = []
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(data)
-            except RuntimeError:
-                disconnected_connections.append(connection)
-                
-        for connection in disconnected_connections:
-            self.active_connections.remove(connection)
+        if data == self.last_payload:
+            return
+        self.last_payload = data
+        self.last_broadcast_ts = time.monotonic()
+
+        # только кладем в очереди без ожидания
+        for client in list(self.active_connections.values()):
+            if client.mode == "full":
+                client.offer(data)
+
+    async def broadcast_delta(self, data: str):
+        """рассылаем изменения клиентам режима дельт"""
+        for client in list(self.active_connections.values()):
+            if client.mode == "delta":
+                client.offer(data, resync_frame=snapshot.snapshot_frame)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "clients": len(self.active_connections),
+            "frames_sent": self.frames_sent,
+            "frames_dropped": self.frames_dropped,
+            "evictions": self.evictions,
+        }
 
 manager = ConnectionManager() 
 
@@ -84,8 +585,22 @@ manager = ConnectionManager()
 @app.on_event("startup")
 async def startup():
     """запуск приложения и сервисов"""
+    # пул соединений до инициализации бд
+    init_pool()
     # инициализация бд при старте
     init_db() 
+    # отложенная запись истории
+    history_buffer.start()
+    # снимок статуса грузим один раз
+    await get_status_snapshot()
+    # разделы истории и срок хранения раз в сутки
+    scheduler.add_job(
+        maintain_history_partitions,
+        "cron",
+        hour=3,
+        id="history_partitions",
+        replace_existing=True,
+    )
     scheduler.start()
     print("FastAPI Backend Started. WebSockets Manager Ready.")
 
@@ -93,72 +608,242 @@ async def startup():
 def shutdown():
     """остановка сервисов приложения тут"""
     scheduler.shutdown()
+    # дописываем историю до закрытия пула
+    history_buffer.stop()
+    close_pool()
 
 
 ## СВЯЗЬ ФРОНТЕНДА И БЕКЕНДА: WEBSOCKET
 @app.websocket("/ws/status")
-async def websocket_endpoint(websocket: WebSocket):
+async def websocket_endpoint(websocket: WebSocket, mode: str = "full"):
     """поток вебсокет обновлений фронта"""
-    await manager.connect(websocket)
+    # режим дельт включается параметром mode=delta
+    mode = "delta" if mode == "delta" else "full"
+    client = await manager.connect(websocket, mode)
     try:
         while True:
             # ждем входящие сообщения сокета
-            await websocket.receive_text() 
+            message = await websocket.receive_text() 
+            if mode == "delta" and _is_resync_request(message) and snapshot.data is not None:
+                # клиент заметил пропуск номера кадра
+                client.offer(snapshot.snapshot_frame())
     except Exception:
         manager.disconnect(websocket)
         print("WebSocket disconnected.")
 
+
+def _is_resync_request(message: str) -> bool:
+    if message.strip() == "resync":
+        return True
+    try:
+        payload = json.loads(message)
+    except ValueError:
+        return False
+    return isinstance(payload, dict) and payload.get("type") == "resync"
+
+async def apply_ml_update(
+    occupancy_list: List[int],
+    camera_id: Optional[str],
+    first_table_id: int,
+    seq: Optional[int] = None,
+    captured_ts: Optional[float] = None,
+    inferred_ts: Optional[float] = None,
+    posted_ts: Optional[float] = None,
+):
+    """общая часть json и бинарного приема"""
+    liveness.update(camera_id, seq)
+    if captured_ts is not None and abs(time.time() - captured_ts) > CAPTURE_MAX_SKEW_SECONDS:
+        # мс вместо сек или сбитые часы мл, задержки от него тоже неверны
+        ingest_latency.capture_ts_ignored += 1
+        captured_ts = inferred_ts = posted_ts = None
+    async with ingest_lock:
+        if camera_id is not None:
+            # каждая камера шлет только свои столы
+            occupancy_list = cameras.merge(camera_id, first_table_id, occupancy_list, seq, captured_ts)
+            if occupancy_list is None:
+                # повтор старше принятого, подтверждаем без записи
+                return {"success": True, "message": "Late update ignored"}
+
+        print(f"DEBUG: FastAPI received payload: {occupancy_list}")
+
+        success = False
+        try:
+            # вызов бд через тредпул
+            success = await run_in_threadpool(
+                update_detailed_tables_status, 
+                occupancy_list, 
+                TABLE_CAPACITY,
+                captured_ts,
+            )
+        except Exception as e:
+            print(f"Database update failed: {e}")
+            # ошибка при работе с бд
+            raise HTTPException(status_code=500, detail=f"Database update failed: {e}")
+
+        if not success:
+            # бд вернула ложь ошибка
+            raise HTTPException(status_code=503, detail="Database service not available or operation failed.")
+
+        committed_ts = time.time()
+        broadcast_ts = None
+        if camera_id is not None:
+            cameras.committed(camera_id, seq, captured_ts)
+
+        # обновляем снимок без чтения бд
+        version_before = snapshot.version
+        if not snapshot.apply_update(occupancy_list, TABLE_CAPACITY, captured_ts, seq):
+            await get_status_snapshot()
+
+        # без изменений шлем только изредка
+        changed = snapshot.version != version_before
+        if snapshot.data is not None and (changed or manager.payload_age() >= BROADCAST_REFRESH_SECONDS):
+            # рассылка обновлений всем сокетам
+            await manager.broadcast(snapshot.encoded()) 
+            if changed:
+                # после загрузки из бд дельты нет
+                await manager.broadcast_delta(snapshot.delta_frame() or snapshot.snapshot_frame())
+            broadcast_ts = time.time()
+
+    ingest_latency.record(
+        captured=captured_ts,
+        inferred=inferred_ts,
+        posted=posted_ts,
+        committed=committed_ts,
+        broadcast=broadcast_ts,
+    )
+    
+    # возвращаем успешный ответ клиенту
+    return {"success": True, "message": "Tables status received and broadcasted"}
+
 ## СВЯЗЬ ML И БЕКЕНДА: HTTP POST
 @app.post("/api/tables/update", tags=["ML Integration"])
 async def ml_update_tables(update_data: OccupancyUpdate):
     """прием статуса столов из мл"""
-    
-    occupancy_list = update_data.table_occupancy
-    
-    print(f"DEBUG: FastAPI received payload: {occupancy_list}")
-    
-    success = False
+    return await apply_ml_update(
+        update_data.table_occupancy,
+        update_data.camera_id,
+        update_data.first_table_id,
+        update_data.seq,
+        update_data.captured_ts,
+        update_data.inferred_ts,
+        update_data.posted_ts,
+    )
+
+## СВЯЗЬ ML И БЕКЕНДА: БИНАРНЫЙ КАДР
+@app.post("/api/tables/update/bin", tags=["ML Integration"])
+async def ml_update_tables_binary(request: Request):
+    """тот же прием из компактного кадра application/x-occupancy"""
     try:
-        # вызов бд через тредпул
-        success = await run_in_threadpool(
-            update_detailed_tables_status, 
-            occupancy_list, 
-            TABLE_CAPACITY
-        )
-    except Exception as e:
-        print(f"Database update failed: {e}")
-        # ошибка при работе с бд
-        raise HTTPException(status_code=500, detail=f"Database update failed: {e}")
+        frame = decode_occupancy_frame(await request.body())
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=422, detail=f"bad occupancy frame: {e}")
+    return await apply_ml_update(
+        frame.table_occupancy,
+        frame.camera_id,
+        frame.first_table_id,
+        frame.seq,
+        frame.captured_ts,
+        frame.inferred_ts,
+        frame.posted_ts,
+    )
 
-    if success:
-        
-        # чтение статуса через тредпул
-        new_status_data = await run_in_threadpool(
-            get_detailed_status, 
-            TABLE_CAPACITY
-        )
-        
-        # сериализация статуса в джсон
-        status_json = json.dumps(new_status_data, default=str) 
-        
-        # рассылка обновлений всем сокетам
-        await manager.broadcast(status_json) 
-        
-        # возвращаем успешный ответ клиенту
-        return {"success": True, "message": "Tables status received and broadcasted"}
-    else:
-        # бд вернула ложь ошибка
-        raise HTTPException(status_code=503, detail="Database service not available or operation failed.")
+async def _ingest_message(message: Dict[str, Any]):
+    """кадр или heartbeat из канала, возвращает номер и nack при ошибке"""
+    if message.get("bytes") is not None:
+        try:
+            frame = decode_occupancy_frame(message["bytes"])
+        except (ValueError, UnicodeDecodeError) as e:
+            return None, {"type": "nack", "seq": None, "status": 422, "error": str(e)}
+        try:
+            await apply_ml_update(
+                frame.table_occupancy,
+                frame.camera_id,
+                frame.first_table_id,
+                frame.seq,
+                frame.captured_ts,
+                frame.inferred_ts,
+                frame.posted_ts,
+            )
+        except HTTPException as e:
+            return frame.seq, {"type": "nack", "seq": frame.seq, "status": e.status_code, "error": str(e.detail)}
+        return frame.seq, None
+
+    try:
+        payload = json.loads(message.get("text") or "")
+        seq = int(payload["seq"])
+        if payload.get("type") != "heartbeat":
+            raise ValueError(f"unknown message type {payload.get('type')}")
+        heartbeat = Heartbeat(camera_id=payload.get("camera_id"), tables=payload.get("tables", 0))
+    except (ValueError, KeyError, TypeError) as e:
+        return None, {"type": "nack", "seq": None, "status": 422, "error": str(e)}
+    liveness.heartbeat(heartbeat.camera_id)
+    cameras.touch(heartbeat.camera_id)
+    return seq, None
+
+## СВЯЗЬ ML И БЕКЕНДА: ПОСТОЯННЫЙ КАНАЛ
+@app.websocket("/ws/ingest")
+async def ml_ingest_channel(websocket: WebSocket):
+    """те же обновления мл по одному сокету, подтверждения пачкой"""
+    await websocket.accept()
+    ingest_channels.open += 1
+    ingest_channels.connections += 1
+    last_seq = None
+    unacked = 0
+
+    async def send_ack():
+        nonlocal unacked
+        # подтверждает все кадры до наибольшего seq включительно
+        await websocket.send_text(json.dumps({"type": "ack", "seq": last_seq, "count": unacked}))
+        ingest_channels.acks += 1
+        unacked = 0
+
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(
+                    websocket.receive(), timeout=WS_INGEST_ACK_DELAY_SECONDS if unacked else None
+                )
+            except asyncio.TimeoutError:
+                # поток затих, подтверждаем накопленное
+                await send_ack()
+                continue
+            if message["type"] == "websocket.disconnect":
+                break
+
+            seq, nack = await _ingest_message(message)
+            ingest_channels.frames += 1
+            if nack is not None:
+                ingest_channels.nacks += 1
+                await websocket.send_text(json.dumps(nack))
+            if seq is not None:
+                # кадры могут прийти не по порядку, ack по наибольшему
+                last_seq = seq if last_seq is None else max(last_seq, seq)
+            unacked += 1
+            if unacked >= WS_INGEST_ACK_EVERY:
+                await send_ack()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        ingest_channels.open -= 1
+
+## СВЯЗЬ ML И БЕКЕНДА: HEARTBEAT
+@app.post("/api/tables/heartbeat", tags=["ML Integration"])
+async def ml_heartbeat(heartbeat: Heartbeat):
+    """мл жив без изменений, без бд и рассылки"""
+    liveness.heartbeat(heartbeat.camera_id)
+    cameras.touch(heartbeat.camera_id)
+    return {"success": True}
 
 ## СВЯЗЬ ФРОНТЕНДА И БЕКЕНДА: HTTP GET
 @app.get("/api/status/detailed", response_model=DetailedStatusResponse, tags=["Frontend API"])
 async def detailed_status():  # асинхронный обработчик статуса хттп
     """хттп статус столов для интерфейса"""
-    # чтение из бд тредпул
-    data = await run_in_threadpool(get_detailed_status, TABLE_CAPACITY)
+    # чтение из снимка в памяти
+    data = await get_status_snapshot()
     
     if data:
-        return data
+        # готовый джсон без повторной сериализации
+        return Response(content=snapshot.encoded(), media_type="application/json")
     else:
         raise HTTPException(status_code=503, detail="Service Unavailable or No data in DB")
 
@@ -176,6 +861,21 @@ async def weekly_stats(days_back: int = 30, start_hour: int = 9, end_hour: int =
     raise HTTPException(status_code=503, detail="Service Unavailable or No data in DB")
 
 
+## МЕТРИКИ СЕРВИСА
+@app.get("/api/metrics", tags=["Metrics"])
+async def metrics():
+    """метрики пула и сервисов"""
+    return {
+        "db_pool": get_pool_stats(),
+        "websocket": manager.stats(),
+        "history_buffer": history_buffer.stats(),
+        "cameras": cameras.stats(),
+        "ml": liveness.stats(),
+        "ingest_channels": ingest_channels.stats(),
+        "latency": ingest_latency.stats(),
+    }
+
+
 # старые эндпоинты для совместимости
 
 @app.get("/")
@@ -1,14 +1,137 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, model_validator
 from typing import List, Optional
+from dataclasses import dataclass
 from datetime import datetime
+import math
+import os
+import struct
+
+# сколько столов в зале максимум, номер последнего стола не больше
+MAX_TABLES = max(1, int(os.getenv("MAX_TABLES", "256")))
 
 # модель запроса от мл
 class OccupancyUpdate(BaseModel):
     """модель данных приема от мл"""
     # список занятости по столам
+    table_occupancy: List[int] = Field(max_length=MAX_TABLES)
+    # камера зала и ее первый стол в общей нумерации
+    camera_id: Optional[str] = None
+    first_table_id: int = Field(1, ge=1, le=MAX_TABLES)
+    # номер обновления и времена unix сек по пути кадра в мл
+    seq: Optional[int] = None
+    # inf и nan не пускаем: бд запишет infinity
+    captured_ts: Optional[float] = Field(None, allow_inf_nan=False)
+    inferred_ts: Optional[float] = Field(None, allow_inf_nan=False)
+    posted_ts: Optional[float] = Field(None, allow_inf_nan=False)
+
+    @model_validator(mode="after")
+    def _tables_in_range(self):
+        # иначе один кадр раздует общий список столов
+        _check_table_range(self.first_table_id, len(self.table_occupancy))
+        return self
+
+
+def _check_table_range(first_table_id: int, n_tables: int) -> None:
+    if first_table_id < 1:
+        raise ValueError("first_table_id должен быть >= 1")
+    if first_table_id + n_tables - 1 > MAX_TABLES:
+        raise ValueError(f"столы {first_table_id}..{first_table_id + n_tables - 1} за пределом MAX_TABLES={MAX_TABLES}")
+
+
+# бинарный кадр от мл: заголовок, id камеры, счетчики uint8
+# v1: magic, версия, длина id, первый стол, номер, время захвата, столов
+# v2: то же плюс float32 задержки инференса и отправки от захвата
+OCCUPANCY_FRAME_MAGIC = b"OC"
+OCCUPANCY_FRAME_VERSION = 2
+OCCUPANCY_FRAME_HEADER_V1 = struct.Struct("<2sBBHIdH")
+OCCUPANCY_FRAME_HEADER = struct.Struct("<2sBBHIdffH")
+OCCUPANCY_FRAME_CONTENT_TYPE = "application/x-occupancy"
+
+
+@dataclass
+class OccupancyFrame:
+    """бинарное обновление без поэлементной проверки pydantic"""
     table_occupancy: List[int]
-    # время можно брать на сервере
-    
+    camera_id: Optional[str]
+    first_table_id: int
+    seq: int
+    captured_ts: float
+    inferred_ts: Optional[float] = None
+    posted_ts: Optional[float] = None
+
+
+def encode_occupancy_frame(
+    table_occupancy: List[int],
+    seq: int,
+    captured_ts: float,
+    camera_id: Optional[str] = None,
+    first_table_id: int = 1,
+    inferred_ts: Optional[float] = None,
+    posted_ts: Optional[float] = None,
+) -> bytes:
+    camera = (camera_id or "").encode("utf-8")
+    header = OCCUPANCY_FRAME_HEADER.pack(
+        OCCUPANCY_FRAME_MAGIC,
+        OCCUPANCY_FRAME_VERSION,
+        len(camera),
+        int(first_table_id),
+        int(seq) & 0xFFFFFFFF,
+        float(captured_ts),
+        # nan когда времени нет
+        float("nan") if inferred_ts is None else inferred_ts - captured_ts,
+        float("nan") if posted_ts is None else posted_ts - captured_ts,
+        len(table_occupancy),
+    )
+    # больше 255 человек за столом не бывает
+    return header + camera + bytes(min(255, max(0, int(v))) for v in table_occupancy)
+
+
+def _after(captured_ts: float, delay: Optional[float]) -> Optional[float]:
+    # nan в кадре значит времени нет, inf тоже не время
+    return None if delay is None or not math.isfinite(delay) else captured_ts + delay
+
+
+def decode_occupancy_frame(data: bytes) -> OccupancyFrame:
+    """ValueError на битый кадр, принимает v1 и v2"""
+    if len(data) < OCCUPANCY_FRAME_HEADER_V1.size:
+        raise ValueError("кадр короче заголовка")
+    magic, version = data[:2], data[2]
+    if magic != OCCUPANCY_FRAME_MAGIC or version not in (1, 2):
+        raise ValueError("неизвестный формат кадра")
+    inferred_delay = posted_delay = None
+    if version == 1:
+        header = OCCUPANCY_FRAME_HEADER_V1
+        _, _, camera_len, first_table_id, seq, captured_ts, n_tables = header.unpack_from(data)
+    else:
+        header = OCCUPANCY_FRAME_HEADER
+        if len(data) < header.size:
+            raise ValueError("кадр короче заголовка")
+        _, _, camera_len, first_table_id, seq, captured_ts, inferred_delay, posted_delay, n_tables = header.unpack_from(data)
+    if len(data) != header.size + camera_len + n_tables:
+        raise ValueError("длина кадра не совпадает с заголовком")
+    _check_table_range(first_table_id, n_tables)
+    if not math.isfinite(captured_ts):
+        raise ValueError("captured_ts должен быть конечным")
+    offset = header.size
+    camera_id = data[offset : offset + camera_len].decode("utf-8") if camera_len else None
+    return OccupancyFrame(
+        # байты сразу в список int
+        table_occupancy=list(data[offset + camera_len :]),
+        camera_id=camera_id,
+        first_table_id=first_table_id,
+        seq=seq,
+        captured_ts=captured_ts,
+        inferred_ts=_after(captured_ts, inferred_delay),
+        posted_ts=_after(captured_ts, posted_delay),
+    )
+
+
+class Heartbeat(BaseModel):
+    """мл жив, статус не менялся"""
+    camera_id: Optional[str] = None
+    # сколько столов у источника
+    tables: int = Field(0, ge=0)
+
 # старые модели для совместимости
 class UpdateData(BaseModel):
     # модель для старого апи
@@ -1,3 +1,5 @@
+import asyncio
+
 import pytest
 
 
@@ -9,7 +11,20 @@ def app_client(monkeypatch):
 
     # отключаем бд и планировщик
     monkeypatch.setattr(main, "init_db", lambda: None)
+    monkeypatch.setattr(main, "init_pool", lambda: False)
+    monkeypatch.setattr(main, "close_pool", lambda: None)
+    monkeypatch.setattr(main.history_buffer, "start", lambda: None)
+    monkeypatch.setattr(main.history_buffer, "stop", lambda: None)
     monkeypatch.setattr(main.scheduler, "start", lambda: None)
+    # чистый снимок статуса на тест
+    monkeypatch.setattr(main, "snapshot", main.StatusSnapshot())
+    monkeypatch.setattr(main, "manager", main.ConnectionManager())
+    monkeypatch.setattr(main, "cameras", main.CameraOccupancy())
+    # замок на цикл событий этого теста
+    monkeypatch.setattr(main, "ingest_lock", asyncio.Lock())
+    monkeypatch.setattr(main, "liveness", main.MlLiveness())
+    monkeypatch.setattr(main, "ingest_channels", main.IngestChannels())
+    monkeypatch.setattr(main, "ingest_latency", main.IngestLatency())
     monkeypatch.setattr(main.scheduler, "shutdown", lambda: None)
 
     return TestClient(main.app)
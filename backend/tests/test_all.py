@@ -1,4 +1,7 @@
+import asyncio
 import json
+import time
+from datetime import datetime
 
 import db
 
@@ -47,7 +50,7 @@ def test_post_tables_update_ok(app_client, monkeypatch):
     # обновление статуса столов
     import main
 
-    monkeypatch.setattr(main, "update_detailed_tables_status", lambda occupancy_list, table_capacity: True)
+    monkeypatch.setattr(main, "update_detailed_tables_status", lambda occupancy_list, table_capacity, captured_ts=None: True)
     monkeypatch.setattr(main, "get_detailed_status", lambda table_capacity: _sample_detailed_status())
 
     r = app_client.post("/api/tables/update", json={"table_occupancy": [0, 1, 2]})
@@ -55,11 +58,328 @@ def test_post_tables_update_ok(app_client, monkeypatch):
     assert r.json()["success"] is True
 
 
+def test_post_tables_update_merges_cameras_into_global_tables(app_client, monkeypatch):
+    # камеры шлют свои столы в общую нумерацию
+    import main
+
+    written = []
+    monkeypatch.setattr(
+        main, "update_detailed_tables_status", lambda occupancy_list, table_capacity, captured_ts=None: written.append(occupancy_list) or True
+    )
+    monkeypatch.setattr(main, "get_detailed_status", lambda table_capacity: _sample_detailed_status())
+
+    r = app_client.post("/api/tables/update", json={"table_occupancy": [1, 2], "camera_id": "hall2", "first_table_id": 4})
+    assert r.status_code == 200
+    r = app_client.post("/api/tables/update", json={"table_occupancy": [3, 0, 1], "camera_id": "hall1"})
+    assert r.status_code == 200
+    r = app_client.post("/api/tables/update", json={"table_occupancy": [0, 0], "camera_id": "hall2", "first_table_id": 4})
+    assert r.status_code == 200
+
+    assert written == [[0, 0, 0, 1, 2], [3, 0, 1, 1, 2], [3, 0, 1, 0, 0]]
+    assert app_client.get("/api/metrics").json()["cameras"]["hall2"]["first_table_id"] == 4
+    r = app_client.post("/api/tables/update", json={"table_occupancy": [1], "camera_id": "x", "first_table_id": 0})
+    assert r.status_code == 422
+    # последний стол за пределом зала
+    from models import MAX_TABLES
+
+    r = app_client.post("/api/tables/update", json={"table_occupancy": [1, 1], "camera_id": "x", "first_table_id": MAX_TABLES})
+    assert r.status_code == 422
+    r = app_client.post("/api/tables/update", json={"table_occupancy": [1], "camera_id": "x", "first_table_id": 65535})
+    assert r.status_code == 422
+    assert written[-1] == [3, 0, 1, 0, 0]
+
+
+def test_stale_camera_tables_are_freed_unless_heartbeat_keeps_it(app_client, monkeypatch):
+    # пропавшая камера не держит столы занятыми, heartbeat продлевает ее
+    import main
+
+    written = []
+    monkeypatch.setattr(
+        main, "update_detailed_tables_status", lambda occupancy_list, table_capacity, captured_ts=None: written.append(occupancy_list) or True
+    )
+    monkeypatch.setattr(main, "get_detailed_status", lambda table_capacity: _sample_detailed_status())
+    monkeypatch.setattr(main, "ML_STALE_SECONDS", 10.0)
+
+    def _age(camera_id, seconds):
+        first, occ, ts = main.cameras.cameras[camera_id]
+        main.cameras.cameras[camera_id] = (first, occ, ts - seconds)
+
+    app_client.post("/api/tables/update", json={"table_occupancy": [2, 1], "camera_id": "hall1"})
+    app_client.post("/api/tables/update", json={"table_occupancy": [1], "camera_id": "hall2", "first_table_id": 3})
+    app_client.post("/api/tables/update", json={"table_occupancy": [3], "camera_id": "hall3", "first_table_id": 4})
+    _age("hall1", 20)
+    _age("hall2", 20)
+    assert app_client.post("/api/tables/heartbeat", json={"camera_id": "hall2", "tables": 1}).status_code == 200
+    app_client.post("/api/tables/update", json={"table_occupancy": [2], "camera_id": "hall3", "first_table_id": 4})
+
+    assert written[-1] == [0, 0, 1, 2]
+    cameras = app_client.get("/api/metrics").json()["cameras"]
+    assert cameras["hall1"]["stale"] is True and cameras["hall2"]["stale"] is False
+
+
+def test_concurrent_camera_updates_commit_latest_merge(app_client, monkeypatch):
+    # медленная запись первой камеры не перетирает вторую старым списком
+    import asyncio
+    import main
+
+    written = []
+
+    def _update(occupancy_list, table_capacity, captured_ts=None):
+        if not written:
+            time.sleep(0.2)
+        written.append(list(occupancy_list))
+        return True
+
+    monkeypatch.setattr(main, "update_detailed_tables_status", _update)
+    monkeypatch.setattr(main, "get_detailed_status", lambda table_capacity: _sample_detailed_status())
+
+    async def _both():
+        monkeypatch.setattr(main, "ingest_lock", asyncio.Lock())
+        await asyncio.gather(main.apply_ml_update([2], "hall1", 1), main.apply_ml_update([3], "hall2", 2))
+
+    asyncio.run(_both())
+    assert written == [[2], [2, 3]]
+    assert [t["occupied"] for t in main.snapshot.data["tables"]][:2] == [2, 3]
+
+
+def test_late_camera_update_is_acked_without_write(app_client, monkeypatch):
+    # повтор мл старше принятого не пишется, перезапуск мл и повтор после 503 пишутся
+    import main
+
+    results = iter([True, False, True, True])
+    written = []
+
+    def _update(occupancy_list, table_capacity, captured_ts=None):
+        written.append(list(occupancy_list))
+        return next(results)
+
+    monkeypatch.setattr(main, "update_detailed_tables_status", _update)
+    monkeypatch.setattr(main, "get_detailed_status", lambda table_capacity: _sample_detailed_status())
+
+    now = time.time()
+
+    def _post(occupancy, seq, captured_ts):
+        body = {"table_occupancy": occupancy, "camera_id": "hall1", "seq": seq, "captured_ts": captured_ts}
+        return app_client.post("/api/tables/update", json=body).status_code
+
+    assert _post([2], 5, now - 1.0) == 200
+    assert _post([1], 4, now - 2.0) == 200
+    assert _post([0], 6, now - 0.5) == 503
+    assert _post([0], 6, now - 0.5) == 200
+    # новый процесс мл: номер с начала, кадр новее
+    assert _post([3], 1, now) == 200
+
+    assert written == [[2], [0], [0], [3]]
+    assert app_client.get("/api/metrics").json()["cameras"]["hall1"]["late_dropped"] == 1
+
+
+def test_heartbeat_marks_ml_alive_without_db_or_broadcast(app_client, monkeypatch):
+    # heartbeat только в памяти
+    import main
+
+    calls = []
+    monkeypatch.setattr(main, "update_detailed_tables_status", lambda *a: calls.append("db") or True)
+
+    async def _broadcast(data):
+        calls.append("broadcast")
+
+    monkeypatch.setattr(main.manager, "broadcast", _broadcast)
+
+    r = app_client.post("/api/tables/heartbeat", json={"camera_id": "hall1", "tables": 12})
+    assert r.status_code == 200
+    r = app_client.post("/api/tables/heartbeat", json={"tables": 5})
+    assert r.status_code == 200
+    assert calls == []
+
+    ml = app_client.get("/api/metrics").json()["ml"]
+    assert ml["hall1"]["heartbeats"] == 1 and ml["hall1"]["updates"] == 0
+    assert ml["hall1"]["update_age_seconds"] is None and ml["hall1"]["stale"] is False
+    assert ml["default"]["heartbeats"] == 1
+    assert app_client.post("/api/tables/heartbeat", json={"tables": -1}).status_code == 422
+
+
+def test_binary_update_frame_matches_json_path(app_client, monkeypatch):
+    # компактный кадр идет тем же путем что json
+    import main
+    from models import OCCUPANCY_FRAME_HEADER, OCCUPANCY_FRAME_HEADER_V1, decode_occupancy_frame, encode_occupancy_frame
+
+    written = []
+    monkeypatch.setattr(
+        main, "update_detailed_tables_status", lambda occupancy_list, table_capacity, captured_ts=None: written.append(occupancy_list) or True
+    )
+    monkeypatch.setattr(main, "get_detailed_status", lambda table_capacity: _sample_detailed_status())
+
+    body = encode_occupancy_frame([1, 2], seq=7, captured_ts=1700000000.25, camera_id="hall2", first_table_id=4)
+    assert len(body) == OCCUPANCY_FRAME_HEADER.size + len("hall2") + 2
+    frame = decode_occupancy_frame(body)
+    assert (frame.seq, frame.captured_ts, frame.camera_id) == (7, 1700000000.25, "hall2")
+
+    r = app_client.post("/api/tables/update/bin", content=body, headers={"Content-Type": "application/x-occupancy"})
+    assert r.status_code == 200
+    r = app_client.post("/api/tables/update/bin", content=encode_occupancy_frame([3, 0, 300], seq=8, captured_ts=0.0))
+    assert r.status_code == 200
+    assert written == [[0, 0, 0, 1, 2], [3, 0, 255]]
+    assert app_client.get("/api/metrics").json()["ml"]["hall2"]["last_seq"] == 7
+
+    assert app_client.post("/api/tables/update/bin", content=body[:-1]).status_code == 422
+    # кадр первой версии без задержек
+    v1 = OCCUPANCY_FRAME_HEADER_V1.pack(b"OC", 1, 0, 1, 9, 0.0, 1) + bytes([2])
+    assert decode_occupancy_frame(v1).table_occupancy == [2] and decode_occupancy_frame(v1).inferred_ts is None
+    assert app_client.post("/api/tables/update/bin", content=b"XX" + body[2:]).status_code == 422
+    far = encode_occupancy_frame([1], seq=10, captured_ts=0.0, camera_id="hall2", first_table_id=65535)
+    assert app_client.post("/api/tables/update/bin", content=far).status_code == 422
+    assert len(written) == 2
+
+
+def test_ingest_channel_acks_in_batches_and_nacks_failures(app_client, monkeypatch):
+    # постоянный канал мл: подтверждение пачкой, ошибка бд отдельным nack
+    import main
+    from models import encode_occupancy_frame
+
+    results = iter([True, True, True, False])
+    written = []
+
+    def _update(occupancy_list, table_capacity, captured_ts=None):
+        written.append(occupancy_list)
+        return next(results)
+
+    monkeypatch.setattr(main, "update_detailed_tables_status", _update)
+    monkeypatch.setattr(main, "get_detailed_status", lambda table_capacity: _sample_detailed_status())
+    monkeypatch.setattr(main, "WS_INGEST_ACK_EVERY", 3)
+
+    with app_client.websocket_connect("/ws/ingest") as ws:
+        ws.send_bytes(encode_occupancy_frame([1, 0], seq=1, captured_ts=0.0))
+        ws.send_text(json.dumps({"type": "heartbeat", "seq": 2, "camera_id": None, "tables": 2}))
+        ws.send_bytes(encode_occupancy_frame([2, 0], seq=3, captured_ts=0.0))
+        assert ws.receive_json() == {"type": "ack", "seq": 3, "count": 3}
+
+        ws.send_bytes(encode_occupancy_frame([3, 0], seq=4, captured_ts=0.0))
+        ws.send_bytes(encode_occupancy_frame([4, 0], seq=5, captured_ts=0.0))
+        nack = ws.receive_json()
+        assert nack["type"] == "nack" and nack["seq"] == 5 and nack["status"] == 503
+        # меньше пачки: ack после паузы
+        assert ws.receive_json() == {"type": "ack", "seq": 5, "count": 2}
+
+    assert written == [[1, 0], [2, 0], [3, 0], [4, 0]]
+    metrics = app_client.get("/api/metrics").json()
+    assert metrics["ml"]["default"]["heartbeats"] == 1 and metrics["ml"]["default"]["last_seq"] == 5
+    assert metrics["ingest_channels"]["frames"] == 5 and metrics["ingest_channels"]["nacks"] == 1
+    assert metrics["ingest_channels"]["open"] == 0
+
+
+def test_ingest_channel_acks_highest_seq_out_of_order(app_client, monkeypatch):
+    # повтор после nack приходит с меньшим seq, ack не откатывается назад
+    import main
+    from models import encode_occupancy_frame
+
+    monkeypatch.setattr(main, "update_detailed_tables_status", lambda occupancy_list, table_capacity, captured_ts=None: True)
+    monkeypatch.setattr(main, "get_detailed_status", lambda table_capacity: _sample_detailed_status())
+    monkeypatch.setattr(main, "WS_INGEST_ACK_EVERY", 2)
+
+    with app_client.websocket_connect("/ws/ingest") as ws:
+        ws.send_bytes(encode_occupancy_frame([0, 1], seq=3, captured_ts=0.0, camera_id="hall2"))
+        ws.send_bytes(encode_occupancy_frame([1, 0], seq=1, captured_ts=0.0, camera_id="hall1"))
+        assert ws.receive_json() == {"type": "ack", "seq": 3, "count": 2}
+
+
+def test_update_timestamps_flow_into_snapshot_and_latency_histograms(app_client, monkeypatch):
+    # время захвата доходит до бд и рассылки, задержки по участкам в метриках
+    import main
+
+    committed = []
+    monkeypatch.setattr(
+        main,
+        "update_detailed_tables_status",
+        lambda occupancy_list, table_capacity, captured_ts=None: committed.append(captured_ts) or True,
+    )
+    monkeypatch.setattr(main, "get_detailed_status", lambda table_capacity: _sample_detailed_status())
+    # снимок грузится при старте
+    assert app_client.get("/api/status/detailed").status_code == 200
+
+    now = time.time()
+    r = app_client.post(
+        "/api/tables/update",
+        json={
+            "table_occupancy": [1, 3],
+            "seq": 41,
+            "captured_ts": now - 0.3,
+            "inferred_ts": now - 0.26,
+            "posted_ts": now - 0.2,
+        },
+    )
+    assert r.status_code == 200
+    assert committed == [now - 0.3]
+
+    status = app_client.get("/api/status/detailed").json()
+    assert status["source_seq"] == 41 and abs(status["captured_at"] - (now - 0.3)) < 1e-6
+
+    latency = app_client.get("/api/metrics").json()["latency"]
+    assert latency["capture_to_inference"]["p50_ms"] == 50.0
+    assert latency["inference_to_post"]["p50_ms"] == 100.0
+    assert latency["post_to_commit"]["count"] == 1 and latency["post_to_commit"]["p50_ms"] >= 250.0
+    assert latency["capture_to_broadcast"]["count"] == 1
+    assert latency["capture_to_broadcast"]["buckets_ms"]["+Inf"] == 1
+
+    # без времен участки не считаются
+    r = app_client.post("/api/tables/update", json={"table_occupancy": [0, 0]})
+    assert r.status_code == 200 and committed[-1] is None
+    assert app_client.get("/api/metrics").json()["latency"]["capture_to_inference"]["count"] == 1
+
+
+def test_bad_capture_time_is_rejected_or_falls_back_to_now(app_client, monkeypatch):
+    # inf и nan отклоняются, мс и 0 не пишутся в бд как время
+    import main
+    from models import OCCUPANCY_FRAME_HEADER, encode_occupancy_frame
+
+    committed = []
+    monkeypatch.setattr(
+        main,
+        "update_detailed_tables_status",
+        lambda occupancy_list, table_capacity, captured_ts=None: committed.append(captured_ts) or True,
+    )
+    monkeypatch.setattr(main, "get_detailed_status", lambda table_capacity: _sample_detailed_status())
+
+    for raw in ("Infinity", "NaN"):
+        body = '{"table_occupancy": [1], "captured_ts": %s}' % raw
+        r = app_client.post("/api/tables/update", content=body, headers={"Content-Type": "application/json"})
+        assert r.status_code == 422
+    for bad in (float("inf"), float("nan")):
+        frame = bytearray(encode_occupancy_frame([1], seq=1, captured_ts=0.0))
+        OCCUPANCY_FRAME_HEADER.pack_into(frame, 0, b"OC", 2, 0, 1, 1, bad, float("nan"), float("nan"), 1)
+        assert app_client.post("/api/tables/update/bin", content=bytes(frame)).status_code == 422
+    assert committed == []
+
+    now = time.time()
+    for ts in (now * 1000.0, 0.0):
+        r = app_client.post("/api/tables/update", json={"table_occupancy": [1], "captured_ts": ts, "posted_ts": ts})
+        assert r.status_code == 200
+        r = app_client.post("/api/tables/update/bin", content=encode_occupancy_frame([2], seq=2, captured_ts=ts))
+        assert r.status_code == 200
+    assert committed == [None, None, None, None]
+    latency = app_client.get("/api/metrics").json()["latency"]
+    assert latency["capture_ts_ignored"] == 4 and latency["capture_to_broadcast"]["count"] == 0
+
+    r = app_client.post("/api/tables/update", json={"table_occupancy": [1], "captured_ts": now - 1.0})
+    assert r.status_code == 200 and committed[-1] == now - 1.0
+
+
+def test_latency_histogram_quantiles_and_clock_skew():
+    import main
+
+    hist = main.LatencyHistogram(bounds=(10, 100))
+    for ms in (1, 5, 50, 500, -3):
+        hist.record(ms)
+    st = hist.stats()
+    assert st["buckets_ms"] == {"10": 3, "100": 4, "+Inf": 5}
+    assert st["p50_ms"] == 10.0 and st["p95_ms"] is None
+    assert st["clock_skew"] == 1
+
+
 def test_post_tables_update_returns_503_when_db_returns_false(app_client, monkeypatch):
     # возврат 503 если бд не обновилась
     import main
 
-    monkeypatch.setattr(main, "update_detailed_tables_status", lambda occupancy_list, table_capacity: False)
+    monkeypatch.setattr(main, "update_detailed_tables_status", lambda occupancy_list, table_capacity, captured_ts=None: False)
 
     r = app_client.post("/api/tables/update", json={"table_occupancy": [0, 0, 0]})
     assert r.status_code == 503
@@ -83,7 +403,7 @@ def test_post_tables_update_triggers_ws_broadcast(app_client, monkeypatch):
     # обновление вызывает broadcast
     import main
 
-    monkeypatch.setattr(main, "update_detailed_tables_status", lambda occupancy_list, table_capacity: True)
+    monkeypatch.setattr(main, "update_detailed_tables_status", lambda occupancy_list, table_capacity, captured_ts=None: True)
     monkeypatch.setattr(main, "get_detailed_status", lambda table_capacity: _sample_detailed_status())
 
     calls = {"count": 0, "payload": None}
@@ -140,3 +460,447 @@ def test_redistribute_ignores_tables_outside_ui_columns():
     assert out[18] == 9
     assert out[19] == 1
     assert sum(out) == sum(src)
+
+
+class _FakeConn:
+    # соединение без настоящей бд
+    def __init__(self):
+        self.closed = 0
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = 1
+
+    def cursor(self):
+        return _FakeCursor()
+
+
+class _FakeCursor:
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchone(self):
+        return (1,)
+
+    def close(self):
+        pass
+
+
+def _make_pool(maxconn=2, timeout_seconds=0.05, healthcheck_idle_seconds=30):
+    return db.ConnectionPool(
+        _FakeConn,
+        minconn=1,
+        maxconn=maxconn,
+        timeout_seconds=timeout_seconds,
+        healthcheck_idle_seconds=healthcheck_idle_seconds,
+    )
+
+
+def test_pool_reuses_connections_and_reports_occupancy():
+    # повторное использование соединения
+    pool = _make_pool()
+    conn = pool.acquire()
+    assert pool.stats()["in_use"] == 1
+    pool.release(conn)
+    assert pool.acquire() is conn
+    stats = pool.stats()
+    assert stats["created"] == 1
+    assert stats["acquired"] == 2
+
+
+def test_pool_times_out_when_exhausted():
+    # таймаут при исчерпании пула
+    pool = _make_pool(maxconn=1)
+    pool.acquire()
+    try:
+        pool.acquire()
+        assert False, "expected PoolTimeout"
+    except db.PoolTimeout:
+        pass
+    assert pool.stats()["timeouts"] == 1
+
+
+def test_pool_discards_closed_connections():
+    # закрытое соединение заменяется новым
+    pool = _make_pool(healthcheck_idle_seconds=0)
+    conn = pool.acquire()
+    pool.release(conn)
+    conn.closed = 1
+    fresh = pool.acquire()
+    assert fresh is not conn
+    assert pool.stats()["discarded"] == 1
+
+
+def test_connect_db_does_not_reopen_pool_after_close(monkeypatch):
+    # запрос после остановки не создает новый пул
+    opened = []
+    monkeypatch.setattr(db, "_open_connection", lambda: opened.append(1) or _FakeConn())
+    monkeypatch.setattr(db, "_pool", None)
+    monkeypatch.setattr(db, "_pool_closed", False)
+
+    conn = db.connect_db()
+    assert conn is not None and len(opened) == 1
+    db.close_pool()
+    db.release_db(conn)
+    assert db.connect_db() is None and len(opened) == 1
+    # явный init открывает снова
+    assert db.init_pool() is True and db.connect_db() is not None
+    db.close_pool()
+
+
+def test_metrics_endpoint_reports_pool(app_client, monkeypatch):
+    # метрики пула через api
+    import main
+
+    monkeypatch.setattr(main, "get_pool_stats", lambda: {"enabled": False})
+    r = app_client.get("/api/metrics")
+    assert r.status_code == 200
+    assert r.json()["db_pool"] == {"enabled": False}
+
+
+def test_update_detailed_tables_status_is_single_statement(monkeypatch):
+    # одно обращение к бд на обновление
+    executed = []
+
+    class _RecordingCursor(_FakeCursor):
+        def execute(self, sql, params=None):
+            executed.append((sql, params))
+
+    conn = _FakeConn()
+    conn.commits = 0
+    conn.cursor = lambda: _RecordingCursor()
+    conn.commit = lambda: setattr(conn, "commits", conn.commits + 1)
+
+    buffered = []
+    monkeypatch.setattr(db, "connect_db", lambda: conn)
+    monkeypatch.setattr(db, "release_db", lambda c: None)
+    monkeypatch.setattr(db.history_buffer, "add", buffered.append)
+
+    occupancy = [1] * 20
+    assert db.update_detailed_tables_status(occupancy, table_capacity=3) is True
+    assert len(executed) == 1
+    assert conn.commits == 1
+    sql, params = executed[0]
+    assert "IS DISTINCT FROM" in sql
+    assert params["table_ids"] == list(range(1, 21))
+    assert params["occupied"] == occupancy
+    # история уходит в буфер а не в запрос
+    assert "visit_history" not in sql
+    assert len(buffered) == 1
+    assert buffered[0][3:] == (20, 20, 40)
+    assert params["captured_ts"] is None
+
+    # время захвата кадра вместо NOW(), в зону бд переводит сама бд
+    captured_ts = 1765886401.0
+    assert db.update_detailed_tables_status(occupancy, table_capacity=3, captured_ts=captured_ts) is True
+    assert "to_timestamp(%(captured_ts)s" in executed[1][0]
+    assert executed[1][1]["captured_ts"] == captured_ts
+    assert buffered[1][0] == datetime.fromtimestamp(captured_ts)
+
+    # время не переводится: ни записи, ни коммита
+    assert db.update_detailed_tables_status(occupancy, table_capacity=3, captured_ts=1e20) is False
+    assert len(executed) == 2 and conn.commits == 2 and len(buffered) == 2
+
+
+def test_detailed_status_served_from_snapshot_after_update(app_client, monkeypatch):
+    # чтение статуса без обращения к бд
+    import main
+
+    reads = {"count": 0}
+
+    def fake_get_detailed_status(table_capacity):
+        reads["count"] += 1
+        return _sample_detailed_status()
+
+    monkeypatch.setattr(main, "get_detailed_status", fake_get_detailed_status)
+    monkeypatch.setattr(main, "update_detailed_tables_status", lambda occupancy_list, table_capacity, captured_ts=None: True)
+
+    assert app_client.get("/api/status/detailed").status_code == 200
+    assert reads["count"] == 1
+
+    r = app_client.post("/api/tables/update", json={"table_occupancy": [2, 0]})
+    assert r.status_code == 200
+
+    body = app_client.get("/api/status/detailed").json()
+    assert reads["count"] == 1
+    assert body["overall_inside"] == 2
+    assert body["tables"][0] == {"table_id": 1, "occupied": 2, "capacity": 3, "status_color": "yellow"}
+    assert body["tables"][1]["status_color"] == "green"
+
+
+def test_status_snapshot_keeps_tables_missing_from_update():
+    # столы вне обновления сохраняются
+    import main
+
+    snap = main.StatusSnapshot()
+    assert snap.apply_update([1], table_capacity=3) is False
+
+    snap.load(_sample_detailed_status())
+    assert snap.apply_update([1], table_capacity=3) is True
+    assert [t["occupied"] for t in snap.data["tables"]] == [1, 3]
+    assert snap.data["total_capacity"] == 6
+
+
+class _FakeWebSocket:
+    # клиент сокета с задержкой отправки
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.sent = []
+        self.closed_with = None
+
+    async def send_text(self, data):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.sent.append(data)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+def test_broadcast_evicts_slow_client_and_skips_duplicates(monkeypatch):
+    # медленный клиент не держит рассылку
+    import main
+
+    monkeypatch.setattr(main, "WS_SEND_TIMEOUT_SECONDS", 0.05)
+
+    async def scenario():
+        manager = main.ConnectionManager()
+        fast = _FakeWebSocket()
+        slow = _FakeWebSocket(delay=1.0)
+        manager.register(fast)
+        manager.register(slow)
+
+        await manager.broadcast('{"a": 1}')
+        # одинаковый payload не шлем повторно
+        await manager.broadcast('{"a": 1}')
+        await asyncio.sleep(0.2)
+        return manager, fast, slow
+
+    manager, fast, slow = asyncio.run(scenario())
+    assert fast.sent == ['{"a": 1}']
+    assert slow.closed_with == 1013
+    assert list(manager.active_connections) == [fast]
+    assert manager.stats()["evictions"] == 1
+
+
+def test_client_queue_keeps_latest_frame_and_evicts_lagging(monkeypatch):
+    # новый кадр вытесняет старый
+    import main
+
+    monkeypatch.setattr(main, "WS_QUEUE_SIZE", 1)
+    monkeypatch.setattr(main, "WS_MAX_LAGGED_FRAMES", 3)
+
+    async def scenario():
+        manager = main.ConnectionManager()
+        ws = _FakeWebSocket()
+        client = main.ClientConnection(ws, manager)
+        manager.active_connections[ws] = client
+
+        # писатель не запущен кадры копятся
+        client.offer("1")
+        client.offer("2")
+        assert client.queue.get_nowait() == "2"
+        client.offer("3")
+        client.offer("4")
+        client.offer("5")
+        return manager
+
+    manager = asyncio.run(scenario())
+    stats = manager.stats()
+    assert stats["frames_dropped"] == 3
+    assert stats["evictions"] == 1
+    assert stats["clients"] == 0
+
+
+def test_status_snapshot_version_only_changes_with_tables():
+    # версия снимка без изменений столов
+    import main
+
+    snap = main.StatusSnapshot()
+    snap.load(_sample_detailed_status())
+    snap.apply_update([0, 3], table_capacity=3)
+    version = snap.version
+    encoded = snap.encoded()
+    assert snap.encoded() is encoded
+
+    snap.apply_update([0, 3], table_capacity=3)
+    assert snap.version == version
+    snap.apply_update([1, 3], table_capacity=3)
+    assert snap.version == version + 1
+    assert json.loads(snap.encoded())["tables"][0]["occupied"] == 1
+
+
+def test_websocket_delta_mode_sends_changes_and_resyncs(app_client, monkeypatch):
+    # режим дельт снимок изменения и ресинк
+    import main
+
+    monkeypatch.setattr(main, "get_detailed_status", lambda table_capacity: _sample_detailed_status())
+    monkeypatch.setattr(main, "update_detailed_tables_status", lambda occupancy_list, table_capacity, captured_ts=None: True)
+
+    with app_client.websocket_connect("/ws/status?mode=delta") as ws:
+        first = json.loads(ws.receive_text())
+        assert first["type"] == "snapshot"
+        assert len(first["tables"]) == 2
+
+        r = app_client.post("/api/tables/update", json={"table_occupancy": [1, 3]})
+        assert r.status_code == 200
+
+        delta = json.loads(ws.receive_text())
+        assert delta["type"] == "delta"
+        assert delta["seq"] == first["seq"] + 1
+        assert delta["changes"] == [[1, 1]]
+        assert delta["overall_inside"] == 4
+
+        ws.send_text(json.dumps({"type": "resync"}))
+        resync = json.loads(ws.receive_text())
+        assert resync["type"] == "snapshot"
+        assert resync["seq"] == delta["seq"]
+        assert resync["tables"][0]["occupied"] == 1
+
+
+def test_weekday_hourly_occupancy_reads_rollups(monkeypatch):
+    # недельная статистика из почасовых агрегатов
+    executed = []
+    rows = [
+        (0, 12, 42, 6),  # понедельник 12 часов
+        (5, 11, 9, 3),  # суббота 11 часов
+    ]
+
+    class _RollupCursor(_FakeCursor):
+        def execute(self, sql, params=None):
+            executed.append((sql, params))
+
+        def fetchall(self):
+            return rows
+
+    conn = _FakeConn()
+    conn.cursor = lambda: _RollupCursor()
+    monkeypatch.setattr(db, "connect_db", lambda: conn)
+    monkeypatch.setattr(db, "release_db", lambda c: None)
+
+    out = db.get_weekday_hourly_occupancy(days_back=30, start_hour=11, end_hour=12)
+    sql, params = executed[0]
+    assert "visit_history_hourly" in sql
+    assert "GROUP BY" in sql
+    assert params == (30, 11, 12)
+    assert out["hours"] == ["11", "12"]
+    assert out["occupancy"]["Пн"] == [0, 7]
+    assert out["occupancy"]["Сб"] == [3, 0]
+
+
+def test_plan_history_partitions_creates_ahead_and_drops_expired():
+    # разделы вперед и удаление старых
+    from datetime import date
+
+    existing = [
+        "visit_history_p2024_11",
+        "visit_history_p2024_12",
+        "visit_history_p2025_12",
+        "visit_history_default",
+    ]
+    to_create, to_drop = db.plan_history_partitions(
+        existing, today=date(2025, 12, 16), ahead=2, retention_months=12
+    )
+    assert to_create == [date(2026, 1, 1), date(2026, 2, 1)]
+    # декабрь 2024 еще в сроке хранения
+    assert to_drop == ["visit_history_p2024_11"]
+
+
+def test_maintain_history_partitions_moves_default_rows_and_prunes_them(monkeypatch):
+    # строки в запасном разделе: раздел месяца создается с переносом и уходит по сроку
+    from datetime import date
+
+    class _Today(date):
+        @classmethod
+        def today(cls):
+            return date(2025, 12, 16)
+
+    existing = ["visit_history_p2025_12", "visit_history_p2026_01", "visit_history_p2026_02", "visit_history_default"]
+    executed = []
+
+    class _PartitionCursor(_FakeCursor):
+        def execute(self, sql, params=None):
+            executed.append(" ".join(sql.split()))
+            self.params = params
+
+        def fetchone(self):
+            return (self.params[0] if self.params[0] in existing else None,)
+
+        def fetchall(self):
+            if "pg_inherits" in executed[-1]:
+                return [(name,) for name in existing]
+            return [(date(2025, 12, 1),), (date(2024, 10, 1),)]
+
+    conn = _FakeConn()
+    conn.cursor = lambda: _PartitionCursor()
+    conn.commit = lambda: None
+    monkeypatch.setattr(db, "date", _Today)
+    monkeypatch.setattr(db, "connect_db", lambda: conn)
+    monkeypatch.setattr(db, "release_db", lambda c: None)
+    monkeypatch.setattr(db, "HISTORY_ARCHIVE_OLD", False)
+
+    assert db.maintain_history_partitions() is True
+    created = [sql for sql in executed if sql.startswith("CREATE TABLE visit_history_p")]
+    assert created == [
+        "CREATE TABLE visit_history_p2024_10 PARTITION OF visit_history FOR VALUES FROM ('2024-10-01') TO ('2024-11-01')"
+    ]
+    step = executed.index(created[0])
+    # перенос из запасного раздела до создания и возврат после
+    assert "DELETE FROM visit_history_default WHERE timestamp >= '2024-10-01' AND timestamp < '2024-11-01'" in executed[step - 1]
+    assert executed[step + 1] == "INSERT INTO visit_history SELECT * FROM visit_history_move"
+    assert executed[-1] == "DROP TABLE visit_history_p2024_10"
+
+
+def _history_sample(minute=0, people=1):
+    from datetime import datetime
+
+    return (datetime(2025, 12, 16, 12, minute), 0, 0, people, 1, 59)
+
+
+def test_history_buffer_flushes_in_batches_and_caps_memory():
+    # пачка замеров и лимит памяти
+    batches = []
+    buf = db.HistoryBuffer(
+        lambda batch: batches.append(list(batch)) or True,
+        flush_seconds=60,
+        flush_rows=2,
+        max_rows=3,
+        spill_path=None,
+    )
+    for minute in range(5):
+        buf.add(_history_sample(minute))
+    assert buf.stats()["dropped"] == 2
+
+    assert buf.flush() is True
+    assert [s[0].minute for s in batches[0]] == [2, 3, 4]
+    assert buf.stats()["pending"] == 0
+    assert buf.stats()["flushed"] == 3
+
+
+def test_history_buffer_spills_failed_flush_and_restores(tmp_path):
+    # неудачная запись уходит в файл
+    spill = tmp_path / "spill.jsonl"
+    failing = db.HistoryBuffer(
+        lambda batch: False, flush_seconds=60, flush_rows=10, max_rows=100, spill_path=str(spill)
+    )
+    failing.add(_history_sample(1, people=4))
+    assert failing.flush() is False
+    assert failing.stats()["pending"] == 1
+    assert spill.exists()
+
+    # после перезапуска замеры возвращаются
+    batches = []
+    restored = db.HistoryBuffer(
+        lambda batch: batches.append(list(batch)) or True,
+        flush_seconds=60,
+        flush_rows=10,
+        max_rows=100,
+        spill_path=str(spill),
+    )
+    assert restored.load_spill() == 1
+    assert restored.flush() is True
+    assert batches[0] == [_history_sample(1, people=4)]
+    assert not spill.exists()
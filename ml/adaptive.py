@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import threading
+from typing import Any, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+
+class AdaptiveInferenceScheduler:
+    """реже инференс когда в зале ничего не меняется"""
+
+    def __init__(
+        self,
+        min_every_n: int,
+        max_every_n: int,
+        stable_seconds: float,
+        motion_threshold: float,
+        motion_size: tuple = (64, 36),
+    ):
+        self.min_every_n = max(1, int(min_every_n))
+        self.max_every_n = max(self.min_every_n, int(max_every_n))
+        self.stable_seconds = float(stable_seconds)
+        self.motion_threshold = float(motion_threshold)
+        self.motion_size = motion_size
+
+        self.every_n = self.min_every_n
+        self.last_motion = 0.0
+        self.inferred = 0
+        self.skipped = 0
+        self._frames_since_infer: Optional[int] = None
+        self._reference: Optional[np.ndarray] = None
+        self._last_status: Optional[List[int]] = None
+        self._stable_since: Optional[float] = None
+        # кадр решаем в инференсе, статус приходит из стадии столов
+        self._lock = threading.Lock()
+
+    def _small(self, frame) -> np.ndarray:
+        return cv2.resize(frame, self.motion_size, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def motion_score(self, small: np.ndarray) -> float:
+        """средняя разница с кадром прошлого инференса, 0..255"""
+        if self._reference is None or self._reference.shape != small.shape:
+            return float("inf")
+        return float(np.abs(small - self._reference).mean())
+
+    def _reset(self, now_ts: float) -> None:
+        self.every_n = self.min_every_n
+        self._stable_since = now_ts
+
+    def should_infer(self, frame, now_ts: float) -> bool:
+        with self._lock:
+            small = self._small(frame)
+            motion = self.motion_score(small)
+            self.last_motion = motion
+            if motion >= self.motion_threshold:
+                # движение сразу возвращает частый инференс
+                self._reset(now_ts)
+
+            if self._frames_since_infer is not None and self._frames_since_infer + 1 < self.every_n:
+                self._frames_since_infer += 1
+                self.skipped += 1
+                return False
+            self._frames_since_infer = 0
+            self._reference = small
+            self.inferred += 1
+            return True
+
+    def observe_status(self, tables_status: List[int], now_ts: float) -> None:
+        """сглаженный статус столов после кадра"""
+        with self._lock:
+            status = [int(v) for v in tables_status]
+            if status != self._last_status or self._stable_since is None:
+                self._last_status = status
+                self._reset(now_ts)
+                return
+            if now_ts - self._stable_since >= self.stable_seconds and self.every_n < self.max_every_n:
+                # тишина, реже в два раза до максимума
+                self.every_n = min(self.max_every_n, self.every_n * 2)
+                self._stable_since = now_ts
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.inferred + self.skipped
+            return {
+                "every_n": self.every_n,
+                "motion": None if self.last_motion == float("inf") else round(self.last_motion, 2),
+                "inferred": self.inferred,
+                "skipped": self.skipped,
+                "infer_ratio": round(self.inferred / total, 3) if total else 0.0,
+            }
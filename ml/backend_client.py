@@ -1,8 +1,15 @@
 from __future__ import annotations
 
-from typing import List, Optional
+import json
+import struct
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
 
 
 def create_session() -> requests.Session:
@@ -16,6 +23,17 @@ def create_session() -> requests.Session:
     return session
 
 
+def create_keepalive_session() -> requests.Session:
+    """одно постоянное соединение без повторов внутри requests"""
+    session = create_session()
+    # повторы делает публикатор, с бэкоффом
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Connection"] = "keep-alive"
+    return session
+
+
 
 # СВЯЗЬ ML И БЕКЕНДА: HTTP POST
 def post_table_occupancy(
@@ -24,13 +42,27 @@ def post_table_occupancy(
     status_list: List[int],
     timeout_seconds: float = 0.5,
     debug: bool = True,
+    camera_id: Optional[str] = None,
+    first_table_id: int = 1,
+    seq: Optional[int] = None,
+    captured_ts: Optional[float] = None,
+    inferred_ts: Optional[float] = None,
+    posted_ts: Optional[float] = None,
 ) -> Optional[int]:
     """
     отправка статуса столов на бекенд
+    с camera_id бекенд кладет столы с first_table_id
+    времена кадра unix сек нужны бекенду для задержек
     возвращает статус http (none при ошибке соединения)
     """
 
     payload = {"table_occupancy": status_list}
+    if camera_id is not None:
+        payload["camera_id"] = camera_id
+        payload["first_table_id"] = int(first_table_id)
+    for key, value in (("seq", seq), ("captured_ts", captured_ts), ("inferred_ts", inferred_ts), ("posted_ts", posted_ts)):
+        if value is not None:
+            payload[key] = value
 
     if debug:
         print(f"DEBUG: ML отправка данных на {url}: {status_list}")
@@ -58,3 +90,493 @@ def post_table_occupancy(
         if debug:
             print(f"ошибка соединения с бекендом: {e}")
         return None
+
+
+# бинарный кадр, формат как в backend/models.py
+OCCUPANCY_FRAME_MAGIC = b"OC"
+OCCUPANCY_FRAME_VERSION = 2
+OCCUPANCY_FRAME_HEADER = struct.Struct("<2sBBHIdffH")
+OCCUPANCY_FRAME_CONTENT_TYPE = "application/x-occupancy"
+
+
+def encode_occupancy_frame(
+    status_list: List[int],
+    seq: int,
+    captured_ts: float,
+    camera_id: Optional[str] = None,
+    first_table_id: int = 1,
+    inferred_ts: Optional[float] = None,
+    posted_ts: Optional[float] = None,
+) -> bytes:
+    """заголовок 28 байт, id камеры и по байту на стол"""
+    camera = (camera_id or "").encode("utf-8")
+    header = OCCUPANCY_FRAME_HEADER.pack(
+        OCCUPANCY_FRAME_MAGIC,
+        OCCUPANCY_FRAME_VERSION,
+        len(camera),
+        int(first_table_id),
+        int(seq) & 0xFFFFFFFF,
+        float(captured_ts),
+        # задержки от захвата, nan когда времени нет
+        float("nan") if inferred_ts is None else inferred_ts - captured_ts,
+        float("nan") if posted_ts is None else posted_ts - captured_ts,
+        len(status_list),
+    )
+    return header + camera + bytes(min(255, max(0, int(v))) for v in status_list)
+
+
+def post_table_occupancy_binary(
+    session: requests.Session,
+    url: str,
+    status_list: List[int],
+    seq: int,
+    captured_ts: float,
+    timeout_seconds: float = 0.5,
+    camera_id: Optional[str] = None,
+    first_table_id: int = 1,
+    inferred_ts: Optional[float] = None,
+    posted_ts: Optional[float] = None,
+) -> Optional[int]:
+    """то же что post_table_occupancy, но компактным кадром"""
+    body = encode_occupancy_frame(status_list, seq, captured_ts, camera_id, first_table_id, inferred_ts, posted_ts)
+    try:
+        response = session.post(
+            url, data=body, headers={"Content-Type": OCCUPANCY_FRAME_CONTENT_TYPE}, timeout=timeout_seconds
+        )
+        return int(response.status_code)
+    except requests.exceptions.RequestException:
+        return None
+
+
+def post_heartbeat(
+    session: requests.Session,
+    url: str,
+    n_tables: int,
+    timeout_seconds: float = 0.5,
+    camera_id: Optional[str] = None,
+) -> Optional[int]:
+    """детектор жив, статус прежний, бекенд историю не пишет"""
+    payload = {"tables": int(n_tables)}
+    if camera_id is not None:
+        payload["camera_id"] = camera_id
+    try:
+        response = session.post(url, json=payload, timeout=timeout_seconds)
+        return int(response.status_code)
+    except requests.exceptions.RequestException:
+        return None
+
+
+class PostingPolicy:
+    """
+    когда слать статус одной камеры
+    изменение не чаще min_gap, в тишине только редкий heartbeat
+    """
+
+    def __init__(self, min_gap_seconds: float = 0.5, heartbeat_seconds: float = 15.0):
+        self.min_gap_seconds = float(min_gap_seconds)
+        self.heartbeat_seconds = float(heartbeat_seconds)
+        self.last_status: Optional[List[int]] = None
+        self.last_update_ts = float("-inf")
+        self.last_contact_ts = float("-inf")
+
+    def decide(self, status_list: List[int], now_ts: float) -> Optional[str]:
+        """update, heartbeat или none"""
+        if status_list != self.last_status:
+            # всплеск изменений схлопывается, последнее уйдет после паузы
+            if now_ts - self.last_update_ts >= self.min_gap_seconds:
+                self.last_status = list(status_list)
+                self.last_update_ts = self.last_contact_ts = now_ts
+                return "update"
+            return None
+        if now_ts - self.last_contact_ts >= self.heartbeat_seconds:
+            self.last_contact_ts = now_ts
+            return "heartbeat"
+        return None
+
+
+@dataclass
+class _PendingUpdate:
+    status_list: List[int]
+    camera_id: Optional[str]
+    first_table_id: int
+    published_ts: float
+    seq: int = 0
+    captured_ts: float = 0.0
+    inferred_ts: Optional[float] = None
+    heartbeat: bool = False
+    # число столов для heartbeat
+    n_tables: int = 0
+    # когда ушло на бекенд, для задержек и таймаута подтверждения
+    sent_ts: float = 0.0
+
+
+class OccupancyPublisher:
+    """
+    отправка статуса в фоне, кадровый цикл не ждет бекенд
+    на камеру хранится только последний статус, старый затирается
+    """
+
+    def __init__(
+        self,
+        url: str,
+        heartbeat_url: Optional[str] = None,
+        binary_url: Optional[str] = None,
+        timeout_seconds: float = 2.0,
+        backoff_initial_seconds: float = 0.5,
+        backoff_max_seconds: float = 10.0,
+        send_fn: Optional[Callable[..., Optional[int]]] = None,
+        latency_window: int = 200,
+    ):
+        self.url = url
+        self.heartbeat_url = heartbeat_url
+        # с binary_url статус уходит бинарным кадром
+        self.binary_url = binary_url
+        self.timeout_seconds = float(timeout_seconds)
+        self.backoff_initial_seconds = float(backoff_initial_seconds)
+        self.backoff_max_seconds = float(backoff_max_seconds)
+        self._session: Optional[requests.Session] = None
+        self._send_fn = send_fn or self._post
+        self._cond = threading.Condition()
+        # камера -> последний неотправленный статус
+        self._pending: Dict[Optional[str], _PendingUpdate] = {}
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self._seq = 0
+        self.sent = 0
+        self.heartbeats = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.retries = 0
+        # от publish до ответа бекенда
+        self._latency_ms = deque(maxlen=latency_window)
+
+    def start(self) -> "OccupancyPublisher":
+        self._thread = threading.Thread(target=self._run, name="publisher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 2.0) -> None:
+        """ждем последнюю отправку не дольше timeout"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._session is not None:
+            self._session.close()
+
+    def publish(
+        self,
+        status_list: List[int],
+        camera_id: Optional[str] = None,
+        first_table_id: int = 1,
+        captured_ts: Optional[float] = None,
+        inferred_ts: Optional[float] = None,
+    ) -> None:
+        """не блокирует, неотправленный статус этой камеры заменяется"""
+        now = time.time()
+        update = _PendingUpdate(
+            list(status_list),
+            camera_id,
+            int(first_table_id),
+            now,
+            captured_ts=now if captured_ts is None else captured_ts,
+            inferred_ts=inferred_ts,
+        )
+        with self._cond:
+            self._seq += 1
+            update.seq = self._seq
+            pending = self._pending.get(camera_id)
+            if pending is not None and not pending.heartbeat:
+                self.coalesced += 1
+            self._pending[camera_id] = update
+            self._cond.notify()
+
+    def heartbeat(self, n_tables: int, camera_id: Optional[str] = None) -> None:
+        """не блокирует, при неотправленном статусе камеры не нужен"""
+        if self.heartbeat_url is None:
+            return
+        update = _PendingUpdate([], camera_id, 1, time.time(), heartbeat=True, n_tables=int(n_tables))
+        with self._cond:
+            if camera_id in self._pending:
+                return
+            self._seq += 1
+            update.seq = self._seq
+            self._pending[camera_id] = update
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        with self._cond:
+            latency = sorted(self._latency_ms)
+            return {
+                "sent": self.sent,
+                "heartbeats": self.heartbeats,
+                "coalesced": self.coalesced,
+                "failed": self.failed,
+                "retries": self.retries,
+                "pending": len(self._pending),
+                "latency_ms_p50": latency[len(latency) // 2] if latency else None,
+                "latency_ms_max": latency[-1] if latency else None,
+            }
+
+    def _requeue(self, update: _PendingUpdate) -> None:
+        """вернуть неотправленное, если по камере нет нового статуса"""
+        pending = self._pending.get(update.camera_id)
+        if pending is None or (pending.heartbeat and not update.heartbeat):
+            self._pending[update.camera_id] = update
+
+    def _post(self, update: _PendingUpdate) -> Optional[int]:
+        if self._session is None:
+            self._session = create_keepalive_session()
+        if update.heartbeat:
+            return post_heartbeat(
+                self._session,
+                self.heartbeat_url,
+                update.n_tables,
+                timeout_seconds=self.timeout_seconds,
+                camera_id=update.camera_id,
+            )
+        if self.binary_url is not None:
+            return post_table_occupancy_binary(
+                self._session,
+                self.binary_url,
+                update.status_list,
+                update.seq,
+                update.captured_ts,
+                timeout_seconds=self.timeout_seconds,
+                camera_id=update.camera_id,
+                first_table_id=update.first_table_id,
+                inferred_ts=update.inferred_ts,
+                posted_ts=update.sent_ts,
+            )
+        return post_table_occupancy(
+            self._session,
+            self.url,
+            update.status_list,
+            timeout_seconds=self.timeout_seconds,
+            debug=False,
+            camera_id=update.camera_id,
+            first_table_id=update.first_table_id,
+            seq=update.seq,
+            captured_ts=update.captured_ts,
+            inferred_ts=update.inferred_ts,
+            posted_ts=update.sent_ts,
+        )
+
+    def _run(self) -> None:
+        backoff = self.backoff_initial_seconds
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopping:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                # самая давняя камера первой
+                camera_id = next(iter(self._pending))
+                update = self._pending.pop(camera_id)
+
+            update.sent_ts = time.time()
+            status_code = self._send_fn(update)
+            with self._cond:
+                if status_code is not None and status_code < 400 and update.heartbeat:
+                    self.heartbeats += 1
+                    backoff = self.backoff_initial_seconds
+                    continue
+                if status_code is not None and status_code < 400:
+                    self.sent += 1
+                    self._latency_ms.append(1000.0 * (time.time() - update.published_ts))
+                    backoff = self.backoff_initial_seconds
+                    continue
+                self.failed += 1
+                if status_code is not None and status_code < 500:
+                    # 4xx повтором не исправить
+                    continue
+                if self._stopping:
+                    return
+                # бекенд лежит: вернем статус если новее не пришел
+                self._requeue(update)
+                self.retries += 1
+                self._cond.wait_for(lambda: self._stopping, timeout=backoff)
+                backoff = min(backoff * 2, self.backoff_max_seconds)
+
+
+class WebSocketPublisher(OccupancyPublisher):
+    """
+    тот же publish по одному постоянному вебсокету
+    кадры уходят без ожидания ответа, бекенд подтверждает пачкой
+    при обрыве переподключаемся, неподтвержденное шлем заново
+    """
+
+    def __init__(
+        self,
+        ws_url: str,
+        timeout_seconds: float = 2.0,
+        backoff_initial_seconds: float = 0.5,
+        backoff_max_seconds: float = 10.0,
+        connect_fn: Optional[Callable[[], object]] = None,
+        latency_window: int = 200,
+    ):
+        super().__init__(
+            ws_url,
+            heartbeat_url=ws_url,
+            timeout_seconds=timeout_seconds,
+            backoff_initial_seconds=backoff_initial_seconds,
+            backoff_max_seconds=backoff_max_seconds,
+            latency_window=latency_window,
+        )
+        self._connect_fn = connect_fn or self._connect
+        self._ws = None
+        # номер -> отправленное без подтверждения
+        self._unacked: Dict[int, _PendingUpdate] = {}
+        self._retry_at = 0.0
+        self._nack_backoff = self.backoff_initial_seconds
+        self.connects = 0
+        self.acks = 0
+
+    def _connect(self):
+        # websocket-client нужен только для канала
+        import websocket
+
+        return websocket.create_connection(self.url, timeout=self.timeout_seconds, enable_multithread=True)
+
+    def stats(self) -> dict:
+        st = super().stats()
+        with self._cond:
+            st.update({"connects": self.connects, "acks": self.acks, "unacked": len(self._unacked)})
+        return st
+
+    def _drop(self, ws) -> None:
+        with self._cond:
+            if self._ws is ws:
+                self._ws = None
+                self._cond.notify_all()
+        try:
+            ws.close()
+        except Exception:
+            pass
+
+    def _receive(self, ws) -> None:
+        # ответы читает свой поток, отправка не ждет
+        while True:
+            try:
+                raw = ws.recv()
+            except Exception:
+                break
+            if not raw:
+                break
+            try:
+                message = json.loads(raw)
+            except ValueError:
+                continue
+            with self._cond:
+                self._on_reply(message)
+        self._drop(ws)
+
+    def _on_reply(self, message: dict) -> None:
+        seq = message.get("seq")
+        if message.get("type") == "nack" and seq is not None:
+            update = self._unacked.pop(int(seq), None)
+            if update is None:
+                return
+            self.failed += 1
+            if int(message.get("status", 500)) >= 500:
+                # бекенд не записал: повтор после паузы
+                self.retries += 1
+                self._requeue(update)
+                self._retry_at = time.time() + self._nack_backoff
+                self._nack_backoff = min(self._nack_backoff * 2, self.backoff_max_seconds)
+            self._cond.notify_all()
+        elif message.get("type") == "ack" and seq is not None:
+            self.acks += 1
+            self._nack_backoff = self.backoff_initial_seconds
+            now = time.time()
+            for acked in [s for s in self._unacked if s <= int(seq)]:
+                update = self._unacked.pop(acked)
+                if update.heartbeat:
+                    self.heartbeats += 1
+                else:
+                    self.sent += 1
+                    self._latency_ms.append(1000.0 * (now - update.published_ts))
+            self._cond.notify_all()
+
+    def _send(self, ws, update: _PendingUpdate) -> None:
+        if update.heartbeat:
+            ws.send(json.dumps({"type": "heartbeat", "seq": update.seq, "camera_id": update.camera_id, "tables": update.n_tables}))
+        else:
+            ws.send_binary(
+                encode_occupancy_frame(
+                    update.status_list,
+                    update.seq,
+                    update.captured_ts,
+                    update.camera_id,
+                    update.first_table_id,
+                    update.inferred_ts,
+                    update.sent_ts,
+                )
+            )
+
+    def _ack_overdue(self) -> bool:
+        oldest = next(iter(self._unacked.values()), None)
+        return oldest is not None and time.time() - oldest.sent_ts > self.timeout_seconds
+
+    def _run(self) -> None:
+        backoff = self.backoff_initial_seconds
+        while True:
+            with self._cond:
+                ws = self._ws
+                if self._stopping and (ws is None or not self._pending):
+                    break
+            if ws is None:
+                try:
+                    ws = self._connect_fn()
+                except Exception:
+                    with self._cond:
+                        self.retries += 1
+                        self._cond.wait_for(lambda: self._stopping, timeout=backoff)
+                    backoff = min(backoff * 2, self.backoff_max_seconds)
+                    continue
+                backoff = self.backoff_initial_seconds
+                with self._cond:
+                    self._ws = ws
+                    self.connects += 1
+                    # что не подтвердили до обрыва, отправим заново
+                    for update in self._unacked.values():
+                        self._requeue(update)
+                    self._unacked.clear()
+                threading.Thread(target=self._receive, args=(ws,), name="publisher-acks", daemon=True).start()
+
+            with self._cond:
+                while self._ws is ws and not self._stopping:
+                    if self._ack_overdue():
+                        break
+                    if self._pending and time.time() >= self._retry_at:
+                        break
+                    self._cond.wait(timeout=self.timeout_seconds / 4)
+                if self._ws is not ws:
+                    continue
+                if self._ack_overdue():
+                    # бекенд молчит, соединение считаем мертвым
+                    batch = None
+                else:
+                    # по номеру: ack бекенда накопительный
+                    batch = sorted(self._pending.values(), key=lambda u: u.seq)
+                    self._pending.clear()
+                    now = time.time()
+                    for update in batch:
+                        update.sent_ts = now
+                        self._unacked[update.seq] = update
+            if batch is None:
+                self._drop(ws)
+                continue
+            try:
+                for update in batch:
+                    self._send(ws, update)
+            except Exception:
+                self._drop(ws)
+
+        # при остановке ждем подтверждения последнего
+        with self._cond:
+            self._cond.wait_for(lambda: not self._unacked or self._ws is None, timeout=self.timeout_seconds)
+            ws = self._ws
+        if ws is not None:
+            self._drop(ws)
@@ -0,0 +1,389 @@
+"""бенчмарки хелперов детектора и профилей модели
+
+запуск из папки ml:
+    python bench.py roi --people 50 --tables 40
+    python bench.py dedup --boxes 60 --tables 20
+    python bench.py render --people 50 --tables 40
+    python bench.py crop --width 1280 --height 720
+    python bench.py profiles --video v1.MP4 --frames 300
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from detector_utils import (
+    RoiMatcher,
+    best_roi_for_bbox,
+    dedup_boxes_by_iou,
+    dedup_boxes_by_iou_array,
+    dedup_boxes_by_iou_grouped,
+)
+from roi_raster import RoiRaster
+
+
+def _random_scene(rng, n_tables, n_people, width=1920, height=1080):
+    # столы сеткой люди вокруг столов
+    rois = []
+    cols = max(1, int(np.ceil(np.sqrt(n_tables))))
+    for t in range(n_tables):
+        cx = (t % cols + 0.5) * width / cols
+        cy = (t // cols + 0.5) * height / cols
+        w, h = width / cols * 0.35, height / cols * 0.35
+        rois.append(np.array(
+            [[cx - w, cy - h], [cx + w, cy - h], [cx + w, cy + h], [cx - w, cy + h]],
+            dtype=np.int32,
+        ))
+    boxes = []
+    for _ in range(n_people):
+        x1, y1 = rng.uniform(0, width - 80), rng.uniform(0, height - 160)
+        boxes.append((x1, y1, x1 + rng.uniform(40, 80), y1 + rng.uniform(100, 160)))
+    return rois, boxes
+
+
+def _time_ms(fn, repeat):
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - started) * 1000.0)
+    return statistics.median(latencies)
+
+
+def bench_roi(people, tables, margin, repeat, width=1920, height=1080):
+    rng = np.random.default_rng(0)
+    rois, boxes = _random_scene(rng, tables, people, width, height)
+
+    scalar = [best_roi_for_bbox(rois, box, margin) for box in boxes]
+    matcher = RoiMatcher(rois, margin)
+    vectorized = matcher.best_rois(boxes)
+    if scalar != vectorized:
+        raise SystemExit("ОШИБКА: назначения не совпали")
+
+    raster = RoiRaster.build(rois, width, height, margin)
+    if raster.best_rois(boxes) != scalar:
+        raise SystemExit("ОШИБКА: назначения растра не совпали")
+
+    prepare_ms = _time_ms(lambda: RoiMatcher(rois, margin), repeat)
+    raster_build_ms = _time_ms(lambda: RoiRaster.build(rois, width, height, margin), 3)
+    scalar_ms = _time_ms(lambda: [best_roi_for_bbox(rois, box, margin) for box in boxes], repeat)
+    vector_ms = _time_ms(lambda: matcher.best_rois(boxes), repeat)
+    raster_ms = _time_ms(lambda: raster.best_rois(boxes), repeat)
+
+    print(f"{people} people x {tables} tables, margin {margin}px, assignments equal")
+    print(f"{'impl':<22} | {'ms per frame':>12}")
+    print("-" * 38)
+    print(f"{'scalar python':<22} | {scalar_ms:>12.3f}")
+    print(f"{'RoiMatcher (numpy)':<22} | {vector_ms:>12.3f}")
+    print(f"{'RoiRaster lookup':<22} | {raster_ms:>12.3f}")
+    print(f"{'RoiMatcher prepare':<22} | {prepare_ms:>12.3f}")
+    print(f"{'RoiRaster build':<22} | {raster_build_ms:>12.3f}")
+    print(f"speedup x{scalar_ms / vector_ms:.1f} (numpy), x{scalar_ms / raster_ms:.1f} (raster)")
+
+
+def _random_table_boxes(rng, n_tables, n_boxes):
+    # по столу кучка боксов с дублями
+    groups = [[] for _ in range(n_tables)]
+    scores = [[] for _ in range(n_tables)]
+    for _ in range(n_boxes):
+        t = int(rng.integers(0, n_tables))
+        cx, cy = (t % 8) * 200 + 100 + rng.normal(0, 10), (t // 8) * 250 + 120 + rng.normal(0, 10)
+        w, h = rng.uniform(40, 80), rng.uniform(100, 160)
+        groups[t].append((cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2))
+        scores[t].append(float(rng.uniform(0.3, 1.0)))
+    return groups, scores
+
+
+def bench_dedup(n_boxes, tables, threshold, repeat):
+    rng = np.random.default_rng(0)
+    groups, scores = _random_table_boxes(rng, tables, n_boxes)
+
+    def scalar():
+        return [dedup_boxes_by_iou(g, s, threshold) if g else [] for g, s in zip(groups, scores)]
+
+    def per_table_array():
+        return [dedup_boxes_by_iou_array(g, s, threshold) if g else [] for g, s in zip(groups, scores)]
+
+    def grouped():
+        return dedup_boxes_by_iou_grouped(groups, scores, threshold)
+
+    if not (scalar() == per_table_array() == grouped()):
+        raise SystemExit("ОШИБКА: дедуп не совпал")
+
+    rows = [
+        ("scalar python", _time_ms(scalar, repeat)),
+        ("numpy per table", _time_ms(per_table_array, repeat)),
+        ("numpy all tables", _time_ms(grouped, repeat)),
+    ]
+    kept = sum(len(k) for k in grouped())
+    print(f"{n_boxes} boxes x {tables} tables, iou {threshold}, kept {kept}, results equal")
+    print(f"{'impl':<22} | {'ms per frame':>12}")
+    print("-" * 38)
+    for name, ms in rows:
+        print(f"{name:<22} | {ms:>12.3f}")
+
+
+def bench_render(people, tables, repeat, width=1920, height=1080):
+    # отрисовка без окна, imshow сюда не входит
+    import cv2
+
+    from main_detector import FramePacket, draw_overlay
+    from occupancy import Detection
+
+    rng = np.random.default_rng(0)
+    rois, boxes = _random_scene(rng, tables, people, width, height)
+    frame = rng.integers(0, 255, size=(height, width, 3), dtype=np.uint8)
+    packet = FramePacket(index=0, captured_ts=0.0, frame=frame)
+    packet.detections = [
+        Detection(box=box, center=(int((box[0] + box[2]) / 2), int((box[1] + box[3]) / 2)), table_idx=i % 2 or None)
+        for i, box in enumerate(boxes)
+    ]
+    packet.tables_status = [int(v) for v in rng.integers(0, 4, size=tables)]
+    entry_line = ((100, 100), (100, 900))
+
+    def old_render():
+        output = frame.copy()
+        draw_overlay(output, rois, entry_line, packet)
+
+    def in_place():
+        draw_overlay(frame, rois, entry_line, packet)
+
+    copy_ms = _time_ms(frame.copy, repeat)
+    old_ms = _time_ms(old_render, repeat)
+    draw_ms = _time_ms(in_place, repeat)
+    jpeg_ms = _time_ms(lambda: cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), 80]), repeat)
+
+    print(f"{width}x{height}, {people} people, {tables} tables")
+    print(f"{'stage':<26} | {'ms per frame':>12}")
+    print("-" * 42)
+    print(f"{'frame.copy':<26} | {copy_ms:>12.3f}")
+    print(f"{'copy + overlay (before)':<26} | {old_ms:>12.3f}")
+    print(f"{'overlay in place (gui)':<26} | {draw_ms:>12.3f}")
+    print(f"{'headless':<26} | {0.0:>12.3f}")
+    print(f"{'jpeg snapshot (per shot)':<26} | {jpeg_ms:>12.3f}")
+    for infer_ms in (30.0, 60.0):
+        # прежний цикл шел последовательно
+        print(
+            f"sequential loop at {infer_ms:.0f} ms inference: "
+            f"{1000.0 / (infer_ms + old_ms):.1f} fps annotated -> {1000.0 / infer_ms:.1f} fps headless"
+        )
+
+
+def bench_crop(width, height, imgsz, pad, pad_top, repeat):
+    # пиксели на инференс для текущих tables.pkl и широкой сцены
+    import pickle
+
+    from roi_crop import CropLayout
+
+    scenes = []
+    try:
+        with open("tables.pkl", "rb") as f:
+            rois = pickle.load(f)
+        with open("entry_lines.pkl", "rb") as f:
+            entry_line = pickle.load(f)["line"]
+        scenes.append(("tables.pkl", rois, entry_line, width, height))
+    except FileNotFoundError:
+        pass
+    # две зоны столов по краям широкого кадра
+    wide = [
+        np.array([[x, y], [x + 160, y], [x + 160, y + 90], [x, y + 90]], dtype=np.int32)
+        for x in (200, 400, 3000, 3200)
+        for y in (1200, 1400)
+    ]
+    scenes.append(("wide 3840x2160", wide, ((1800, 1900), (2000, 1900)), 3840, 2160))
+
+    print(f"{'scene':<16} | {'regions':>7} | {'mosaic':>11} | {'pixels':>6} | {'scale@imgsz':>14} | {'compose ms':>10}")
+    print("-" * 80)
+    for name, rois, entry_line, w, h in scenes:
+        layout = CropLayout.build(rois, entry_line, w, h, int(pad * h), int(pad_top * h))
+        frame = np.zeros((h, w, 3), dtype=np.uint8)
+        compose_ms = _time_ms(lambda: layout.compose(frame), repeat)
+        # во сколько раз крупнее люди при том же imgsz
+        full_scale = imgsz / max(w, h)
+        crop_scale = imgsz / max(layout.mosaic_width, layout.mosaic_height)
+        print(
+            f"{name:<16} | {len(layout.regions):>7} | {layout.mosaic_width:>5}x{layout.mosaic_height:<5} | "
+            f"{layout.pixel_ratio:>6.0%} | {full_scale:.2f} -> {crop_scale:.2f} | {compose_ms:>10.3f}"
+        )
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # линукс в килобайтах, мак в байтах
+        return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+    except ImportError:
+        pass
+    try:
+        import psutil
+
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / (1024.0 * 1024.0)
+    except ImportError:
+        return None
+
+
+def run_profile(name, video, frames, warmup, tables_path, entry_lines_path):
+    """один профиль по видео подряд, каждый кадр в инференс"""
+    import cv2
+
+    from main_detector import build_backend, build_id_tracker, build_tracker, load_scene
+    from profiles import get_profile
+
+    rois, entry_line, inside_ref_point = load_scene(tables_path, entry_lines_path)
+    backend = build_backend(get_profile(name))
+    id_tracker = None if backend.tracks else build_id_tracker()
+    tracker = build_tracker(rois, entry_line, inside_ref_point)
+
+    cap = cv2.VideoCapture(video)
+    video_fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    counts = []
+    started = cpu_started = None
+    index = 0
+    while index < frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if index == warmup:
+            # прогрев модели не считаем
+            started, cpu_started = time.perf_counter(), time.process_time()
+        # время видео, чтобы сглаживание не зависело от скорости
+        ts = index / video_fps
+        boxes, ids, confs = backend.detect(frame)
+        if id_tracker is not None:
+            ids = id_tracker.update(boxes, ts)
+        _, tables_status = tracker.process(boxes, ids, confs, frame.shape, ts)
+        counts.append([int(v) for v in tables_status])
+        index += 1
+    cap.release()
+
+    timed = index - warmup
+    if started is None or timed <= 0:
+        raise ValueError(f"в видео {index} кадров, меньше прогрева {warmup}")
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    return {
+        "profile": name,
+        "frames": timed,
+        "fps": timed / wall,
+        "cpu_ms_per_frame": 1000.0 * cpu / timed,
+        "peak_rss_mb": _peak_rss_mb(),
+        "counts": counts,
+    }
+
+
+def bench_profiles(names, video, frames, warmup, tables_path, entry_lines_path):
+    # каждый профиль в своем процессе, иначе пик памяти общий
+    from profiles import compare_counts
+
+    results = []
+    for name in names:
+        with tempfile.TemporaryDirectory() as tmp:
+            out_path = os.path.join(tmp, "result.json")
+            cmd = [
+                sys.executable, os.path.abspath(__file__), "profile-run", name,
+                "--video", video, "--frames", str(frames), "--warmup", str(warmup),
+                "--tables", tables_path, "--entry-lines", entry_lines_path, "--out", out_path,
+            ]
+            proc = subprocess.run(cmd, capture_output=True, text=True)
+            if proc.returncode != 0 or not os.path.exists(out_path):
+                print(f"{name}: ошибка\n{proc.stderr.strip()[-2000:]}")
+                continue
+            with open(out_path, "r", encoding="utf-8") as f:
+                results.append(json.load(f))
+    if not results:
+        return
+
+    reference = next((r for r in results if r["profile"] == "accurate"), results[0])
+    print(f"{video}, {frames} frames max, warmup {warmup}, counts vs {reference['profile']}")
+    print(
+        f"{'profile':<10} | {'fps':>6} | {'cpu ms/frame':>12} | {'peak rss MB':>11} | "
+        f"{'mean |diff|':>11} | {'max diff':>8} | {'frames equal':>12}"
+    )
+    print("-" * 88)
+    for r in results:
+        diff = compare_counts(reference["counts"], r["counts"])
+        rss = "n/a" if r["peak_rss_mb"] is None else f"{r['peak_rss_mb']:.0f}"
+        print(
+            f"{r['profile']:<10} | {r['fps']:>6.1f} | {r['cpu_ms_per_frame']:>12.1f} | {rss:>11} | "
+            f"{diff['mean_abs_diff']:>11.3f} | {diff['max_abs_diff']:>8} | {diff['frames_equal']:>12.0%}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ml helper benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_roi = sub.add_parser("roi", help="box to table assignment")
+    p_roi.add_argument("--people", type=int, default=50)
+    p_roi.add_argument("--tables", type=int, default=40)
+    p_roi.add_argument("--margin", type=float, default=6.0)
+    p_roi.add_argument("--repeat", type=int, default=20)
+
+    p_dedup = sub.add_parser("dedup", help="per table box dedup")
+    p_dedup.add_argument("--boxes", type=int, default=60)
+    p_dedup.add_argument("--tables", type=int, default=20)
+    p_dedup.add_argument("--iou", type=float, default=0.6)
+    p_dedup.add_argument("--repeat", type=int, default=50)
+
+    p_render = sub.add_parser("render", help="annotation stage on vs headless")
+    p_render.add_argument("--people", type=int, default=50)
+    p_render.add_argument("--tables", type=int, default=40)
+    p_render.add_argument("--repeat", type=int, default=30)
+
+    p_crop = sub.add_parser("crop", help="pixels per inference with roi crops")
+    p_crop.add_argument("--width", type=int, default=1280)
+    p_crop.add_argument("--height", type=int, default=720)
+    p_crop.add_argument("--imgsz", type=int, default=960)
+    p_crop.add_argument("--pad", type=float, default=0.05)
+    p_crop.add_argument("--pad-top", type=float, default=0.2)
+    p_crop.add_argument("--repeat", type=int, default=30)
+
+    from profiles import MODEL_PROFILES
+
+    p_profiles = sub.add_parser("profiles", help="model profiles over a recorded video")
+    p_profiles.add_argument("--video", required=True)
+    p_profiles.add_argument("--profiles", nargs="+", default=list(MODEL_PROFILES), choices=list(MODEL_PROFILES))
+    p_profiles.add_argument("--frames", type=int, default=300)
+    p_profiles.add_argument("--warmup", type=int, default=10)
+    p_profiles.add_argument("--tables", default="tables.pkl")
+    p_profiles.add_argument("--entry-lines", default="entry_lines.pkl")
+
+    # один профиль в отдельном процессе, вызывает profiles
+    p_run = sub.add_parser("profile-run")
+    p_run.add_argument("profile", choices=list(MODEL_PROFILES))
+    p_run.add_argument("--video", required=True)
+    p_run.add_argument("--frames", type=int, default=300)
+    p_run.add_argument("--warmup", type=int, default=10)
+    p_run.add_argument("--tables", default="tables.pkl")
+    p_run.add_argument("--entry-lines", default="entry_lines.pkl")
+    p_run.add_argument("--out", required=True)
+
+    args = parser.parse_args()
+    if args.command == "roi":
+        bench_roi(args.people, args.tables, args.margin, args.repeat)
+    elif args.command == "dedup":
+        bench_dedup(args.boxes, args.tables, args.iou, args.repeat)
+    elif args.command == "render":
+        bench_render(args.people, args.tables, args.repeat)
+    elif args.command == "crop":
+        bench_crop(args.width, args.height, args.imgsz, args.pad, args.pad_top, args.repeat)
+    elif args.command == "profiles":
+        bench_profiles(args.profiles, args.video, args.frames, args.warmup, args.tables, args.entry_lines)
+    elif args.command == "profile-run":
+        result = run_profile(args.profile, args.video, args.frames, args.warmup, args.tables, args.entry_lines)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+
+
+if __name__ == "__main__":
+    main()
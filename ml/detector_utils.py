@@ -3,6 +3,8 @@ from __future__ import annotations
 import math
 from typing import Iterable, List, Optional, Sequence, Tuple
 
+import numpy as np
+
 BoxXYXY = Tuple[float, float, float, float]
 PointXY = Tuple[int, int]
 
@@ -165,6 +167,85 @@ def dedup_boxes_by_iou(
     return keep
 
 
+def iou_matrix(boxes: np.ndarray) -> np.ndarray:
+    """айоу всех пар боксов разом, можно пачкой (..., n, 4)"""
+    b = np.asarray(boxes, dtype=np.float64)
+    if b.ndim == 1:
+        b = b.reshape(-1, 4)
+    x1, y1, x2, y2 = b[..., 0], b[..., 1], b[..., 2], b[..., 3]
+
+    inter_w = np.maximum(
+        0.0, np.minimum(x2[..., :, None], x2[..., None, :]) - np.maximum(x1[..., :, None], x1[..., None, :])
+    )
+    inter_h = np.maximum(
+        0.0, np.minimum(y2[..., :, None], y2[..., None, :]) - np.maximum(y1[..., :, None], y1[..., None, :])
+    )
+    inter_area = inter_w * inter_h
+
+    area = np.maximum(0.0, x2 - x1) * np.maximum(0.0, y2 - y1)
+    denom = area[..., :, None] + area[..., None, :] - inter_area
+    with np.errstate(divide="ignore", invalid="ignore"):
+        iou = inter_area / denom
+    return np.where(denom > 0, iou, 0.0)
+
+
+def dedup_boxes_by_iou_array(
+    boxes: Optional[Sequence[Sequence[float]]],
+    scores: Optional[Sequence[float]] = None,
+    iou_threshold: float = 0.6,
+) -> List[int]:
+    """дедуп боксов через матрицу айоу"""
+
+    if boxes is None or len(boxes) == 0:
+        return []
+    return dedup_boxes_by_iou_grouped([boxes], None if scores is None else [scores], iou_threshold)[0]
+
+
+def dedup_boxes_by_iou_grouped(
+    boxes_per_group: Sequence[Sequence[Sequence[float]]],
+    scores_per_group: Optional[Sequence[Sequence[float]]] = None,
+    iou_threshold: float = 0.6,
+) -> List[List[int]]:
+    """дедуп для всех столов одним вызовом"""
+
+    sizes = [0 if g is None else len(g) for g in boxes_per_group]
+    n_groups = len(sizes)
+    width = max(sizes, default=0)
+    if width == 0:
+        return [[] for _ in sizes]
+
+    # столы добиваем до одной длины
+    boxes = np.zeros((n_groups, width, 4), dtype=np.float64)
+    scores = np.full((n_groups, width), -np.inf)
+    for g, size in enumerate(sizes):
+        if not size:
+            continue
+        boxes[g, :size] = np.asarray(boxes_per_group[g], dtype=np.float64).reshape(size, 4)
+        if scores_per_group is None:
+            scores[g, :size] = 1.0
+        else:
+            scores[g, :size] = np.asarray(scores_per_group[g], dtype=np.float64).reshape(size)
+
+    over = iou_matrix(boxes) >= iou_threshold
+    # стабильная сортировка как sorted reverse, пустые в конце
+    order = np.argsort(-scores, axis=1, kind="stable")
+    rows = np.arange(n_groups)
+    suppressed = np.zeros((n_groups, width), dtype=bool)
+    suppressed[np.arange(width)[None, :] >= np.asarray(sizes)[:, None]] = True
+    kept = np.zeros((n_groups, width), dtype=bool)
+
+    # жадный проход по рангу сразу для всех столов
+    for k in range(width):
+        cand = order[:, k]
+        ok = ~suppressed[rows, cand]
+        if not ok.any():
+            continue
+        kept[:, k] = ok
+        suppressed |= over[rows, cand] & ok[:, None]
+
+    return [order[g][kept[g]].tolist() for g in range(n_groups)]
+
+
 def is_point_in_roi(roi, point: PointXY, roi_margin_px: float) -> bool:
     # проверяем точку внутри рои
     # допускаем небольшой запас пикселей
@@ -198,3 +279,106 @@ def best_roi_for_bbox(rois: Iterable, box: Sequence[float], roi_margin_px: float
             best_idx = idx
 
     return best_idx
+
+
+class RoiMatcher:
+    """рои заранее разобранные для пакетного выбора"""
+
+    def __init__(self, rois: Iterable, roi_margin_px: float):
+        self.roi_margin_px = float(roi_margin_px)
+        polys = [_roi_points(roi) for roi in rois]
+        self.n_rois = len(polys)
+
+        # ребра всех рои в общих массивах
+        max_edges = max((len(p) for p in polys), default=0)
+        self._a = np.zeros((self.n_rois, max_edges, 2), dtype=np.float64)
+        self._b = np.zeros((self.n_rois, max_edges, 2), dtype=np.float64)
+        self._edge_mask = np.zeros((self.n_rois, max_edges), dtype=bool)
+        # рои меньше трех точек не содержат точек
+        self._can_contain = np.array([len(p) >= 3 for p in polys], dtype=bool)
+        self._valid = np.array([len(p) >= 2 for p in polys], dtype=bool)
+
+        for r, poly in enumerate(polys):
+            n = len(poly)
+            for e in range(n):
+                self._a[r, e] = poly[e - 1]
+                self._b[r, e] = poly[e]
+                self._edge_mask[r, e] = True
+
+    def signed_distances(self, points: np.ndarray) -> np.ndarray:
+        """знаковые расстояния точек до всех рои"""
+        # points (m 2) результат (m r)
+        m = points.shape[0]
+        if self.n_rois == 0 or self._a.shape[1] == 0:
+            return np.full((m, self.n_rois), -np.inf)
+
+        px = points[:, 0][:, None, None]
+        py = points[:, 1][:, None, None]
+        ax, ay = self._a[None, :, :, 0], self._a[None, :, :, 1]
+        bx, by = self._b[None, :, :, 0], self._b[None, :, :, 1]
+
+        abx = bx - ax
+        aby = by - ay
+        ab_len2 = abx * abx + aby * aby
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = ((px - ax) * abx + (py - ay) * aby) / ab_len2
+        t = np.clip(t, 0.0, 1.0)
+        # вырожденное ребро расстояние до вершины
+        t = np.where(ab_len2 > 0.0, t, 0.0)
+        dist = np.hypot(px - (ax + t * abx), py - (ay + t * aby))
+        dist = np.where(self._edge_mask[None], dist, np.inf)
+        min_dist = dist.min(axis=2)
+
+        # четность пересечений как в _point_in_polygon
+        y1, y2 = ay, by
+        straddles = (y1 > py) != (y2 > py)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_cross = (bx - ax) * (py - y1) / (y2 - y1 + 0.0) + ax
+        crossings = straddles & (px < x_cross) & self._edge_mask[None]
+        inside = (crossings.sum(axis=2) % 2 == 1) & self._can_contain[None]
+
+        signed = np.where(inside, min_dist, -min_dist)
+        return np.where(self._valid[None], signed, -np.inf)
+
+    def best_rois(self, boxes: Sequence[Sequence[float]]) -> List[Optional[int]]:
+        """лучшая рои для каждого бокса разом"""
+        n_boxes = len(boxes)
+        if n_boxes == 0:
+            return []
+        if self.n_rois == 0:
+            return [None] * n_boxes
+
+        points, point_mask = anchor_points_array(boxes)
+        k_max = points.shape[1]
+
+        dist = self.signed_distances(points.reshape(-1, 2)).reshape(n_boxes, k_max, self.n_rois)
+        hit = (dist >= -self.roi_margin_px) & point_mask[:, :, None]
+
+        in_count = hit.sum(axis=1)
+        # суммируем по порядку точек как скалярная версия
+        dist_sum = np.zeros((n_boxes, self.n_rois), dtype=np.float64)
+        for k in range(k_max):
+            dist_sum = dist_sum + np.where(hit[:, k], dist[:, k], 0.0)
+
+        return pick_best_rois(in_count, dist_sum)
+
+
+def pick_best_rois(in_count: np.ndarray, dist_sum: np.ndarray) -> List[Optional[int]]:
+    """больше точек внутри потом больше запас"""
+    best_count = in_count.max(axis=1)
+    candidates = in_count == best_count[:, None]
+    # при равенстве берется первая рои
+    best = np.argmax(np.where(candidates, dist_sum, -np.inf), axis=1)
+    return [int(best[i]) if best_count[i] > 0 else None for i in range(in_count.shape[0])]
+
+
+def anchor_points_array(boxes: Sequence[Sequence[float]]) -> Tuple[np.ndarray, np.ndarray]:
+    """точки привязки боксов с маской"""
+    anchors = [bbox_anchor_points(box) for box in boxes]
+    k_max = max((len(a) for a in anchors), default=0)
+    points = np.zeros((len(boxes), k_max, 2), dtype=np.float64)
+    point_mask = np.zeros((len(boxes), k_max), dtype=bool)
+    for i, pts in enumerate(anchors):
+        points[i, : len(pts)] = pts
+        point_mask[i, : len(pts)] = True
+    return points, point_mask
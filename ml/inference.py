@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import abc
+import glob
+import os
+import shutil
+from typing import List, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from detector_utils import dedup_boxes_by_iou_array
+
+# класс человека в coco
+PERSON_CLASS = 0
+
+
+def letterbox(image: np.ndarray, size: int) -> Tuple[np.ndarray, float, Tuple[int, int]]:
+    """как в ultralytics: масштаб с полями 114 до квадрата"""
+    h, w = image.shape[:2]
+    scale = min(size / h, size / w)
+    new_w, new_h = int(round(w * scale)), int(round(h * scale))
+    if (new_w, new_h) != (w, h):
+        image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    dw, dh = (size - new_w) / 2.0, (size - new_h) / 2.0
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    return image, scale, (left, top)
+
+
+def to_blob(images: Sequence[np.ndarray]) -> np.ndarray:
+    # bgr hwc uint8 -> rgb nchw float
+    batch = np.stack(images)[..., ::-1].transpose(0, 3, 1, 2)
+    return np.ascontiguousarray(batch, dtype=np.float32) / 255.0
+
+
+def decode_yolo_output(
+    raw: np.ndarray,
+    conf: float,
+    iou: float,
+    scale: float,
+    pad: Tuple[int, int],
+    image_shape: Sequence[int],
+    class_id: int = PERSON_CLASS,
+):
+    """выход yolov8 (4+nc, n) в боксы кадра после nms"""
+    pred = np.asarray(raw, dtype=np.float32)
+    if pred.ndim == 3:
+        pred = pred[0]
+    pred = pred.T
+    scores = pred[:, 4 + class_id]
+    mask = scores >= conf
+    if not mask.any():
+        return np.zeros((0, 4), dtype=np.float32), np.zeros((0,), dtype=np.float32)
+
+    cx, cy, w, h = pred[mask, 0], pred[mask, 1], pred[mask, 2], pred[mask, 3]
+    boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+    scores = scores[mask]
+    keep = dedup_boxes_by_iou_array(boxes, scores, iou)
+    boxes, scores = boxes[keep], scores[keep]
+
+    # обратно из letterbox в исходную картинку
+    boxes[:, [0, 2]] = (boxes[:, [0, 2]] - pad[0]) / scale
+    boxes[:, [1, 3]] = (boxes[:, [1, 3]] - pad[1]) / scale
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, image_shape[1])
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, image_shape[0])
+    return boxes, scores
+
+
+def result_arrays(result):
+    """боксы иды и скор одного кадра ultralytics"""
+    # иды могут отсутствовать иногда
+    # считаем занятость без идов
+    boxes = None
+    ids = None
+    confs = None
+    if result is not None and getattr(result, "boxes", None) is not None:
+        if result.boxes.xyxy is not None:
+            boxes = result.boxes.xyxy.cpu().numpy()
+        if result.boxes.id is not None:
+            ids = result.boxes.id.cpu().numpy()
+        if getattr(result.boxes, "conf", None) is not None:
+            confs = result.boxes.conf.cpu().numpy()
+    return boxes, ids, confs
+
+
+class UltralyticsBackend:
+    """pytorch через ultralytics, трекер встроенный"""
+
+    name = "ultralytics"
+    tracks = True
+
+    def __init__(self, weights: str, imgsz: int, conf: float):
+        # ленивая загрузка для тестов
+        from ultralytics import YOLO
+
+        self.model = YOLO(weights)
+        self.imgsz = int(imgsz)
+        self.conf = float(conf)
+
+    def detect(self, image: np.ndarray):
+        results = self.model.track(
+            image,
+            conf=self.conf,
+            imgsz=self.imgsz,
+            persist=True,
+            classes=[PERSON_CLASS],
+            verbose=False,
+        )
+        return result_arrays(results[0] if results else None)
+
+    def detect_batch(self, images: List[np.ndarray]):
+        # трекер йоло общий на батч, поэтому без идов
+        results = self.model.predict(
+            images,
+            conf=self.conf,
+            imgsz=self.imgsz,
+            classes=[PERSON_CLASS],
+            verbose=False,
+        )
+        return [result_arrays(r) for r in results]
+
+
+class _ExportedBackend(abc.ABC):
+    """общие пред и пост обработка для экспортированной модели"""
+
+    tracks = False
+
+    def __init__(self, imgsz: int, conf: float, iou: float):
+        self.imgsz = int(imgsz)
+        self.conf = float(conf)
+        self.iou = float(iou)
+
+    @abc.abstractmethod
+    def _run(self, blob: np.ndarray) -> np.ndarray:
+        """сырой выход модели на пачку"""
+
+    def detect(self, image: np.ndarray):
+        return self.detect_batch([image])[0]
+
+    def detect_batch(self, images: List[np.ndarray]):
+        out = []
+        # модель экспортирована с батчем 1
+        for image in images:
+            padded, scale, pad = letterbox(image, self.imgsz)
+            raw = self._run(to_blob([padded]))
+            boxes, scores = decode_yolo_output(raw, self.conf, self.iou, scale, pad, image.shape)
+            out.append((boxes, None, scores))
+        return out
+
+
+class OnnxBackend(_ExportedBackend):
+    name = "onnx"
+
+    def __init__(self, model_path: str, imgsz: int, conf: float, iou: float, threads: int = 0):
+        super().__init__(imgsz, conf, iou)
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if threads > 0:
+            options.intra_op_num_threads = int(threads)
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def _run(self, blob: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: blob})[0]
+
+
+class OpenVinoBackend(_ExportedBackend):
+    name = "openvino"
+
+    def __init__(self, model_xml: str, imgsz: int, conf: float, iou: float, threads: int = 0):
+        super().__init__(imgsz, conf, iou)
+        import openvino as ov
+
+        core = ov.Core()
+        config = {"PERFORMANCE_HINT": "LATENCY"}
+        if threads > 0:
+            config["INFERENCE_NUM_THREADS"] = int(threads)
+        self.compiled = core.compile_model(core.read_model(model_xml), "CPU", config)
+        self.output = self.compiled.output(0)
+
+    def _run(self, blob: np.ndarray) -> np.ndarray:
+        return self.compiled(blob)[self.output]
+
+
+def exported_model_path(weights: str, fmt: str, imgsz: int, cache_dir: str, suffix: str = "") -> str:
+    stem = os.path.splitext(os.path.basename(weights))[0]
+    name = f"{stem}_{imgsz}{suffix}"
+    if fmt == "openvino":
+        return os.path.join(cache_dir, f"{name}_openvino_model", f"{stem}.xml")
+    return os.path.join(cache_dir, f"{name}.onnx")
+
+
+def export_model(weights: str, fmt: str, imgsz: int, cache_dir: str, **export_kwargs) -> str:
+    """экспорт pt один раз, дальше берем из кэша"""
+    suffix = "_int8" if export_kwargs.get("int8") else ""
+    target = exported_model_path(weights, fmt, imgsz, cache_dir, suffix)
+    if os.path.exists(target):
+        return target
+
+    from ultralytics import YOLO
+
+    print(f"экспорт {weights} в {fmt} imgsz={imgsz}, один раз...")
+    exported = YOLO(weights).export(format=fmt, imgsz=imgsz, batch=1, **export_kwargs)
+    os.makedirs(cache_dir, exist_ok=True)
+    if fmt == "openvino":
+        target_dir = os.path.dirname(target)
+        if os.path.exists(target_dir):
+            shutil.rmtree(target_dir)
+        shutil.move(str(exported), target_dir)
+        xml = glob.glob(os.path.join(target_dir, "*.xml"))
+        if xml and xml[0] != target:
+            os.replace(xml[0], target)
+            os.replace(os.path.splitext(xml[0])[0] + ".bin", os.path.splitext(target)[0] + ".bin")
+    else:
+        shutil.move(str(exported), target)
+    return target
+
+
+def load_backend(
+    name: str,
+    weights: str,
+    imgsz: int,
+    conf: float,
+    iou: float = 0.7,
+    threads: int = 0,
+    cache_dir: str = ".model_cache",
+    **export_kwargs,
+):
+    """ultralytics, onnx или openvino по имени"""
+    if name == "ultralytics":
+        return UltralyticsBackend(weights, imgsz, conf)
+    if name in ("onnx", "openvino"):
+        fmt = "onnx" if name == "onnx" else "openvino"
+        path = weights
+        if weights.endswith(".pt"):
+            path = export_model(weights, fmt, imgsz, cache_dir, **export_kwargs)
+        if name == "onnx":
+            return OnnxBackend(path, imgsz, conf, iou, threads)
+        return OpenVinoBackend(path, imgsz, conf, iou, threads)
+    raise ValueError(f"неизвестный бэкенд инференса: {name}")
@@ -2,22 +2,31 @@ import cv2
 import pickle
 import numpy as np
 import argparse
+import itertools
+import queue
 import time
 import os
+from dataclasses import dataclass, field
 from datetime import datetime
+from typing import Any, List, Optional
 
 from detector_utils import (
+    RoiMatcher,
     best_roi_for_bbox as _best_roi_for_bbox,
     bbox_anchor_points,
-    bbox_center,
-    bbox_iou,
-    calculate_side,
-    dedup_boxes_by_iou,
     is_point_in_roi as _is_point_in_roi,
 )
 
-from backend_client import create_session, post_table_occupancy
+from adaptive import AdaptiveInferenceScheduler
+from backend_client import OccupancyPublisher, PostingPolicy, WebSocketPublisher
+from inference import load_backend
+from occupancy import Detection, OccupancyTracker
+from pipeline import Pipeline, QueueClosed, StageQueue
+from profiles import ModelProfile, get_profile
+from roi_crop import CropLayout
+from roi_raster import load_or_build_roi_raster
 from smoothing import TableCountSmoother
+from tracker import IouTracker
 
 
 # СВЯЗЬ ML И БЕКЕНДА: URL ДЛЯ ОТПРАВКИ ДАННЫХ
@@ -27,11 +36,32 @@ TABLE_CAPACITY = 3
 LOG_INTERVAL = 2.0
 BACKEND_BASE_URL = os.getenv("BACKEND_BASE_URL", "http://127.0.0.1:8000").rstrip("/")
 BACKEND_UPDATE_URL = os.getenv("BACKEND_UPDATE_URL", f"{BACKEND_BASE_URL}/api/tables/update")
+BACKEND_UPDATE_BIN_URL = os.getenv("BACKEND_UPDATE_BIN_URL", f"{BACKEND_BASE_URL}/api/tables/update/bin")
+BACKEND_INGEST_WS_URL = os.getenv(
+    "BACKEND_INGEST_WS_URL", BACKEND_BASE_URL.replace("http", "ws", 1) + "/ws/ingest"
+)
+BACKEND_HEARTBEAT_URL = os.getenv("BACKEND_HEARTBEAT_URL", f"{BACKEND_BASE_URL}/api/tables/heartbeat")
+
+# профиль модели accurate, balanced или fast, переменные ниже важнее
+MODEL_PROFILE = os.getenv("MODEL_PROFILE", "")
+_profile = get_profile(MODEL_PROFILE) if MODEL_PROFILE else None
 
 # настройки йоло из окружения
-YOLO_MODEL = os.getenv("YOLO_MODEL", "yolov8n.pt")
-YOLO_CONF = float(os.getenv("YOLO_CONF", "0.25"))
-YOLO_IMGSZ = int(os.getenv("YOLO_IMGSZ", "960"))
+YOLO_MODEL = os.getenv("YOLO_MODEL", _profile.weights if _profile else "yolov8n.pt")
+YOLO_CONF = float(os.getenv("YOLO_CONF", str(_profile.conf) if _profile else "0.25"))
+YOLO_IMGSZ = int(os.getenv("YOLO_IMGSZ", str(_profile.imgsz) if _profile else "960"))
+
+# бэкенд инференса: ultralytics, onnx или openvino
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", _profile.backend if _profile else "ultralytics")
+# int8 экспорт для onnx и openvino
+MODEL_INT8 = os.getenv("MODEL_INT8", "1" if _profile and _profile.int8 else "0") in ("1", "true", "True", "yes", "YES")
+# потоки внутри оператора, 0 по умолчанию рантайма
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "0"))
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", ".model_cache")
+NMS_IOU = float(os.getenv("NMS_IOU", "0.7"))
+# свой трекер для бэкендов без трекинга
+TRACKER_IOU = float(os.getenv("TRACKER_IOU", "0.3"))
+TRACKER_MAX_AGE_SECONDS = float(os.getenv("TRACKER_MAX_AGE_SECONDS", "1.5"))
 
 # фильтры ошибок внутри рои
 ROI_MIN_CONF = float(os.getenv("ROI_MIN_CONF", "0.35"))
@@ -45,6 +75,22 @@ CHANGE_CONFIRM_FRAMES = max(1, int(os.getenv("CHANGE_CONFIRM_FRAMES", "2")))
 # пропуск кадров для скорости
 PROCESS_EVERY_N_FRAMES = max(1, int(os.getenv("PROCESS_EVERY_N_FRAMES", "1")))
 
+# адаптивный пропуск: реже в тишине, чаще при движении
+ADAPTIVE_SKIP = os.getenv("ADAPTIVE_SKIP", "0") in ("1", "true", "True", "yes", "YES")
+ADAPTIVE_MAX_EVERY_N = max(1, int(os.getenv("ADAPTIVE_MAX_EVERY_N", "15")))
+ADAPTIVE_STABLE_SECONDS = float(os.getenv("ADAPTIVE_STABLE_SECONDS", "3.0"))
+ADAPTIVE_MOTION_THRESHOLD = float(os.getenv("ADAPTIVE_MOTION_THRESHOLD", "6.0"))
+
+
+def _optional_seconds(name: str, adaptive_default: str) -> Optional[float]:
+    # при переменном шаге кадров окно считаем по времени
+    raw = os.getenv(name, adaptive_default if ADAPTIVE_SKIP else "")
+    return float(raw) if raw != "" else None
+
+
+SMOOTH_WINDOW_SECONDS = _optional_seconds("SMOOTH_WINDOW_SECONDS", "2.0")
+CHANGE_CONFIRM_SECONDS = _optional_seconds("CHANGE_CONFIRM_SECONDS", "0.8")
+
 # очистка консоли при выводе
 CLEAR_CONSOLE = os.getenv("CLEAR_CONSOLE", "1") in ("1", "true", "True", "yes", "YES")
 
@@ -54,10 +100,46 @@ OCCUPANCY_HOLD_SECONDS = float(os.getenv("OCCUPANCY_HOLD_SECONDS", "6.0"))
 # запас для попадания рои
 ROI_MARGIN_PX = float(os.getenv("ROI_MARGIN_PX", "6"))
 
+# растр рои для выбора стола таблицей
+ROI_RASTER = os.getenv("ROI_RASTER", "1") in ("1", "true", "True", "yes", "YES")
+ROI_RASTER_SCALE = max(1, int(os.getenv("ROI_RASTER_SCALE", "1")))
+ROI_RASTER_CACHE_DIR = os.getenv("ROI_RASTER_CACHE_DIR", ".roi_cache")
+
+# инференс только по окнам вокруг столов и линии входа
+ROI_CROP = os.getenv("ROI_CROP", "0") in ("1", "true", "True", "yes", "YES")
+# запас окна в долях высоты кадра, сверху больше под сидящих
+ROI_CROP_PAD = float(os.getenv("ROI_CROP_PAD", "0.05"))
+ROI_CROP_PAD_TOP = float(os.getenv("ROI_CROP_PAD_TOP", "0.2"))
+ROI_CROP_IMGSZ = int(os.getenv("ROI_CROP_IMGSZ", str(YOLO_IMGSZ)))
+# мозаика почти с кадр не выгодна
+ROI_CROP_MAX_RATIO = float(os.getenv("ROI_CROP_MAX_RATIO", "0.85"))
+
 # удержание трек привязки стола
 TRACK_TABLE_TTL_SECONDS = float(os.getenv("TRACK_TABLE_TTL_SECONDS", "2.0"))
 
-_session = create_session()
+# очереди между стадиями конвейера
+PIPELINE_QUEUE_SIZE = max(1, int(os.getenv("PIPELINE_QUEUE_SIZE", "2")))
+# сброс старых кадров: auto только для живой камеры
+CAPTURE_DROP_FRAMES = os.getenv("CAPTURE_DROP_FRAMES", "auto")
+
+# без окна и отрисовки для сервера
+HEADLESS = os.getenv("HEADLESS", "0") in ("1", "true", "True", "yes", "YES")
+# редкий jpeg с разметкой вместо окна
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "")
+SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("SNAPSHOT_INTERVAL_SECONDS", "10"))
+SNAPSHOT_JPEG_QUALITY = int(os.getenv("SNAPSHOT_JPEG_QUALITY", "80"))
+
+# фоновая отправка на бекенд
+PUBLISH_TIMEOUT_SECONDS = float(os.getenv("PUBLISH_TIMEOUT_SECONDS", "2.0"))
+PUBLISH_BACKOFF_MAX_SECONDS = float(os.getenv("PUBLISH_BACKOFF_MAX_SECONDS", "10.0"))
+# формат обновления: json или binary (компактный кадр)
+INGEST_FORMAT = os.getenv("INGEST_FORMAT", "json")
+# http запрос на обновление или ws постоянный канал (всегда бинарный)
+INGEST_TRANSPORT = os.getenv("INGEST_TRANSPORT", "http")
+# шлем только изменения, не чаще раза в gap
+POST_MIN_GAP_SECONDS = float(os.getenv("POST_MIN_GAP_SECONDS", "0.5"))
+# без изменений только признак жизни
+HEARTBEAT_SECONDS = float(os.getenv("HEARTBEAT_SECONDS", "15"))
 
 def is_point_in_roi(roi, point):
     return _is_point_in_roi(roi, point, ROI_MARGIN_PX)
@@ -73,294 +155,459 @@ def best_roi_for_bbox(rois, box):
     return _best_roi_for_bbox(rois, box, ROI_MARGIN_PX)
 
 
-def main(video_path: str):
-    # ленивая загрузка для тестов
-    from ultralytics import YOLO
+@dataclass
+class FramePacket:
+    index: int
+    captured_ts: float
+    frame: Any
+    do_infer: bool = False
+    boxes: Any = None
+    ids: Any = None
+    confs: Any = None
+    detections: List[Detection] = field(default_factory=list)
+    tables_status: List[int] = field(default_factory=list)
+    inside_total: int = 0
+    camera_id: Optional[str] = None
+    # когда стадия инференса отдала кадр, для задержек на бекенде
+    inferred_ts: Optional[float] = None
+
+
+def is_live_source(video_source) -> bool:
+    return isinstance(video_source, int) or "://" in str(video_source)
+
+
+def should_drop_frames(video_source) -> bool:
+    if CAPTURE_DROP_FRAMES == "auto":
+        # файл читаем целиком, камеру без отставания
+        return is_live_source(video_source)
+    return CAPTURE_DROP_FRAMES in ("1", "true", "True", "yes", "YES")
+
+
+def load_scene(tables_path: str = "tables.pkl", entry_lines_path: str = "entry_lines.pkl"):
+    """рои столов и линия входа из конфигураторов"""
+    with open(tables_path, "rb") as f:
+        rois = pickle.load(f)
+    with open(entry_lines_path, "rb") as f:
+        entry_data = pickle.load(f)
+    return rois, entry_data["line"], entry_data["inside_ref"]
+
+
+def build_tracker(rois, entry_line, inside_ref_point) -> OccupancyTracker:
+    # рои разбираем один раз на весь запуск
+    return OccupancyTracker(
+        n_tables=len(rois),
+        entry_line=entry_line,
+        inside_ref_point=inside_ref_point,
+        roi_matcher=RoiMatcher(rois, ROI_MARGIN_PX),
+        smoother=TableCountSmoother(
+            n_tables=len(rois),
+            smooth_window=SMOOTH_WINDOW,
+            change_confirm_frames=CHANGE_CONFIRM_FRAMES,
+            hold_seconds=OCCUPANCY_HOLD_SECONDS,
+            window_seconds=SMOOTH_WINDOW_SECONDS,
+            confirm_seconds=CHANGE_CONFIRM_SECONDS,
+        ),
+        roi_min_conf=ROI_MIN_CONF,
+        min_bbox_area_ratio=MIN_BBOX_AREA_RATIO,
+        dedup_iou_threshold=DEDUP_IOU_THRESHOLD,
+        track_table_ttl_seconds=TRACK_TABLE_TTL_SECONDS,
+    )
+
+
+def build_backend(profile: Optional[ModelProfile] = None):
+    if profile is not None:
+        # явный профиль для сравнения, окружение не смотрим
+        return load_backend(
+            profile.backend,
+            profile.weights,
+            imgsz=profile.imgsz,
+            conf=profile.conf,
+            iou=NMS_IOU,
+            threads=INFERENCE_THREADS,
+            cache_dir=MODEL_CACHE_DIR,
+            **({"int8": True} if profile.int8 else {}),
+        )
+    # с окнами модель видит мозаику своего размера
+    return load_backend(
+        INFERENCE_BACKEND,
+        YOLO_MODEL,
+        imgsz=ROI_CROP_IMGSZ if ROI_CROP else YOLO_IMGSZ,
+        conf=YOLO_CONF,
+        iou=NMS_IOU,
+        threads=INFERENCE_THREADS,
+        cache_dir=MODEL_CACHE_DIR,
+        **({"int8": True} if MODEL_INT8 else {}),
+    )
+
+
+def build_publisher() -> OccupancyPublisher:
+    if INGEST_TRANSPORT == "ws":
+        return WebSocketPublisher(
+            BACKEND_INGEST_WS_URL,
+            timeout_seconds=PUBLISH_TIMEOUT_SECONDS,
+            backoff_max_seconds=PUBLISH_BACKOFF_MAX_SECONDS,
+        )
+    return OccupancyPublisher(
+        BACKEND_UPDATE_URL,
+        heartbeat_url=BACKEND_HEARTBEAT_URL,
+        binary_url=BACKEND_UPDATE_BIN_URL if INGEST_FORMAT == "binary" else None,
+        timeout_seconds=PUBLISH_TIMEOUT_SECONDS,
+        backoff_max_seconds=PUBLISH_BACKOFF_MAX_SECONDS,
+    )
+
+
+def build_posting_policy() -> PostingPolicy:
+    return PostingPolicy(min_gap_seconds=POST_MIN_GAP_SECONDS, heartbeat_seconds=HEARTBEAT_SECONDS)
+
+
+def format_publisher_stats(publisher: OccupancyPublisher) -> str:
+    st = publisher.stats()
+    latency = "-" if st["latency_ms_p50"] is None else f"{st['latency_ms_p50']:.0f}/{st['latency_ms_max']:.0f} мс"
+    line = (
+        f"бекенд: отправлено {st['sent']}, heartbeat {st['heartbeats']}, затерто {st['coalesced']}, "
+        f"ошибок {st['failed']}, задержка p50/max {latency}"
+    )
+    if "connects" in st:
+        line += f", канал: подключений {st['connects']}, без ответа {st['unacked']}"
+    return line
+
+
+def build_id_tracker() -> IouTracker:
+    return IouTracker(iou_threshold=TRACKER_IOU, max_age_seconds=TRACKER_MAX_AGE_SECONDS)
+
+
+def build_scheduler() -> Optional[AdaptiveInferenceScheduler]:
+    if not ADAPTIVE_SKIP:
+        return None
+    return AdaptiveInferenceScheduler(
+        min_every_n=PROCESS_EVERY_N_FRAMES,
+        max_every_n=ADAPTIVE_MAX_EVERY_N,
+        stable_seconds=ADAPTIVE_STABLE_SECONDS,
+        motion_threshold=ADAPTIVE_MOTION_THRESHOLD,
+    )
+
+
+def build_crop_layout(rois, entry_line, frame_shape) -> Optional[CropLayout]:
+    """окна инференса, none если выгоды нет"""
+    if not ROI_CROP:
+        return None
+    height, width = frame_shape[0], frame_shape[1]
+    layout = CropLayout.build(
+        rois,
+        entry_line,
+        width,
+        height,
+        pad_px=int(ROI_CROP_PAD * height),
+        pad_top_px=int(ROI_CROP_PAD_TOP * height),
+    )
+    print(
+        f"окна инференса: {len(layout.regions)}, мозаика {layout.mosaic_width}x{layout.mosaic_height}, "
+        f"{layout.pixel_ratio:.0%} пикселей кадра"
+    )
+    if layout.pixel_ratio >= ROI_CROP_MAX_RATIO:
+        print("окна почти весь кадр, инференс по полному кадру")
+        return None
+    return layout
+
+
+def build_roi_raster(rois, frame_shape):
+    # размер кадра известен только тут
+    t0 = time.time()
+    raster = load_or_build_roi_raster(
+        rois,
+        frame_shape[1],
+        frame_shape[0],
+        ROI_MARGIN_PX,
+        scale=ROI_RASTER_SCALE,
+        cache_dir=ROI_RASTER_CACHE_DIR,
+    )
+    print(f"растр рои готов за {time.time() - t0:.2f}с")
+    return raster
+
+
+def draw_overlay(output, rois, entry_line, packet: FramePacket) -> None:
+    for det in packet.detections:
+        box = det.box
+        if det.table_idx is not None:
+            cv2.rectangle(
+                output,
+                (int(box[0]), int(box[1])),
+                (int(box[2]), int(box[3])),
+                (0, 0, 255),
+                2,
+            )
+            cv2.circle(output, det.center, 4, (0, 0, 255), -1)
+        else:
+            cv2.rectangle(
+                output,
+                (int(box[0]), int(box[1])),
+                (int(box[2]), int(box[3])),
+                (0, 255, 0),
+                2,
+            )
+
+    cv2.line(output, entry_line[0], entry_line[1], (255, 0, 0), 3)
+    cv2.putText(
+        output,
+        "ENTRY LINE",
+        (entry_line[0][0], entry_line[0][1] - 10),
+        cv2.FONT_HERSHEY_SIMPLEX,
+        0.6,
+        (255, 0, 0),
+        2,
+    )
+
+    tables_status = packet.tables_status
+    for idx, roi in enumerate(rois):
+        count = tables_status[idx]
+        color = (0, 255, 0) if count < TABLE_CAPACITY else (0, 0, 255)
+
+        cv2.polylines(output, [roi], True, color, 2)
+
+        M = cv2.moments(roi)
+        if M["m00"] != 0:
+            cX = int(M["m10"] / M["m00"])
+            cY = int(M["m01"] / M["m00"])
+            label = f"T{idx+1}: {count}/{TABLE_CAPACITY}"
+            cv2.putText(
+                output,
+                label,
+                (cX - 30, cY),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.6,
+                (255, 255, 255),
+                2,
+            )
 
+    total_seated = int(sum(tables_status))
+    total_free = max(0, (len(rois) * TABLE_CAPACITY) - total_seated)
+
+    # счетчик линии может ошибаться
+    # итог берем по столам
+    cv2.rectangle(output, (0, 0), (360, 90), (0, 0, 0), -1)
+    cv2.putText(
+        output,
+        f"TOTAL INSIDE (tables): {total_seated}",
+        (10, 30),
+        cv2.FONT_HERSHEY_SIMPLEX,
+        0.8,
+        (255, 255, 255),
+        2,
+    )
+    cv2.putText(
+        output,
+        f"CROSSINGS (debug): {packet.inside_total}",
+        (10, 58),
+        cv2.FONT_HERSHEY_SIMPLEX,
+        0.6,
+        (200, 200, 200),
+        1,
+    )
+    cv2.putText(
+        output,
+        f"FREE: {total_free}",
+        (10, 82),
+        cv2.FONT_HERSHEY_SIMPLEX,
+        0.6,
+        (200, 200, 200),
+        1,
+    )
+
+
+def write_snapshot(path: str, image, quality: int = SNAPSHOT_JPEG_QUALITY) -> bool:
+    """jpeg атомарно чтобы читатель не видел половину"""
+    ok, buf = cv2.imencode(".jpg", image, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+    if not ok:
+        return False
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(buf.tobytes())
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"не удалось сохранить снимок {path}: {e}")
+        return False
+    return True
+
+
+def print_report(tables_status, inside_total, pipeline: Pipeline, scheduler=None, publisher=None) -> None:
+    if CLEAR_CONSOLE:
+        os.system('cls' if os.name == 'nt' else 'clear')
+
+    total_seated = int(sum(tables_status))
+    t_now = datetime.now().strftime("%H:%M:%S")
+    print(f"--- ОТЧЕТ {t_now} ---")
+    print(f"Посетителей (по столам): {total_seated}")
+    print(f"Посетителей (по линии входа, debug): {inside_total}")
+    print("-" * 35)
+    print(f"{'Стол':<6} | {'Занято':<8} | {'Свободно':<8}")
+    print("-" * 35)
+
+    for idx, count in enumerate(tables_status):
+        free = max(0, TABLE_CAPACITY - count)
+        status_str = f"{count}" if count <= TABLE_CAPACITY else f"{count} (!)"
+        print(f"#{idx+1:<5} | {status_str:<8} | {free:<8}")
+
+    print("-" * 35)
+    for line in pipeline.format_stats():
+        print(line)
+    if scheduler is not None:
+        st = scheduler.stats()
+        print(f"инференс каждый {st['every_n']} кадр, движение {st['motion']}, доля {st['infer_ratio']:.0%}")
+    if publisher is not None:
+        print(format_publisher_stats(publisher))
+
+
+def main(video_path: str):
     video_source = int(video_path) if video_path.isdigit() else video_path
 
     try:
-        with open("tables.pkl", "rb") as f:
-            rois = pickle.load(f)
-        with open("entry_lines.pkl", "rb") as f:
-            entry_data = pickle.load(f)
-            entry_line = entry_data["line"]
-            inside_ref_point = entry_data["inside_ref"]
+        rois, entry_line, inside_ref_point = load_scene()
     except FileNotFoundError:
         print("ОШИБКА: файлы pkl не найдены сначала конфигураторы!")
         return 1
 
-    ref_value = calculate_side(entry_line, inside_ref_point)
-    INSIDE_SIGN = 1 if ref_value > 0 else -1
+    tracker = build_tracker(rois, entry_line, inside_ref_point)
+
+    try:
+        backend = build_backend()
+    except (ImportError, OSError, RuntimeError, ValueError) as e:
+        print(f"ОШИБКА: бэкенд инференса {INFERENCE_BACKEND}: {e}")
+        return 1
+    # иды для счетчика входа если бэкенд сам не трекает
+    id_tracker = None if backend.tracks else build_id_tracker()
+    print(f"бэкенд инференса: {backend.name}")
 
-    model = YOLO(YOLO_MODEL)
     cap = cv2.VideoCapture(video_source)
+    frame_counter = itertools.count()
+
+    # захват -> инференс -> столы -> отрисовка в главном потоке
+    pipeline = Pipeline()
+    capture_queue = StageQueue(PIPELINE_QUEUE_SIZE, drop_oldest=should_drop_frames(video_source))
+    detect_queue = StageQueue(PIPELINE_QUEUE_SIZE)
+    render_queue = StageQueue(PIPELINE_QUEUE_SIZE)
+
+    def capture():
+        ret, frame = cap.read()
+        if not ret:
+            return None
+        return FramePacket(index=next(frame_counter), captured_ts=time.time(), frame=frame)
+
+    scheduler = build_scheduler()
+
+    crop_layout = None
+    crop_ready = False
+
+    def infer(packet: FramePacket) -> FramePacket:
+        nonlocal crop_layout, crop_ready
+        # пропуск кадров для скорости
+        if scheduler is not None:
+            packet.do_infer = scheduler.should_infer(packet.frame, packet.captured_ts)
+        else:
+            packet.do_infer = (packet.index % PROCESS_EVERY_N_FRAMES) == 0
+        if packet.do_infer:
+            if not crop_ready:
+                crop_layout = build_crop_layout(rois, entry_line, packet.frame.shape)
+                crop_ready = True
+            # мозаика окон одна и та же, трекер видит стабильную картинку
+            image = packet.frame if crop_layout is None else crop_layout.compose(packet.frame)
+            packet.boxes, packet.ids, packet.confs = backend.detect(image)
+            if crop_layout is not None:
+                packet.boxes, packet.ids, packet.confs = crop_layout.map_boxes(packet.boxes, packet.ids, packet.confs)
+            if id_tracker is not None:
+                packet.ids = id_tracker.update(packet.boxes, packet.captured_ts)
+        packet.inferred_ts = time.time()
+        return packet
+
+    raster_ready = not ROI_RASTER
+
+    def assign(packet: FramePacket) -> FramePacket:
+        nonlocal raster_ready
+        if not raster_ready:
+            tracker.roi_matcher = build_roi_raster(rois, packet.frame.shape)
+            raster_ready = True
+
+        # сглаживаем по времени захвата кадра
+        packet.detections, packet.tables_status = tracker.process(
+            packet.boxes,
+            packet.ids,
+            packet.confs,
+            packet.frame.shape,
+            packet.captured_ts,
+            inferred=packet.do_infer,
+        )
+        packet.inside_total = tracker.inside_total
+        if scheduler is not None:
+            scheduler.observe_status(packet.tables_status, packet.captured_ts)
+        return packet
+
+    pipeline.add_source("capture", capture, capture_queue)
+    pipeline.add_stage("inference", infer, capture_queue, detect_queue)
+    pipeline.add_stage("tables", assign, detect_queue, render_queue)
+    render_stats = pipeline.add_sink("report" if HEADLESS else "render", render_queue)
 
-    tracks = {}
-    track_table = {}
-    smoother = None
-    inside_total = 0
     last_log_time = time.time()
-    frame_idx = 0
+    last_snapshot_time = 0.0
+    # СВЯЗЬ ML И БЕКЕНДА: отправка в своем потоке
+    publisher = build_publisher().start()
+    posting = build_posting_policy()
 
     print("Запуск системы...")
+    pipeline.start()
 
     try:
         while True:
-            ret, frame = cap.read()
-            if not ret:
+            try:
+                packet = render_queue.get(timeout=0.1)
+            except queue.Empty:
+                if pipeline.stop_event.is_set():
+                    break
+                continue
+            except QueueClosed:
                 print("Поток завершен.")
                 break
 
-            output = frame.copy()
-
-            do_infer = (frame_idx % PROCESS_EVERY_N_FRAMES) == 0
-            frame_idx += 1
-
-            results = None
-            if do_infer:
-                results = model.track(
-                    frame,
-                    conf=YOLO_CONF,
-                    imgsz=YOLO_IMGSZ,
-                    persist=True,
-                    classes=[0],
-                    verbose=False,
-                )
-
-            if smoother is None:
-                smoother = TableCountSmoother(
-                    n_tables=len(rois),
-                    smooth_window=SMOOTH_WINDOW,
-                    change_confirm_frames=CHANGE_CONFIRM_FRAMES,
-                    hold_seconds=OCCUPANCY_HOLD_SECONDS,
-                )
-
-            detected_tables_status = [0] * len(rois)
-
-            # боксы и скор по рои
-            per_table_boxes = [[] for _ in range(len(rois))]
-            per_table_scores = [[] for _ in range(len(rois))]
-
-            # иды могут отсутствовать иногда
-            # считаем занятость без идов
-            ids = None
-            boxes = None
-            confs = None
-            if results and getattr(results[0], "boxes", None) is not None:
-                if results[0].boxes.xyxy is not None:
-                    boxes = results[0].boxes.xyxy.cpu().numpy()
-                if results[0].boxes.id is not None:
-                    ids = results[0].boxes.id.cpu().numpy()
-                if getattr(results[0].boxes, "conf", None) is not None:
-                    confs = results[0].boxes.conf.cpu().numpy()
-
-            frame_area = float(frame.shape[0] * frame.shape[1]) if frame is not None else 0.0
-
-            if boxes is not None:
-                for i, box in enumerate(boxes):
-                    score = float(confs[i]) if confs is not None else 1.0
-                    # фильтруем ложные боксы тут
-                    if score < ROI_MIN_CONF:
-                        continue
-                    x1, y1, x2, y2 = [float(v) for v in box]
-                    area = max(0.0, x2 - x1) * max(0.0, y2 - y1)
-                    if frame_area > 0 and area < (MIN_BBOX_AREA_RATIO * frame_area):
-                        continue
-
-                    cx, cy = bbox_center(box)
-
-                    now_ts = time.time()
-
-                    pid = None
-                    if ids is not None:
-                        pid = int(ids[i])
-
-                    # счетчик входа по идам
-                    if pid is not None:
-                        current_side_val = calculate_side(entry_line, (cx, cy))
-                        current_sign = 1 if (current_side_val * INSIDE_SIGN) > 0 else -1
-
-                        if pid not in tracks:
-                            tracks[pid] = {
-                                "last_sign": current_sign,
-                                "counted": False,
-                            }
-
-                        last_sign = tracks[pid]["last_sign"]
-                        if current_sign != last_sign:
-                            if current_sign == 1:
-                                inside_total += 1
-                            else:
-                                inside_total -= 1
-                            tracks[pid]["last_sign"] = current_sign
-
-                        if inside_total < 0:
-                            inside_total = 0
-
-                    # назначаем бокс в рои
-                    is_sitting = False
-                    matched_table = best_roi_for_bbox(rois, box)
-
-                    if matched_table is None and pid is not None:
-                        # удерживаем рои для трека
-                        prev = track_table.get(pid)
-                        if prev is not None and (now_ts - prev["ts"]) <= TRACK_TABLE_TTL_SECONDS:
-                            matched_table = int(prev["table_idx"])
-
-                    if matched_table is not None:
-                        # дедуп внутри одного стола
-                        per_table_boxes[int(matched_table)].append(box)
-                        per_table_scores[int(matched_table)].append(score)
-                        is_sitting = True
-                        if pid is not None:
-                            track_table[pid] = {"table_idx": int(matched_table), "ts": now_ts}
-
-                        cv2.rectangle(
-                            output,
-                            (int(box[0]), int(box[1])),
-                            (int(box[2]), int(box[3])),
-                            (0, 0, 255),
-                            2,
-                        )
-                        cv2.circle(output, (cx, cy), 4, (0, 0, 255), -1)
-
-                    if not is_sitting:
-                        cv2.rectangle(
-                            output,
-                            (int(box[0]), int(box[1])),
-                            (int(box[2]), int(box[3])),
-                            (0, 255, 0),
-                            2,
-                        )
-
-            # считаем людей после дедупа
-            inferred_counts = None
-            if do_infer:
-                inferred_counts = [0] * len(rois)
-                for t_idx in range(len(rois)):
-                    if not per_table_boxes[t_idx]:
-                        continue
-                    keep = dedup_boxes_by_iou(
-                        per_table_boxes[t_idx],
-                        per_table_scores[t_idx],
-                        iou_threshold=DEDUP_IOU_THRESHOLD,
-                    )
-                    inferred_counts[t_idx] = int(len(keep))
-
-            cv2.line(output, entry_line[0], entry_line[1], (255, 0, 0), 3)
-            mid_x = int((entry_line[0][0] + entry_line[1][0]) / 2)
-            mid_y = int((entry_line[0][1] + entry_line[1][1]) / 2)
-            cv2.putText(
-                output,
-                "ENTRY LINE",
-                (entry_line[0][0], entry_line[0][1] - 10),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.6,
-                (255, 0, 0),
-                2,
-            )
-
-            # сглаживаем счетчики по кадрам
-            now_ts = time.time()
-            if smoother is not None:
-                smoother.update(inferred_counts, now_ts)
-                tables_status = smoother.current(now_ts)
-            else:
-                tables_status = [0] * len(rois)
-
-            for idx, roi in enumerate(rois):
-                count = tables_status[idx]
-                color = (0, 255, 0) if count < TABLE_CAPACITY else (0, 0, 255)
-
-                cv2.polylines(output, [roi], True, color, 2)
-
-                M = cv2.moments(roi)
-                if M["m00"] != 0:
-                    cX = int(M["m10"] / M["m00"])
-                    cY = int(M["m01"] / M["m00"])
-                    label = f"T{idx+1}: {count}/{TABLE_CAPACITY}"
-                    cv2.putText(
-                        output,
-                        label,
-                        (cX - 30, cY),
-                        cv2.FONT_HERSHEY_SIMPLEX,
-                        0.6,
-                        (255, 255, 255),
-                        2,
-                    )
-
-            total_seated = int(sum(tables_status))
-            total_free = max(0, (len(rois) * TABLE_CAPACITY) - total_seated)
-
-            # счетчик линии может ошибаться
-            # итог берем по столам
-            cv2.rectangle(output, (0, 0), (360, 90), (0, 0, 0), -1)
-            cv2.putText(
-                output,
-                f"TOTAL INSIDE (tables): {total_seated}",
-                (10, 30),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.8,
-                (255, 255, 255),
-                2,
-            )
-            cv2.putText(
-                output,
-                f"CROSSINGS (debug): {inside_total}",
-                (10, 58),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.6,
-                (200, 200, 200),
-                1,
-            )
-            cv2.putText(
-                output,
-                f"FREE: {total_free}",
-                (10, 82),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.6,
-                (200, 200, 200),
-                1,
-            )
-
+            started = time.perf_counter()
+            snapshot_due = bool(SNAPSHOT_PATH) and time.time() - last_snapshot_time >= SNAPSHOT_INTERVAL_SECONDS
+            if not HEADLESS or snapshot_due:
+                # кадр дальше никому не нужен, рисуем без копии
+                draw_overlay(packet.frame, rois, entry_line, packet)
+            if snapshot_due:
+                write_snapshot(SNAPSHOT_PATH, packet.frame)
+                last_snapshot_time = time.time()
+
+            # изменение уходит сразу, в тишине только heartbeat
+            action = posting.decide(packet.tables_status, time.time())
+            if action == "update":
+                publisher.publish(packet.tables_status, captured_ts=packet.captured_ts, inferred_ts=packet.inferred_ts)
+            elif action == "heartbeat":
+                publisher.heartbeat(len(packet.tables_status))
 
             if time.time() - last_log_time > LOG_INTERVAL:
-                # СВЯЗЬ ML И БЕКЕНДА: HTTP POST
-                post_table_occupancy(_session, BACKEND_UPDATE_URL, tables_status, timeout_seconds=0.5, debug=True)
-
-                if CLEAR_CONSOLE:
-                    os.system('cls' if os.name == 'nt' else 'clear')
-
-                t_now = datetime.now().strftime("%H:%M:%S")
-                print(f"--- ОТЧЕТ {t_now} ---")
-                print(f"Посетителей (по столам): {total_seated}")
-                print(f"Посетителей (по линии входа, debug): {inside_total}")
-                print("-" * 35)
-                print(f"{'Стол':<6} | {'Занято':<8} | {'Свободно':<8}")
-                print("-" * 35)
-
-                for idx, count in enumerate(tables_status):
-                    free = max(0, TABLE_CAPACITY - count)
-                    status_str = f"{count}" if count <= TABLE_CAPACITY else f"{count} (!)"
-                    print(f"#{idx+1:<5} | {status_str:<8} | {free:<8}")
-
-                print("-" * 35)
+                print_report(packet.tables_status, packet.inside_total, pipeline, scheduler, publisher)
                 last_log_time = time.time()
 
-            cv2.imshow("Monitor", output)
-            if cv2.waitKey(1) & 0xFF == ord('q'):
+            key = -1
+            if not HEADLESS:
+                cv2.imshow("Monitor", packet.frame)
+                key = cv2.waitKey(1) & 0xFF
+            render_stats.record(started, time.perf_counter())
+            if key == ord('q'):
                 break
     except KeyboardInterrupt:
         print("\nStopping ML (Ctrl+C).")
+    finally:
+        pipeline.stop()
+        publisher.stop()
 
     cap.release()
-    cv2.destroyAllWindows()
-    return 0
+    if not HEADLESS:
+        cv2.destroyAllWindows()
+    return 1 if pipeline.error is not None else 0
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("video_path")
     args = parser.parse_args()
-    raise SystemExit(main(args.video_path))
\ No newline at end of file
+    raise SystemExit(main(args.video_path))
@@ -0,0 +1,295 @@
+"""несколько камер на одной модели йоло"""
+
+import argparse
+import itertools
+import json
+import os
+import queue
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List
+
+import cv2
+
+from main_detector import (
+    CLEAR_CONSOLE,
+    LOG_INTERVAL,
+    PIPELINE_QUEUE_SIZE,
+    PROCESS_EVERY_N_FRAMES,
+    ROI_RASTER,
+    TABLE_CAPACITY,
+    INFERENCE_BACKEND,
+    FramePacket,
+    build_backend,
+    build_crop_layout,
+    build_id_tracker,
+    build_posting_policy,
+    build_publisher,
+    build_roi_raster,
+    build_scheduler,
+    build_tracker,
+    format_publisher_stats,
+    load_scene,
+    should_drop_frames,
+)
+from pipeline import Pipeline, QueueClosed, StageQueue
+
+
+@dataclass
+class Camera:
+    camera_id: str
+    source: Any
+    rois: list
+    entry_line: Any
+    inside_ref_point: Any
+    # номер первого стола камеры в общей нумерации
+    first_table_id: int
+
+
+def load_cameras(config_path: str) -> List[Camera]:
+    """камеры из json, пути к pkl от папки конфига"""
+    with open(config_path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+
+    base_dir = os.path.dirname(os.path.abspath(config_path))
+    cameras: List[Camera] = []
+    next_table_id = 1
+    for item in config["cameras"]:
+        camera_id = str(item["id"])
+        if any(c.camera_id == camera_id for c in cameras):
+            raise ValueError(f"камера {camera_id} указана дважды")
+
+        source = str(item["source"])
+        rois, entry_line, inside_ref_point = load_scene(
+            os.path.join(base_dir, item.get("tables", f"{camera_id}_tables.pkl")),
+            os.path.join(base_dir, item.get("entry_lines", f"{camera_id}_entry_lines.pkl")),
+        )
+        # по умолчанию столы камер идут подряд
+        first_table_id = int(item.get("first_table_id", next_table_id))
+        if first_table_id < 1:
+            raise ValueError(f"камера {camera_id}: first_table_id должен быть >= 1")
+
+        cameras.append(
+            Camera(
+                camera_id=camera_id,
+                source=int(source) if source.isdigit() else source,
+                rois=rois,
+                entry_line=entry_line,
+                inside_ref_point=inside_ref_point,
+                first_table_id=first_table_id,
+            )
+        )
+        next_table_id = max(next_table_id, first_table_id + len(rois))
+    return cameras
+
+
+def gather_batch(frame_queues: List[StageQueue], stop_event, poll_seconds: float = 0.005):
+    """по последнему кадру с каждой камеры, none когда все кончились"""
+    while not stop_event.is_set():
+        batch = []
+        open_queues = 0
+        for q in frame_queues:
+            try:
+                batch.append(q.get(timeout=0))
+                open_queues += 1
+            except queue.Empty:
+                open_queues += 1
+            except QueueClosed:
+                pass
+        if batch:
+            return batch
+        if open_queues == 0:
+            return None
+        time.sleep(poll_seconds)
+    return None
+
+
+def print_cameras_report(cameras: List[Camera], latest: Dict[str, FramePacket], pipeline: Pipeline, publisher=None) -> None:
+    if CLEAR_CONSOLE:
+        os.system('cls' if os.name == 'nt' else 'clear')
+
+    t_now = datetime.now().strftime("%H:%M:%S")
+    print(f"--- ОТЧЕТ {t_now} ---")
+    for cam in cameras:
+        packet = latest.get(cam.camera_id)
+        status = packet.tables_status if packet is not None else [0] * len(cam.rois)
+        cells = " ".join(
+            f"#{cam.first_table_id + idx}:{count}/{TABLE_CAPACITY}" for idx, count in enumerate(status)
+        )
+        print(f"[{cam.camera_id}] посетителей {int(sum(status))} | {cells}")
+    print("-" * 35)
+    for line in pipeline.format_stats():
+        print(line)
+    if publisher is not None:
+        print(format_publisher_stats(publisher))
+
+
+def main(config_path: str):
+    try:
+        cameras = load_cameras(config_path)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"ОШИБКА: конфиг камер {config_path}: {e}")
+        return 1
+    if not cameras:
+        print("ОШИБКА: в конфиге нет камер")
+        return 1
+
+    # одна модель на все камеры
+    try:
+        backend = build_backend()
+    except (ImportError, OSError, RuntimeError, ValueError) as e:
+        print(f"ОШИБКА: бэкенд инференса {INFERENCE_BACKEND}: {e}")
+        return 1
+
+    pipeline = Pipeline()
+    batch_queue = StageQueue(PIPELINE_QUEUE_SIZE)
+    detect_queue = StageQueue(PIPELINE_QUEUE_SIZE)
+    report_queue = StageQueue(PIPELINE_QUEUE_SIZE)
+
+    caps = []
+    frame_queues = []
+    trackers = {}
+    id_trackers = {}
+    schedulers = {}
+    raster_ready = set()
+
+    def make_capture(cap, camera_id):
+        counter = itertools.count()
+
+        def capture():
+            ret, frame = cap.read()
+            if not ret:
+                print(f"[{camera_id}] поток завершен.")
+                return None
+            return FramePacket(index=next(counter), captured_ts=time.time(), frame=frame, camera_id=camera_id)
+
+        return capture
+
+    for cam in cameras:
+        cap = cv2.VideoCapture(cam.source)
+        frame_queue = StageQueue(PIPELINE_QUEUE_SIZE, drop_oldest=should_drop_frames(cam.source))
+        pipeline.add_source(f"cap:{cam.camera_id}", make_capture(cap, cam.camera_id), frame_queue)
+        caps.append(cap)
+        frame_queues.append(frame_queue)
+        trackers[cam.camera_id] = build_tracker(cam.rois, cam.entry_line, cam.inside_ref_point)
+        schedulers[cam.camera_id] = build_scheduler()
+        # батч без трекинга, иды свои на каждую камеру
+        id_trackers[cam.camera_id] = build_id_tracker()
+
+    rois_by_camera = {cam.camera_id: cam.rois for cam in cameras}
+    cameras_by_id = {cam.camera_id: cam for cam in cameras}
+    crop_layouts = {}
+
+    def infer(batch: List[FramePacket]) -> List[FramePacket]:
+        for packet in batch:
+            scheduler = schedulers[packet.camera_id]
+            if scheduler is not None:
+                packet.do_infer = scheduler.should_infer(packet.frame, packet.captured_ts)
+            else:
+                packet.do_infer = (packet.index % PROCESS_EVERY_N_FRAMES) == 0
+        to_infer = [packet for packet in batch if packet.do_infer]
+        if to_infer:
+            images = []
+            for packet in to_infer:
+                if packet.camera_id not in crop_layouts:
+                    cam = cameras_by_id[packet.camera_id]
+                    crop_layouts[packet.camera_id] = build_crop_layout(cam.rois, cam.entry_line, packet.frame.shape)
+                layout = crop_layouts[packet.camera_id]
+                images.append(packet.frame if layout is None else layout.compose(packet.frame))
+            for packet, detections in zip(to_infer, backend.detect_batch(images)):
+                packet.boxes, packet.ids, packet.confs = detections
+                layout = crop_layouts[packet.camera_id]
+                if layout is not None:
+                    packet.boxes, packet.ids, packet.confs = layout.map_boxes(packet.boxes, packet.ids, packet.confs)
+                packet.ids = id_trackers[packet.camera_id].update(packet.boxes, packet.captured_ts)
+        inferred_ts = time.time()
+        for packet in batch:
+            packet.inferred_ts = inferred_ts
+        return batch
+
+    def assign(batch: List[FramePacket]) -> List[FramePacket]:
+        for packet in batch:
+            tracker = trackers[packet.camera_id]
+            if ROI_RASTER and packet.camera_id not in raster_ready:
+                tracker.roi_matcher = build_roi_raster(rois_by_camera[packet.camera_id], packet.frame.shape)
+                raster_ready.add(packet.camera_id)
+            packet.detections, packet.tables_status = tracker.process(
+                packet.boxes,
+                packet.ids,
+                packet.confs,
+                packet.frame.shape,
+                packet.captured_ts,
+                inferred=packet.do_infer,
+            )
+            packet.inside_total = tracker.inside_total
+            scheduler = schedulers[packet.camera_id]
+            if scheduler is not None:
+                scheduler.observe_status(packet.tables_status, packet.captured_ts)
+            # кадр дальше не нужен
+            packet.frame = None
+        return batch
+
+    pipeline.add_source("batch", lambda: gather_batch(frame_queues, pipeline.stop_event), batch_queue)
+    pipeline.add_stage("inference", infer, batch_queue, detect_queue)
+    pipeline.add_stage("tables", assign, detect_queue, report_queue)
+    report_stats = pipeline.add_sink("report", report_queue)
+
+    latest: Dict[str, FramePacket] = {}
+    posting = {cam.camera_id: build_posting_policy() for cam in cameras}
+    last_log_time = time.time()
+    # СВЯЗЬ ML И БЕКЕНДА: отправка в своем потоке, по статусу на камеру
+    publisher = build_publisher().start()
+
+    print(f"Запуск системы: камер {len(cameras)}...")
+    pipeline.start()
+
+    try:
+        while True:
+            try:
+                batch = report_queue.get(timeout=0.1)
+            except queue.Empty:
+                if pipeline.stop_event.is_set():
+                    break
+                continue
+            except QueueClosed:
+                print("Все потоки завершены.")
+                break
+
+            started = time.perf_counter()
+            for packet in batch:
+                latest[packet.camera_id] = packet
+                # изменение уходит сразу, в тишине только heartbeat
+                cam = cameras_by_id[packet.camera_id]
+                action = posting[cam.camera_id].decide(packet.tables_status, time.time())
+                if action == "update":
+                    publisher.publish(
+                        packet.tables_status,
+                        camera_id=cam.camera_id,
+                        first_table_id=cam.first_table_id,
+                        captured_ts=packet.captured_ts,
+                        inferred_ts=packet.inferred_ts,
+                    )
+                elif action == "heartbeat":
+                    publisher.heartbeat(len(packet.tables_status), camera_id=cam.camera_id)
+
+            if time.time() - last_log_time > LOG_INTERVAL:
+                print_cameras_report(cameras, latest, pipeline, publisher)
+                last_log_time = time.time()
+            report_stats.record(started, time.perf_counter())
+    except KeyboardInterrupt:
+        print("\nStopping ML (Ctrl+C).")
+    finally:
+        pipeline.stop()
+        publisher.stop()
+
+    for cap in caps:
+        cap.release()
+    return 1 if pipeline.error is not None else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="несколько камер на одной модели")
+    parser.add_argument("config", help="json со списком камер, пример cameras.example.json")
+    args = parser.parse_args()
+    raise SystemExit(main(args.config))
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from detector_utils import bbox_center, calculate_side, dedup_boxes_by_iou_grouped
+from smoothing import TableCountSmoother
+
+
+@dataclass
+class Detection:
+    box: Sequence[float]
+    center: Tuple[int, int]
+    table_idx: Optional[int]
+    track_id: Optional[int] = None
+
+
+class OccupancyTracker:
+    """боксы кадра в столы, счетчик входа и сглаживание"""
+
+    def __init__(
+        self,
+        n_tables: int,
+        entry_line,
+        inside_ref_point,
+        roi_matcher,
+        smoother: TableCountSmoother,
+        roi_min_conf: float,
+        min_bbox_area_ratio: float,
+        dedup_iou_threshold: float,
+        track_table_ttl_seconds: float,
+    ):
+        self.n_tables = int(n_tables)
+        self.entry_line = entry_line
+        self.inside_sign = 1 if calculate_side(entry_line, inside_ref_point) > 0 else -1
+        # растр подменяет матчер когда известен кадр
+        self.roi_matcher = roi_matcher
+        self.smoother = smoother
+        self.roi_min_conf = float(roi_min_conf)
+        self.min_bbox_area_ratio = float(min_bbox_area_ratio)
+        self.dedup_iou_threshold = float(dedup_iou_threshold)
+        self.track_table_ttl_seconds = float(track_table_ttl_seconds)
+
+        self.tracks: Dict[int, Dict[str, Any]] = {}
+        self.track_table: Dict[int, Dict[str, Any]] = {}
+        self.inside_total = 0
+
+    def _count_entry(self, pid: int, center: Tuple[int, int]) -> None:
+        # счетчик входа по идам
+        current_side_val = calculate_side(self.entry_line, center)
+        current_sign = 1 if (current_side_val * self.inside_sign) > 0 else -1
+
+        if pid not in self.tracks:
+            self.tracks[pid] = {
+                "last_sign": current_sign,
+                "counted": False,
+            }
+
+        last_sign = self.tracks[pid]["last_sign"]
+        if current_sign != last_sign:
+            if current_sign == 1:
+                self.inside_total += 1
+            else:
+                self.inside_total -= 1
+            self.tracks[pid]["last_sign"] = current_sign
+
+        if self.inside_total < 0:
+            self.inside_total = 0
+
+    def process(
+        self,
+        boxes,
+        ids,
+        confs,
+        frame_shape: Sequence[int],
+        now_ts: float,
+        inferred: bool = True,
+    ) -> Tuple[List[Detection], List[int]]:
+        """обрабатываем кадр, без инференса только удержание"""
+
+        detections: List[Detection] = []
+        per_table_boxes = [[] for _ in range(self.n_tables)]
+        per_table_scores = [[] for _ in range(self.n_tables)]
+        frame_area = float(frame_shape[0] * frame_shape[1]) if frame_shape is not None else 0.0
+
+        if boxes is not None:
+            # фильтруем ложные боксы тут
+            kept = []
+            for i, box in enumerate(boxes):
+                score = float(confs[i]) if confs is not None else 1.0
+                if score < self.roi_min_conf:
+                    continue
+                x1, y1, x2, y2 = [float(v) for v in box]
+                area = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+                if frame_area > 0 and area < (self.min_bbox_area_ratio * frame_area):
+                    continue
+                kept.append(i)
+
+            # все боксы против всех рои одним вызовом
+            matched_tables = self.roi_matcher.best_rois([boxes[i] for i in kept])
+
+            for i, matched_table in zip(kept, matched_tables):
+                box = boxes[i]
+                score = float(confs[i]) if confs is not None else 1.0
+                center = bbox_center(box)
+
+                pid = int(ids[i]) if ids is not None else None
+                if pid is not None:
+                    self._count_entry(pid, center)
+
+                if matched_table is None and pid is not None:
+                    # удерживаем рои для трека
+                    prev = self.track_table.get(pid)
+                    if prev is not None and (now_ts - prev["ts"]) <= self.track_table_ttl_seconds:
+                        matched_table = int(prev["table_idx"])
+
+                if matched_table is not None:
+                    # дедуп внутри одного стола
+                    per_table_boxes[int(matched_table)].append(box)
+                    per_table_scores[int(matched_table)].append(score)
+                    if pid is not None:
+                        self.track_table[pid] = {"table_idx": int(matched_table), "ts": now_ts}
+
+                detections.append(
+                    Detection(
+                        box=box,
+                        center=center,
+                        table_idx=None if matched_table is None else int(matched_table),
+                        track_id=pid,
+                    )
+                )
+
+        # считаем людей после дедупа
+        inferred_counts = None
+        if inferred:
+            # все столы одной матрицей айоу
+            keeps = dedup_boxes_by_iou_grouped(
+                per_table_boxes,
+                per_table_scores,
+                iou_threshold=self.dedup_iou_threshold,
+            )
+            inferred_counts = [int(len(keep)) for keep in keeps]
+
+        self.smoother.update(inferred_counts, now_ts)
+        return detections, self.smoother.current(now_ts)
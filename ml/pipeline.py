@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import collections
+import queue
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+
+class QueueClosed(Exception):
+    """очередь закрыта и уже пуста"""
+
+
+class StageQueue:
+    """ограниченная очередь между стадиями"""
+
+    def __init__(self, maxsize: int, drop_oldest: bool = False):
+        self.maxsize = max(1, int(maxsize))
+        # для живой камеры старый кадр не нужен
+        self.drop_oldest = bool(drop_oldest)
+        self.dropped = 0
+        self._items: Deque[Any] = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def put(self, item: Any) -> bool:
+        """false если очередь уже закрыта"""
+        with self._cond:
+            if self.drop_oldest:
+                while len(self._items) >= self.maxsize and not self._closed:
+                    self._items.popleft()
+                    self.dropped += 1
+            else:
+                while len(self._items) >= self.maxsize and not self._closed:
+                    self._cond.wait()
+            if self._closed:
+                return False
+            self._items.append(item)
+            self._cond.notify_all()
+            return True
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        """queue.Empty по таймауту, QueueClosed в конце"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self._items:
+                if self._closed:
+                    raise QueueClosed()
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty()
+                self._cond.wait(remaining)
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def close(self, discard: bool = False) -> None:
+        """остаток дочитают если не discard"""
+        with self._cond:
+            self._closed = True
+            if discard:
+                self._items.clear()
+            self._cond.notify_all()
+
+    def qsize(self) -> int:
+        with self._cond:
+            return len(self._items)
+
+
+class StageStats:
+    """фпс стадии по скользящему окну"""
+
+    def __init__(self, name: str, window_seconds: float = 5.0):
+        self.name = name
+        self.window_seconds = float(window_seconds)
+        self.items = 0
+        self.busy_seconds = 0.0
+        self._done: Deque[float] = collections.deque()
+        self._lock = threading.Lock()
+
+    def record(self, started: float, finished: float) -> None:
+        with self._lock:
+            self.items += 1
+            self.busy_seconds += finished - started
+            self._done.append(finished)
+            while self._done and finished - self._done[0] > self.window_seconds:
+                self._done.popleft()
+
+    def fps(self) -> float:
+        with self._lock:
+            if len(self._done) < 2:
+                return 0.0
+            span = self._done[-1] - self._done[0]
+            return (len(self._done) - 1) / span if span > 0 else 0.0
+
+    def busy_ms(self) -> float:
+        with self._lock:
+            return self.busy_seconds * 1000.0 / self.items if self.items else 0.0
+
+
+class Pipeline:
+    """стадии в своих потоках через ограниченные очереди"""
+
+    def __init__(self) -> None:
+        self.stop_event = threading.Event()
+        self.error: Optional[BaseException] = None
+        self._threads: List[threading.Thread] = []
+        # стадия и ее входная очередь для отчета
+        self._stages: List[Dict[str, Any]] = []
+
+    def _stage(self, name: str, in_queue: Optional[StageQueue]) -> StageStats:
+        stats = StageStats(name)
+        self._stages.append({"stats": stats, "queue": in_queue})
+        return stats
+
+    def _fail(self, name: str, e: BaseException) -> None:
+        print(f"ОШИБКА стадии {name}: {e!r}")
+        if self.error is None:
+            self.error = e
+        self.stop_event.set()
+
+    def add_source(self, name: str, read_fn: Callable[[], Any], out_queue: StageQueue) -> StageStats:
+        """источник, read_fn вернул none значит поток кончился"""
+        stats = self._stage(name, None)
+
+        def run() -> None:
+            try:
+                while not self.stop_event.is_set():
+                    started = time.perf_counter()
+                    item = read_fn()
+                    if item is None:
+                        break
+                    stats.record(started, time.perf_counter())
+                    if not out_queue.put(item):
+                        break
+            except Exception as e:
+                self._fail(name, e)
+            finally:
+                out_queue.close()
+
+        self._threads.append(threading.Thread(target=run, name=name, daemon=True))
+        return stats
+
+    def add_stage(
+        self,
+        name: str,
+        fn: Callable[[Any], Any],
+        in_queue: StageQueue,
+        out_queue: Optional[StageQueue] = None,
+    ) -> StageStats:
+        """стадия, fn вернул none значит элемент дальше не идет"""
+        stats = self._stage(name, in_queue)
+
+        def run() -> None:
+            try:
+                while not self.stop_event.is_set():
+                    try:
+                        item = in_queue.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    except QueueClosed:
+                        break
+                    started = time.perf_counter()
+                    out = fn(item)
+                    stats.record(started, time.perf_counter())
+                    if out is not None and out_queue is not None and not out_queue.put(out):
+                        break
+            except Exception as e:
+                self._fail(name, e)
+            finally:
+                if out_queue is not None:
+                    out_queue.close()
+
+        self._threads.append(threading.Thread(target=run, name=name, daemon=True))
+        return stats
+
+    def add_sink(self, name: str, in_queue: StageQueue) -> StageStats:
+        """стадия в главном потоке, например окно opencv"""
+        return self._stage(name, in_queue)
+
+    def start(self) -> None:
+        for t in self._threads:
+            t.start()
+
+    def stop(self, timeout: float = 2.0) -> None:
+        self.stop_event.set()
+        for stage in self._stages:
+            if stage["queue"] is not None:
+                stage["queue"].close(discard=True)
+        for t in self._threads:
+            t.join(timeout)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        out = []
+        for stage in self._stages:
+            stats, in_queue = stage["stats"], stage["queue"]
+            out.append(
+                {
+                    "stage": stats.name,
+                    "fps": round(stats.fps(), 1),
+                    "busy_ms": round(stats.busy_ms(), 1),
+                    "items": stats.items,
+                    "queue_depth": None if in_queue is None else in_queue.qsize(),
+                    "queue_max": None if in_queue is None else in_queue.maxsize,
+                    "dropped": None if in_queue is None else in_queue.dropped,
+                }
+            )
+        return out
+
+    def format_stats(self) -> List[str]:
+        lines = [f"{'Стадия':<10} | {'FPS':>6} | {'мс/кадр':>8} | {'очередь':>8} | {'сброшено':>8}"]
+        for s in self.stats():
+            depth = "-" if s["queue_depth"] is None else f"{s['queue_depth']}/{s['queue_max']}"
+            dropped = "-" if s["dropped"] is None else str(s["dropped"])
+            lines.append(f"{s['stage']:<10} | {s['fps']:>6.1f} | {s['busy_ms']:>8.1f} | {depth:>8} | {dropped:>8}")
+        return lines
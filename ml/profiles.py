@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, List, Sequence
+
+
+@dataclass(frozen=True)
+class ModelProfile:
+    name: str
+    backend: str
+    weights: str
+    imgsz: int
+    conf: float
+    # int8 через экспорт ultralytics с калибровкой
+    int8: bool = False
+    description: str = ""
+
+
+MODEL_PROFILES: Dict[str, ModelProfile] = {
+    p.name: p
+    for p in (
+        ModelProfile(
+            name="accurate",
+            backend="ultralytics",
+            weights="yolov8s.pt",
+            imgsz=960,
+            conf=0.25,
+            description="эталон: модель s, pytorch, полный размер",
+        ),
+        ModelProfile(
+            name="balanced",
+            backend="onnx",
+            weights="yolov8n.pt",
+            imgsz=768,
+            conf=0.25,
+            description="модель n в onnxruntime, размер поменьше",
+        ),
+        ModelProfile(
+            name="fast",
+            backend="openvino",
+            weights="yolov8n.pt",
+            imgsz=640,
+            conf=0.2,
+            int8=True,
+            description="модель n int8 в openvino, малый размер",
+        ),
+    )
+}
+
+
+def get_profile(name: str) -> ModelProfile:
+    try:
+        return MODEL_PROFILES[name]
+    except KeyError:
+        raise ValueError(f"неизвестный профиль модели {name}, есть: {', '.join(MODEL_PROFILES)}") from None
+
+
+def compare_counts(reference: Sequence[Sequence[int]], other: Sequence[Sequence[int]]) -> Dict[str, float]:
+    """насколько счетчики столов расходятся с эталоном по кадрам"""
+    n = min(len(reference), len(other))
+    if n == 0:
+        return {"frames": 0, "mean_abs_diff": 0.0, "max_abs_diff": 0, "frames_equal": 0.0, "tables_equal": 0.0}
+
+    abs_diffs: List[int] = []
+    frames_equal = 0
+    for ref_row, row in zip(reference[:n], other[:n]):
+        diffs = [abs(int(a) - int(b)) for a, b in zip(ref_row, row)]
+        abs_diffs.extend(diffs)
+        frames_equal += int(not any(diffs))
+    return {
+        "frames": n,
+        # ошибка на стол на кадр
+        "mean_abs_diff": sum(abs_diffs) / len(abs_diffs) if abs_diffs else 0.0,
+        "max_abs_diff": max(abs_diffs, default=0),
+        "frames_equal": frames_equal / n,
+        "tables_equal": sum(1 for d in abs_diffs if d == 0) / len(abs_diffs) if abs_diffs else 1.0,
+    }
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import math
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from detector_utils import _roi_points
+
+# x0, y0, x1, y1 с исключенной правой и нижней границей
+Rect = Tuple[int, int, int, int]
+
+
+def _rects_touch(a: Rect, b: Rect, gap: int) -> bool:
+    return a[0] < b[2] + gap and b[0] < a[2] + gap and a[1] < b[3] + gap and b[1] < a[3] + gap
+
+
+def merge_rects(rects: Iterable[Rect], gap: int = 0) -> List[Rect]:
+    """сливаем окна которые пересекаются или почти касаются"""
+    merged = [tuple(int(v) for v in r) for r in rects]
+    changed = True
+    while changed:
+        changed = False
+        for i in range(len(merged)):
+            for j in range(i + 1, len(merged)):
+                a, b = merged[i], merged[j]
+                if _rects_touch(a, b, gap):
+                    merged[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    del merged[j]
+                    changed = True
+                    break
+            if changed:
+                break
+    return sorted(merged)
+
+
+def pack_rects(sizes: Sequence[Tuple[int, int]], gap: int) -> Tuple[List[Tuple[int, int]], Tuple[int, int]]:
+    """полками в почти квадрат, йоло все равно режет в квадрат"""
+    total_area = sum(w * h for w, h in sizes)
+    row_limit = max(max(w for w, _ in sizes), int(math.ceil(math.sqrt(total_area))))
+    placements: List[Optional[Tuple[int, int]]] = [None] * len(sizes)
+    x = y = row_h = width = 0
+    for i in sorted(range(len(sizes)), key=lambda k: -sizes[k][1]):
+        w, h = sizes[i]
+        if x > 0 and x + w > row_limit:
+            y += row_h + gap
+            x = row_h = 0
+        placements[i] = (x, y)
+        x += w + gap
+        row_h = max(row_h, h)
+        width = max(width, x - gap)
+    return placements, (width, y + row_h)
+
+
+class CropLayout:
+    """окна вокруг столов и линии входа в одной мозаике"""
+
+    def __init__(self, regions: List[Rect], placements: List[Tuple[int, int]], mosaic_size: Tuple[int, int], frame_size: Tuple[int, int]):
+        self.regions = regions
+        self.placements = placements
+        self.mosaic_width, self.mosaic_height = mosaic_size
+        self.frame_width, self.frame_height = frame_size
+        self._buffer: Optional[np.ndarray] = None
+
+    @classmethod
+    def build(
+        cls,
+        rois,
+        entry_line,
+        frame_width: int,
+        frame_height: int,
+        pad_px: int,
+        pad_top_px: int,
+        gap_px: int = 16,
+    ) -> "CropLayout":
+        rects: List[Rect] = []
+        polygons = [_roi_points(roi) for roi in rois]
+        if entry_line is not None:
+            polygons.append([tuple(p) for p in entry_line])
+        for poly in polygons:
+            if not poly:
+                continue
+            xs = [p[0] for p in poly]
+            ys = [p[1] for p in poly]
+            # сидящий человек выше стола, сверху запас больше
+            rects.append(
+                (
+                    max(0, int(math.floor(min(xs))) - pad_px),
+                    max(0, int(math.floor(min(ys))) - pad_top_px),
+                    min(frame_width, int(math.ceil(max(xs))) + pad_px + 1),
+                    min(frame_height, int(math.ceil(max(ys))) + pad_px + 1),
+                )
+            )
+        if not rects:
+            rects = [(0, 0, frame_width, frame_height)]
+
+        # близкие окна проще взять одним, шов режет людей
+        regions = merge_rects(rects, gap=gap_px)
+        placements, mosaic_size = pack_rects([(r[2] - r[0], r[3] - r[1]) for r in regions], gap_px)
+        return cls(regions, placements, mosaic_size, (frame_width, frame_height))
+
+    @property
+    def pixel_ratio(self) -> float:
+        """доля пикселей мозаики от кадра"""
+        return (self.mosaic_width * self.mosaic_height) / float(self.frame_width * self.frame_height)
+
+    def compose(self, frame: np.ndarray) -> np.ndarray:
+        if len(self.regions) == 1:
+            # одно окно без копии
+            x0, y0, x1, y1 = self.regions[0]
+            return frame[y0:y1, x0:x1]
+
+        shape = (self.mosaic_height, self.mosaic_width) + frame.shape[2:]
+        if self._buffer is None or self._buffer.shape != shape or self._buffer.dtype != frame.dtype:
+            # швы остаются черными
+            self._buffer = np.zeros(shape, dtype=frame.dtype)
+        for (x0, y0, x1, y1), (px, py) in zip(self.regions, self.placements):
+            self._buffer[py : py + (y1 - y0), px : px + (x1 - x0)] = frame[y0:y1, x0:x1]
+        return self._buffer
+
+    def map_boxes(self, boxes, ids=None, confs=None):
+        """боксы мозаики в координаты кадра, бокс на шве отдаем его окну"""
+        if boxes is None or len(boxes) == 0:
+            return boxes, ids, confs
+
+        b = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        cx = (b[:, 0] + b[:, 2]) / 2.0
+        cy = (b[:, 1] + b[:, 3]) / 2.0
+        out = np.empty_like(b)
+        keep = np.zeros(len(b), dtype=bool)
+        for (x0, y0, x1, y1), (px, py) in zip(self.regions, self.placements):
+            w, h = x1 - x0, y1 - y0
+            inside = (cx >= px) & (cx < px + w) & (cy >= py) & (cy < py + h) & ~keep
+            if not inside.any():
+                continue
+            # обрезаем по окну и сдвигаем в кадр
+            out[inside, 0] = np.clip(b[inside, 0], px, px + w) - px + x0
+            out[inside, 2] = np.clip(b[inside, 2], px, px + w) - px + x0
+            out[inside, 1] = np.clip(b[inside, 1], py, py + h) - py + y0
+            out[inside, 3] = np.clip(b[inside, 3], py, py + h) - py + y0
+            keep |= inside
+
+        out = out[keep]
+        ids = None if ids is None else np.asarray(ids)[keep]
+        confs = None if confs is None else np.asarray(confs)[keep]
+        return out, ids, confs
@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import hashlib
+import math
+import os
+from typing import Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from detector_utils import RoiMatcher, _roi_points, anchor_points_array, pick_best_rois
+
+# версия формата кэша растра
+_RASTER_FORMAT = "v1"
+
+
+class RoiRaster:
+    """растр рои для выбора стола по таблице"""
+
+    def __init__(
+        self,
+        labels: np.ndarray,
+        distances: np.ndarray,
+        n_rois: int,
+        scale: int,
+        roi_margin_px: float,
+        fallback: RoiMatcher,
+    ):
+        # слои на случай пересечения рои с запасом
+        self.labels = labels
+        self.distances = distances
+        self.n_rois = int(n_rois)
+        self.scale = max(1, int(scale))
+        self.roi_margin_px = float(roi_margin_px)
+        self._fallback = fallback
+
+    @classmethod
+    def build(
+        cls,
+        rois: Iterable,
+        frame_width: int,
+        frame_height: int,
+        roi_margin_px: float,
+        scale: int = 1,
+    ) -> "RoiRaster":
+        """растеризуем рои один раз на запуск"""
+        rois = list(rois)
+        scale = max(1, int(scale))
+        margin = float(roi_margin_px)
+        width = int(math.ceil(frame_width / scale))
+        height = int(math.ceil(frame_height / scale))
+
+        labels: List[np.ndarray] = []
+        distances: List[np.ndarray] = []
+
+        for r, roi in enumerate(rois):
+            poly = _roi_points(roi)
+            if len(poly) < 2:
+                continue
+            xs = [p[0] for p in poly]
+            ys = [p[1] for p in poly]
+            # только окно рои с запасом
+            i0 = max(0, int(math.ceil((min(xs) - margin) / scale)))
+            i1 = min(width - 1, int(math.floor((max(xs) + margin) / scale)))
+            j0 = max(0, int(math.ceil((min(ys) - margin) / scale)))
+            j1 = min(height - 1, int(math.floor((max(ys) + margin) / scale)))
+            if i0 > i1 or j0 > j1:
+                continue
+
+            jj, ii = np.mgrid[j0 : j1 + 1, i0 : i1 + 1]
+            points = np.stack([ii.ravel() * scale, jj.ravel() * scale], axis=1).astype(np.float64)
+            dist = RoiMatcher([roi], margin).signed_distances(points)[:, 0]
+            hit = dist >= -margin
+            if not hit.any():
+                continue
+            jj, ii, dist = jj.ravel()[hit], ii.ravel()[hit], dist[hit]
+
+            # пиксель кладем в первый свободный слой
+            for layer in range(len(labels) + 1):
+                if layer == len(labels):
+                    labels.append(np.full((height, width), -1, dtype=np.int16))
+                    distances.append(np.zeros((height, width), dtype=np.float64))
+                free = labels[layer][jj, ii] == -1
+                labels[layer][jj[free], ii[free]] = r
+                distances[layer][jj[free], ii[free]] = dist[free]
+                jj, ii, dist = jj[~free], ii[~free], dist[~free]
+                if jj.size == 0:
+                    break
+
+        if not labels:
+            labels.append(np.full((height, width), -1, dtype=np.int16))
+            distances.append(np.zeros((height, width), dtype=np.float64))
+
+        return cls(
+            np.stack(labels),
+            np.stack(distances),
+            len(rois),
+            scale,
+            margin,
+            RoiMatcher(rois, margin),
+        )
+
+    def contains(self, roi_idx: int, point: Sequence[float]) -> bool:
+        """точка в рои с учетом запаса"""
+        i = int(point[0] // self.scale)
+        j = int(point[1] // self.scale)
+        if not (0 <= j < self.labels.shape[1] and 0 <= i < self.labels.shape[2]):
+            roi_dist = self._fallback.signed_distances(np.array([point], dtype=np.float64))
+            return bool(roi_dist[0, roi_idx] >= -self.roi_margin_px)
+        return bool((self.labels[:, j, i] == roi_idx).any())
+
+    def best_rois(self, boxes: Sequence[Sequence[float]]) -> List[Optional[int]]:
+        """лучшая рои для каждого бокса по растру"""
+        n_boxes = len(boxes)
+        if n_boxes == 0:
+            return []
+        if self.n_rois == 0:
+            return [None] * n_boxes
+
+        points, point_mask = anchor_points_array(boxes)
+        ii = np.floor_divide(points[:, :, 0], self.scale).astype(np.int64)
+        jj = np.floor_divide(points[:, :, 1], self.scale).astype(np.int64)
+        inside_raster = (
+            (ii >= 0) & (ii < self.labels.shape[2]) & (jj >= 0) & (jj < self.labels.shape[1])
+        )
+        # боксы за краем кадра считаем точно
+        fallback_rows = np.where((~inside_raster & point_mask).any(axis=1))[0]
+        ii = np.where(inside_raster, ii, 0)
+        jj = np.where(inside_raster, jj, 0)
+
+        in_count = np.zeros((n_boxes, self.n_rois), dtype=np.int64)
+        dist_sum = np.zeros((n_boxes, self.n_rois), dtype=np.float64)
+        rows = np.arange(n_boxes)
+        # по порядку точек как скалярная версия
+        for k in range(points.shape[1]):
+            valid_k = point_mask[:, k] & inside_raster[:, k]
+            for layer in range(self.labels.shape[0]):
+                label = self.labels[layer, jj[:, k], ii[:, k]]
+                use = valid_k & (label >= 0)
+                if not use.any():
+                    continue
+                in_count[rows[use], label[use]] += 1
+                dist_sum[rows[use], label[use]] += self.distances[layer, jj[use, k], ii[use, k]]
+
+        result = pick_best_rois(in_count, dist_sum)
+        if fallback_rows.size:
+            exact = self._fallback.best_rois([boxes[i] for i in fallback_rows])
+            for i, best in zip(fallback_rows, exact):
+                result[int(i)] = best
+        return result
+
+    def save(self, path: str) -> None:
+        tmp_path = f"{path}.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            labels=self.labels,
+            distances=self.distances,
+            meta=np.array([self.n_rois, self.scale], dtype=np.int64),
+            margin=np.array([self.roi_margin_px], dtype=np.float64),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, rois: Iterable) -> "RoiRaster":
+        rois = list(rois)
+        with np.load(path) as data:
+            n_rois, scale = (int(v) for v in data["meta"])
+            margin = float(data["margin"][0])
+            return cls(
+                data["labels"],
+                data["distances"],
+                n_rois,
+                scale,
+                margin,
+                RoiMatcher(rois, margin),
+            )
+
+
+def roi_raster_key(rois: Iterable, frame_width: int, frame_height: int, roi_margin_px: float, scale: int) -> str:
+    """ключ кэша по рои и размеру кадра"""
+    h = hashlib.sha1()
+    h.update(f"{_RASTER_FORMAT}:{frame_width}x{frame_height}:{float(roi_margin_px)}:{int(scale)}".encode())
+    for roi in rois:
+        pts = np.asarray(_roi_points(roi), dtype=np.int64)
+        h.update(str(pts.shape).encode())
+        h.update(pts.tobytes())
+    return h.hexdigest()[:16]
+
+
+def load_or_build_roi_raster(
+    rois: Iterable,
+    frame_width: int,
+    frame_height: int,
+    roi_margin_px: float,
+    scale: int = 1,
+    cache_dir: Optional[str] = None,
+) -> RoiRaster:
+    """растр из кэша или строим и сохраняем"""
+    rois = list(rois)
+    path = None
+    if cache_dir:
+        key = roi_raster_key(rois, frame_width, frame_height, roi_margin_px, scale)
+        path = os.path.join(cache_dir, f"roi_raster_{key}.npz")
+        if os.path.exists(path):
+            try:
+                return RoiRaster.load(path, rois)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"кэш растра рои поврежден пересоздаем: {e}")
+
+    raster = RoiRaster.build(rois, frame_width, frame_height, roi_margin_px, scale)
+    if path is not None:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            raster.save(path)
+        except OSError as e:
+            print(f"не удалось сохранить кэш растра рои: {e}")
+    return raster
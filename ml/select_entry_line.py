@@ -32,6 +32,8 @@ def select_logic(event, x, y, flags, param):
 
 parser = argparse.ArgumentParser()
 parser.add_argument("video_path")
+# свой файл на камеру для нескольких залов
+parser.add_argument("--out", default="entry_lines.pkl")
 args = parser.parse_args()
 
 cap = cv2.VideoCapture(args.video_path)
@@ -69,9 +71,9 @@ while True:
                 "line": points,
                 "inside_ref": inside_point
             }
-            with open("entry_lines.pkl", "wb") as f:
+            with open(args.out, "wb") as f:
                 pickle.dump(data, f)
-            print("[OK] Сохранено в entry_lines.pkl")
+            print(f"[OK] Сохранено в {args.out}")
             break
         else:
             print("Сначала закончи настройку (2 точки линии + 1 точка внутри)!")
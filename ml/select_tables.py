@@ -29,6 +29,8 @@ def select_points(event, x, y, flags, param):
 
 parser = argparse.ArgumentParser(description="Выбор столов (ROI)")
 parser.add_argument("video_path", type=str)
+# свой файл на камеру для нескольких залов
+parser.add_argument("--out", type=str, default="tables.pkl")
 args = parser.parse_args()
 
 cap = cv2.VideoCapture(args.video_path)
@@ -62,9 +64,9 @@ while True:
         current_polygon_points = []
 
     elif key == ord("s"):
-        with open("tables.pkl", "wb") as f:
+        with open(args.out, "wb") as f:
             pickle.dump(rois, f)
-        print("[OK] СТОЛЫ СОХРАНЕНЫ → tables.pkl")
+        print(f"[OK] СТОЛЫ СОХРАНЕНЫ → {args.out}")
         break
 
 cv2.destroyAllWindows()
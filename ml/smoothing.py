@@ -10,12 +10,18 @@ class TableCountSmoother:
     smooth_window: int
     change_confirm_frames: int
     hold_seconds: float
+    # окно и подтверждение по времени а не по кадрам
+    # нужно когда кадры идут с переменным шагом
+    window_seconds: Optional[float] = None
+    confirm_seconds: Optional[float] = None
 
     # внутреннее состояние для сглаживания
     stable_counts: List[int] = field(init=False)
     recent_counts: List[List[int]] = field(init=False)
+    recent_ts: List[List[float]] = field(init=False)
     pending_target: List[int] = field(init=False)
     pending_streak: List[int] = field(init=False)
+    pending_since_ts: List[float] = field(init=False)
     last_seen_nonzero_ts: List[float] = field(init=False)
     last_nonzero_count: List[int] = field(init=False)
 
@@ -26,8 +32,10 @@ class TableCountSmoother:
 
         self.stable_counts = [0] * self.n_tables
         self.recent_counts = [[] for _ in range(self.n_tables)]
+        self.recent_ts = [[] for _ in range(self.n_tables)]
         self.pending_target = [0] * self.n_tables
         self.pending_streak = [0] * self.n_tables
+        self.pending_since_ts = [0.0] * self.n_tables
         self.last_seen_nonzero_ts = [0.0] * self.n_tables
         self.last_nonzero_count = [0] * self.n_tables
 
@@ -56,11 +64,20 @@ class TableCountSmoother:
                 f"inferred_counts length mismatch: expected {self.n_tables}, got {len(inferred_counts)}"
             )
 
+        now_ts = float(now_ts)
         for idx in range(self.n_tables):
             recent = self.recent_counts[idx]
+            recent_ts = self.recent_ts[idx]
             recent.append(int(inferred_counts[idx]))
-            if len(recent) > self.smooth_window:
+            recent_ts.append(now_ts)
+            if self.window_seconds is not None:
+                # последний замер остается всегда
+                while len(recent) > 1 and now_ts - recent_ts[0] > self.window_seconds:
+                    del recent[0]
+                    del recent_ts[0]
+            elif len(recent) > self.smooth_window:
                 del recent[0]
+                del recent_ts[0]
 
             smoothed = self._mode_or_median(recent)
 
@@ -71,15 +88,20 @@ class TableCountSmoother:
                 if self.pending_target[idx] != smoothed:
                     self.pending_target[idx] = smoothed
                     self.pending_streak[idx] = 1
+                    self.pending_since_ts[idx] = now_ts
                 else:
                     self.pending_streak[idx] += 1
 
-                if self.pending_streak[idx] >= self.change_confirm_frames:
+                if self.confirm_seconds is not None:
+                    confirmed = now_ts - self.pending_since_ts[idx] >= self.confirm_seconds
+                else:
+                    confirmed = self.pending_streak[idx] >= self.change_confirm_frames
+                if confirmed:
                     self.stable_counts[idx] = smoothed
                     self.pending_streak[idx] = 0
 
             if self.stable_counts[idx] > 0:
-                self.last_seen_nonzero_ts[idx] = float(now_ts)
+                self.last_seen_nonzero_ts[idx] = now_ts
                 self.last_nonzero_count[idx] = int(self.stable_counts[idx])
 
     def current(self, now_ts: float) -> List[int]:
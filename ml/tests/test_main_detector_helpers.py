@@ -79,3 +79,533 @@ def test_table_count_smoother_confirms_changes_and_holds_after_drop_to_zero():
     # держим прошлое значение секунды
     assert smoother.current(now_ts=0.3) == [2]
     assert smoother.current(now_ts=3.5) == [0]
+
+
+def _random_scene(rng, n_rois, n_boxes, width=1280, height=720):
+    rois = []
+    for _ in range(n_rois):
+        n = int(rng.choice([2, 3, 4, 4, 5, 6]))
+        cx, cy = rng.integers(0, width), rng.integers(0, height)
+        pts = np.stack([cx + rng.integers(-90, 90, n), cy + rng.integers(-60, 60, n)], axis=1)
+        rois.append(pts.astype(np.int32))
+    boxes = []
+    for _ in range(n_boxes):
+        x1, y1 = rng.uniform(-20, width), rng.uniform(-20, height)
+        boxes.append((x1, y1, x1 + rng.uniform(0, 160), y1 + rng.uniform(0, 260)))
+    return rois, boxes
+
+
+def test_roi_matcher_matches_scalar_best_roi_on_random_scenes():
+    # векторный выбор рои как скалярный
+    from detector_utils import RoiMatcher, best_roi_for_bbox
+
+    rng = np.random.default_rng(7)
+    for _ in range(100):
+        rois, boxes = _random_scene(rng, int(rng.integers(0, 15)), int(rng.integers(0, 25)))
+        margin = float(rng.choice([0.0, 6.0, 25.0]))
+        matcher = RoiMatcher(rois, margin)
+        expected = [best_roi_for_bbox(rois, box, margin) for box in boxes]
+        assert matcher.best_rois(boxes) == expected
+
+
+def test_roi_raster_matches_matcher_and_uses_disk_cache(tmp_path):
+    # растр рои как точный выбор и кэш
+    from detector_utils import RoiMatcher
+    from roi_raster import load_or_build_roi_raster
+
+    rng = np.random.default_rng(11)
+    for _ in range(20):
+        rois, boxes = _random_scene(rng, int(rng.integers(1, 12)), 20, width=640, height=360)
+        expected = RoiMatcher(rois, 6.0).best_rois(boxes)
+        raster = load_or_build_roi_raster(rois, 640, 360, 6.0, cache_dir=str(tmp_path))
+        assert raster.best_rois(boxes) == expected
+
+    # второй запуск берет растр с диска
+    cache_dir = tmp_path / "single"
+    load_or_build_roi_raster(rois, 640, 360, 6.0, cache_dir=str(cache_dir))
+    (cached,) = list(cache_dir.iterdir())
+    before = cached.stat().st_mtime_ns
+    again = load_or_build_roi_raster(rois, 640, 360, 6.0, cache_dir=str(cache_dir))
+    assert cached.stat().st_mtime_ns == before
+    assert again.best_rois(boxes) == expected
+
+
+def _random_boxes(rng, n):
+    # кучные боксы чтобы были дубли
+    centers = rng.uniform(0, 200, size=(max(1, n // 3), 2))
+    out = []
+    for _ in range(n):
+        cx, cy = centers[rng.integers(0, len(centers))] + rng.normal(0, 6, 2)
+        w, h = rng.uniform(10, 60, 2)
+        out.append((cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2))
+    return out
+
+
+def test_dedup_array_matches_scalar_on_random_inputs():
+    # векторный дедуп как скалярный
+    from detector_utils import dedup_boxes_by_iou, dedup_boxes_by_iou_array
+
+    rng = np.random.default_rng(5)
+    for _ in range(200):
+        n = int(rng.integers(0, 30))
+        boxes = _random_boxes(rng, n)
+        # округленные скоры дают равенства
+        scores = list(np.round(rng.uniform(0, 1, n), 1))
+        thr = float(rng.choice([0.3, 0.5, 0.6, 0.9]))
+        assert dedup_boxes_by_iou_array(boxes, scores, thr) == dedup_boxes_by_iou(boxes, scores, thr)
+        assert dedup_boxes_by_iou_array(boxes, None, thr) == dedup_boxes_by_iou(boxes, None, thr)
+
+
+def test_dedup_grouped_matches_per_table_calls():
+    # дедуп всех столов одним вызовом
+    from detector_utils import dedup_boxes_by_iou, dedup_boxes_by_iou_grouped
+
+    rng = np.random.default_rng(9)
+    for _ in range(50):
+        groups = [_random_boxes(rng, int(rng.integers(0, 8))) for _ in range(int(rng.integers(1, 10)))]
+        scores = [list(np.round(rng.uniform(0, 1, len(g)), 1)) for g in groups]
+        expected = [dedup_boxes_by_iou(g, s, 0.6) if g else [] for g, s in zip(groups, scores)]
+        assert dedup_boxes_by_iou_grouped(groups, scores, 0.6) == expected
+
+
+def test_stage_queue_drops_oldest_and_drains_after_close():
+    # живая камера не копит отставание
+    import pytest
+
+    from pipeline import QueueClosed, StageQueue
+
+    q = StageQueue(2, drop_oldest=True)
+    for i in range(5):
+        assert q.put(i) is True
+    assert q.dropped == 3
+    q.close()
+    assert q.put(99) is False
+    assert [q.get(), q.get()] == [3, 4]
+    with pytest.raises(QueueClosed):
+        q.get(timeout=0.1)
+
+
+def test_pipeline_runs_stages_in_order_and_reports_stats():
+    # стадии в потоках, конец потока доходит до выхода
+    from pipeline import Pipeline, QueueClosed, StageQueue
+
+    items = iter(range(20))
+    pipeline = Pipeline()
+    q_in, q_mid, q_out = StageQueue(2), StageQueue(2), StageQueue(2)
+    pipeline.add_source("capture", lambda: next(items, None), q_in)
+    pipeline.add_stage("double", lambda x: x * 2, q_in, q_mid)
+    pipeline.add_stage("odd_only", lambda x: x + 1 if x % 4 == 0 else None, q_mid, q_out)
+    pipeline.start()
+
+    got = []
+    while True:
+        try:
+            got.append(q_out.get(timeout=2.0))
+        except QueueClosed:
+            break
+    pipeline.stop()
+
+    assert got == [x * 2 + 1 for x in range(0, 20, 2)]
+    stats = {s["stage"]: s for s in pipeline.stats()}
+    assert stats["double"]["items"] == 20
+    assert stats["capture"]["queue_depth"] is None
+    assert stats["odd_only"]["queue_max"] == 2
+    assert pipeline.error is None
+
+
+def test_occupancy_tracker_counts_tables_and_entry_crossings():
+    # стол, удержание трека и линия входа
+    from detector_utils import RoiMatcher
+    from occupancy import OccupancyTracker
+    from smoothing import TableCountSmoother
+
+    rois = [np.array([[0, 0], [100, 0], [100, 100], [0, 100]], dtype=np.int32)]
+    tracker = OccupancyTracker(
+        n_tables=1,
+        entry_line=((200, 0), (200, 300)),
+        inside_ref_point=(100, 50),
+        roi_matcher=RoiMatcher(rois, 0),
+        smoother=TableCountSmoother(n_tables=1, smooth_window=1, change_confirm_frames=1, hold_seconds=0),
+        roi_min_conf=0.3,
+        min_bbox_area_ratio=0.0,
+        dedup_iou_threshold=0.6,
+        track_table_ttl_seconds=2.0,
+    )
+
+    boxes = np.array([[20, 20, 60, 90], [21, 21, 60, 90], [300, 20, 340, 90]], dtype=float)
+    confs = np.array([0.9, 0.8, 0.2])
+    dets, status = tracker.process(boxes, np.array([1, 2, 3]), confs, (300, 400), now_ts=0.0)
+    # дубль снят, низкий скор отброшен
+    assert status == [1]
+    assert [d.table_idx for d in dets] == [0, 0]
+
+    # трек вышел за рои но держит стол по ттл
+    dets, status = tracker.process(np.array([[150, 20, 190, 90]], float), np.array([1]), None, (300, 400), now_ts=1.0)
+    assert dets[0].table_idx == 0 and status == [1]
+
+    # пересек линию наружу и обратно
+    tracker.process(np.array([[250, 20, 290, 90]], float), np.array([1]), None, (300, 400), now_ts=5.0)
+    tracker.process(np.array([[150, 20, 190, 90]], float), np.array([1]), None, (300, 400), now_ts=6.0)
+    assert tracker.inside_total == 1
+
+    # кадр без инференса сглаживание не трогает
+    _, status = tracker.process(None, None, None, (300, 400), now_ts=7.0, inferred=False)
+    assert status == [0]
+
+
+def test_load_cameras_numbers_tables_across_halls(tmp_path):
+    # столы камер подряд если не задано явно
+    import json
+    import pickle
+
+    import pytest
+
+    from multi_camera import load_cameras
+
+    square = np.array([[0, 0], [10, 0], [10, 10], [0, 10]], dtype=np.int32)
+    for name, n_tables in (("a", 3), ("b", 2)):
+        with open(tmp_path / f"{name}_tables.pkl", "wb") as f:
+            pickle.dump([square] * n_tables, f)
+        with open(tmp_path / f"{name}_entry_lines.pkl", "wb") as f:
+            pickle.dump({"line": ((0, 0), (0, 10)), "inside_ref": (5, 5)}, f)
+
+    config = tmp_path / "cameras.json"
+    config.write_text(json.dumps({"cameras": [
+        {"id": "a", "source": "0"},
+        {"id": "b", "source": "rtsp://cam/b"},
+        {"id": "c", "source": "c.mp4", "tables": "a_tables.pkl", "entry_lines": "a_entry_lines.pkl", "first_table_id": 20},
+    ]}))
+    cameras = load_cameras(str(config))
+    assert [(c.camera_id, c.first_table_id, len(c.rois)) for c in cameras] == [("a", 1, 3), ("b", 4, 2), ("c", 20, 3)]
+    assert cameras[0].source == 0
+
+    config.write_text(json.dumps({"cameras": [{"id": "a", "source": "0"}, {"id": "a", "source": "1"}]}))
+    with pytest.raises(ValueError):
+        load_cameras(str(config))
+
+
+def test_write_snapshot_replaces_jpeg_atomically(tmp_path):
+    # снимок без временного файла рядом
+    import cv2
+
+    from main_detector import write_snapshot
+
+    path = str(tmp_path / "snap.jpg")
+    image = np.full((40, 60, 3), 200, dtype=np.uint8)
+    assert write_snapshot(path, image, quality=70) is True
+    assert write_snapshot(path, image[:20], quality=70) is True
+    assert cv2.imread(path).shape == (20, 60, 3)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["snap.jpg"]
+
+
+def test_table_count_smoother_time_based_with_variable_frame_spacing():
+    # подтверждение по секундам а не по числу кадров
+    from smoothing import TableCountSmoother
+
+    smoother = TableCountSmoother(
+        n_tables=1,
+        smooth_window=1,
+        change_confirm_frames=100,
+        hold_seconds=0.0,
+        window_seconds=1.0,
+        confirm_seconds=0.5,
+    )
+    smoother.update([2], now_ts=0.0)
+    smoother.update([2], now_ts=0.2)
+    assert smoother.current(0.2) == [0]
+    # редкий кадр подтверждает сразу по времени
+    smoother.update([2], now_ts=1.5)
+    assert smoother.current(1.5) == [2]
+    # окно по времени: старые замеры ушли, мода из одного
+    smoother.update([1], now_ts=4.0)
+    assert smoother.recent_counts[0] == [1]
+    smoother.update([1], now_ts=4.6)
+    assert smoother.current(4.6) == [1]
+
+
+def test_adaptive_scheduler_backs_off_when_stable_and_resets_on_motion():
+    # в тишине реже, движение и смена статуса сразу чаще
+    from adaptive import AdaptiveInferenceScheduler
+
+    sched = AdaptiveInferenceScheduler(min_every_n=1, max_every_n=8, stable_seconds=1.0, motion_threshold=5.0)
+    still = np.full((72, 128, 3), 100, dtype=np.uint8)
+    moved = still.copy()
+    moved[:, :64] = 200
+
+    ts = 0.0
+    decisions = []
+    for _ in range(200):
+        decisions.append(sched.should_infer(still, ts))
+        sched.observe_status([1, 0], ts)
+        ts += 0.1
+    assert sched.every_n == 8
+    assert decisions[-16:].count(True) == 2
+
+    assert sched.should_infer(moved, ts) is True
+    assert sched.every_n == 1
+
+    sched.every_n = 8
+    sched.observe_status([2, 0], ts)
+    assert sched.every_n == 1
+
+
+def test_crop_layout_mosaic_roundtrip_maps_boxes_to_frame():
+    # два дальних стола в одной мозаике и обратно в кадр
+    from roi_crop import CropLayout, merge_rects
+
+    assert merge_rects([(0, 0, 10, 10), (12, 0, 20, 10), (100, 100, 110, 110)], gap=4) == [
+        (0, 0, 20, 10),
+        (100, 100, 110, 110),
+    ]
+
+    rois = [
+        np.array([[100, 100], [200, 100], [200, 160], [100, 160]], dtype=np.int32),
+        np.array([[1500, 800], [1700, 800], [1700, 900], [1500, 900]], dtype=np.int32),
+    ]
+    layout = CropLayout.build(rois, None, 1920, 1080, pad_px=10, pad_top_px=40)
+    assert len(layout.regions) == 2
+    assert layout.pixel_ratio < 0.1
+
+    frame = np.random.default_rng(0).integers(0, 255, size=(1080, 1920, 3), dtype=np.uint8)
+    mosaic = layout.compose(frame)
+    assert mosaic.shape == (layout.mosaic_height, layout.mosaic_width, 3)
+
+    # бокс у второго стола в координатах мозаики
+    (x0, y0, _, _), (px, py) = layout.regions[1], layout.placements[1]
+    assert np.array_equal(mosaic[py + 5, px + 7], frame[y0 + 5, x0 + 7])
+    box = (px + 20, py + 10, px + 60, py + 90)
+    mapped, ids, confs = layout.map_boxes(np.array([box, (-50, -50, -40, -40)], float), np.array([7, 8]), np.array([0.9, 0.8]))
+    assert mapped.tolist() == [[x0 + 20, y0 + 10, x0 + 60, y0 + 90]]
+    assert ids.tolist() == [7] and confs.tolist() == [0.9]
+
+
+def test_decode_yolo_output_undoes_letterbox_and_keeps_people():
+    # выход yolov8 в боксы кадра без onnxruntime
+    from inference import decode_yolo_output, letterbox
+
+    image = np.zeros((720, 1280, 3), dtype=np.uint8)
+    padded, scale, pad = letterbox(image, 320)
+    assert padded.shape == (320, 320, 3) and pad == (0, 70)
+
+    raw = np.zeros((1, 84, 3), dtype=np.float32)
+    raw[0, :5, 0] = [160, 160, 40, 80, 0.9]
+    raw[0, :5, 1] = [162, 161, 40, 80, 0.8]  # дубль снимает nms
+    raw[0, :4, 2] = [60, 60, 20, 20]
+    raw[0, 4 + 15, 2] = 0.95  # не человек
+    boxes, scores = decode_yolo_output(raw, conf=0.25, iou=0.7, scale=scale, pad=pad, image_shape=image.shape)
+    assert boxes.tolist() == [[560.0, 200.0, 720.0, 520.0]]
+    assert scores.tolist() == [np.float32(0.9)]
+
+
+def test_iou_tracker_keeps_ids_and_expires_old_tracks():
+    # иды для счетчика входа без трекера йоло
+    from tracker import IouTracker
+
+    tracker = IouTracker(iou_threshold=0.3, max_age_seconds=1.0)
+    ids = tracker.update([(0, 0, 10, 20), (100, 0, 110, 20)], now_ts=0.0)
+    assert ids.tolist() == [1, 2]
+    # сдвинулись и поменялись местами в списке
+    ids = tracker.update([(101, 1, 111, 21), (1, 0, 11, 20), (300, 0, 310, 20)], now_ts=0.5)
+    assert ids.tolist() == [2, 1, 3]
+    # трек 1 пропал дольше max_age
+    ids = tracker.update([(0, 0, 10, 20)], now_ts=2.0)
+    assert ids.tolist() == [4]
+    assert tracker.update(None, now_ts=2.1) is None
+
+
+def test_model_profiles_and_count_diff():
+    # профили и сравнение счетчиков с эталоном
+    import pytest
+
+    from profiles import MODEL_PROFILES, compare_counts, get_profile
+
+    assert set(MODEL_PROFILES) == {"accurate", "balanced", "fast"}
+    fast = get_profile("fast")
+    assert fast.int8 and fast.imgsz < get_profile("accurate").imgsz
+    with pytest.raises(ValueError):
+        get_profile("turbo")
+
+    diff = compare_counts([[1, 0, 2], [1, 1, 2]], [[1, 0, 2], [0, 1, 3], [5, 5, 5]])
+    assert diff["frames"] == 2
+    assert diff["max_abs_diff"] == 1
+    assert diff["frames_equal"] == 0.5
+    assert abs(diff["mean_abs_diff"] - 2 / 6) < 1e-9
+
+
+def test_occupancy_publisher_coalesces_and_retries():
+    # отправка в фоне, пока бекенд занят копится только последний статус
+    import threading
+    import time
+
+    from backend_client import OccupancyPublisher
+
+    release = threading.Event()
+    sent = []
+    codes = iter([None, 200, 200, 200])
+
+    def send(update):
+        release.wait(2.0)
+        code = next(codes)
+        sent.append((update.status_list, code))
+        return code
+
+    publisher = OccupancyPublisher("http://test", backoff_initial_seconds=0.01, send_fn=send).start()
+    publisher.publish([1, 0])
+    time.sleep(0.05)
+    # первый еще в отправке, эти два затирают друг друга
+    publisher.publish([2, 0])
+    publisher.publish([3, 0])
+    release.set()
+    deadline = time.time() + 2.0
+    while publisher.stats()["sent"] < 1 and time.time() < deadline:
+        time.sleep(0.01)
+    publisher.stop()
+
+    # неудачный [1, 0] заменен более новым, повтор уже с ним
+    assert sent == [([1, 0], None), ([3, 0], 200)]
+    st = publisher.stats()
+    assert st["coalesced"] == 1 and st["failed"] == 1 and st["retries"] == 1
+    assert st["pending"] == 0 and st["latency_ms_max"] is not None
+
+
+def test_posting_policy_sends_changes_with_gap_and_heartbeats():
+    # шлем только изменения, в тишине редкий heartbeat
+    from backend_client import PostingPolicy
+
+    policy = PostingPolicy(min_gap_seconds=1.0, heartbeat_seconds=10.0)
+    assert policy.decide([0, 1], 0.0) == "update"
+    assert policy.decide([0, 1], 0.5) is None
+    # всплеск внутри gap ждет
+    assert policy.decide([1, 1], 0.6) is None
+    assert policy.decide([2, 1], 0.9) is None
+    assert policy.decide([2, 1], 1.0) == "update"
+    assert policy.decide([2, 1], 10.9) is None
+    assert policy.decide([2, 1], 11.0) == "heartbeat"
+    assert policy.decide([2, 1], 20.9) is None
+    assert policy.decide([2, 1], 21.0) == "heartbeat"
+    assert policy.decide([2, 0], 21.1) == "update"
+
+
+def test_encode_occupancy_frame_layout():
+    # формат должен совпадать с backend/models.py
+    from backend_client import OCCUPANCY_FRAME_HEADER, encode_occupancy_frame
+
+    body = encode_occupancy_frame(
+        [0, 3, 1], seq=5, captured_ts=12.5, camera_id="hall1", first_table_id=2, inferred_ts=12.75, posted_ts=13.0
+    )
+    assert OCCUPANCY_FRAME_HEADER.size == 28
+    assert OCCUPANCY_FRAME_HEADER.unpack_from(body) == (b"OC", 2, 5, 2, 5, 12.5, 0.25, 0.5, 3)
+    assert body[28:33] == b"hall1" and list(body[33:]) == [0, 3, 1]
+    # без времен задержки пустые
+    assert np.isnan(OCCUPANCY_FRAME_HEADER.unpack_from(encode_occupancy_frame([1], seq=1, captured_ts=1.0))[6])
+
+
+def test_websocket_publisher_streams_and_resends_after_reconnect():
+    # канал: без ожидания ответа, неподтвержденное уходит заново после обрыва
+    import json
+    import queue
+    import time
+
+    from backend_client import OCCUPANCY_FRAME_HEADER, WebSocketPublisher
+
+    class FakeWs:
+        def __init__(self):
+            self.sent = []
+            self.replies = queue.Queue()
+
+        def send_binary(self, data):
+            self.sent.append(OCCUPANCY_FRAME_HEADER.unpack_from(data)[4])
+
+        def send(self, text):
+            self.sent.append(("hb", json.loads(text)["seq"]))
+
+        def recv(self):
+            reply = self.replies.get()
+            if reply is None:
+                raise ConnectionError("closed")
+            return json.dumps(reply)
+
+        def close(self):
+            self.replies.put(None)
+
+    sockets = [FakeWs(), FakeWs()]
+    connects = iter(sockets)
+
+    def wait_for(cond):
+        deadline = time.time() + 2.0
+        while not cond() and time.time() < deadline:
+            time.sleep(0.01)
+        assert cond()
+
+    publisher = WebSocketPublisher("ws://test", backoff_initial_seconds=0.01, connect_fn=lambda: next(connects)).start()
+    first, second = sockets
+    publisher.publish([1, 0])
+    publisher.heartbeat(2, camera_id="hall2")
+    wait_for(lambda: len(first.sent) == 2)
+    first.replies.put({"type": "ack", "seq": 2, "count": 2})
+    wait_for(lambda: publisher.stats()["sent"] == 1)
+
+    # обрыв до подтверждения
+    publisher.publish([2, 0])
+    wait_for(lambda: len(first.sent) == 3)
+    first.close()
+    wait_for(lambda: second.sent == [3])
+    second.replies.put({"type": "ack", "seq": 3, "count": 1})
+    wait_for(lambda: publisher.stats()["sent"] == 2)
+    publisher.stop()
+
+    assert first.sent == [1, ("hb", 2), 3]
+    st = publisher.stats()
+    assert st["connects"] == 2 and st["heartbeats"] == 1 and st["unacked"] == 0 and st["acks"] == 2
+
+
+def test_websocket_publisher_resends_two_cameras_in_seq_order():
+    # nack по одной камере и обрыв по другой: повтор идет по возрастанию seq
+    import json
+    import queue
+    import time
+
+    from backend_client import OCCUPANCY_FRAME_HEADER, WebSocketPublisher
+
+    class FakeWs:
+        def __init__(self):
+            self.sent = []
+            self.replies = queue.Queue()
+
+        def send_binary(self, data):
+            self.sent.append(OCCUPANCY_FRAME_HEADER.unpack_from(data)[4])
+
+        def recv(self):
+            reply = self.replies.get()
+            if reply is None:
+                raise ConnectionError("closed")
+            return json.dumps(reply)
+
+        def close(self):
+            self.replies.put(None)
+
+    sockets = [FakeWs(), FakeWs()]
+    connects = iter(sockets)
+
+    def wait_for(cond):
+        deadline = time.time() + 2.0
+        while not cond() and time.time() < deadline:
+            time.sleep(0.01)
+        assert cond()
+
+    publisher = WebSocketPublisher("ws://test", backoff_initial_seconds=0.3, connect_fn=lambda: next(connects)).start()
+    first, second = sockets
+    publisher.publish([1, 0], camera_id="hall1")
+    publisher.publish([0, 1], camera_id="hall2")
+    wait_for(lambda: len(first.sent) == 2)
+    # hall2 вернулся в очередь раньше, чем hall1 после обрыва
+    first.replies.put({"type": "nack", "seq": 2, "status": 503})
+    wait_for(lambda: publisher.stats()["failed"] == 1)
+    first.close()
+    wait_for(lambda: second.sent == [1, 2])
+    second.replies.put({"type": "ack", "seq": 2, "count": 2})
+    wait_for(lambda: publisher.stats()["sent"] == 2)
+    publisher.stop()
+
+    st = publisher.stats()
+    assert st["connects"] == 2 and st["unacked"] == 0 and st["pending"] == 0
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from detector_utils import iou_matrix
+
+
+class IouTracker:
+    """простая привязка идов по айоу между кадрами"""
+
+    def __init__(self, iou_threshold: float = 0.3, max_age_seconds: float = 1.5):
+        self.iou_threshold = float(iou_threshold)
+        self.max_age_seconds = float(max_age_seconds)
+        self._next_id = 1
+        # ид -> последний бокс и время
+        self._boxes: Dict[int, np.ndarray] = {}
+        self._seen_ts: Dict[int, float] = {}
+
+    def update(self, boxes, now_ts: float) -> Optional[np.ndarray]:
+        """иды в порядке боксов, новые боксы получают новые иды"""
+        for track_id in [t for t, ts in self._seen_ts.items() if now_ts - ts > self.max_age_seconds]:
+            del self._boxes[track_id]
+            del self._seen_ts[track_id]
+
+        if boxes is None:
+            return None
+        b = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        ids = np.zeros(len(b), dtype=np.int64)
+        if len(b) == 0:
+            return ids
+
+        track_ids: List[int] = list(self._boxes)
+        assigned = np.zeros(len(b), dtype=bool)
+        if track_ids:
+            prev = np.stack([self._boxes[t] for t in track_ids])
+            iou = iou_matrix(np.concatenate([prev, b]))[: len(prev), len(prev) :]
+            # жадно от лучшего совпадения
+            used_tracks = set()
+            for flat in np.argsort(-iou, axis=None, kind="stable"):
+                t_idx, d_idx = divmod(int(flat), len(b))
+                if iou[t_idx, d_idx] < self.iou_threshold:
+                    break
+                if t_idx in used_tracks or assigned[d_idx]:
+                    continue
+                used_tracks.add(t_idx)
+                assigned[d_idx] = True
+                ids[d_idx] = track_ids[t_idx]
+
+        for d_idx in np.where(~assigned)[0]:
+            ids[d_idx] = self._next_id
+            self._next_id += 1
+
+        for d_idx, track_id in enumerate(ids.tolist()):
+            self._boxes[track_id] = b[d_idx]
+            self._seen_ts[track_id] = float(now_ts)
+        return ids